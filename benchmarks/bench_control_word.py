@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Control word codec throughput.
+
+Упаковка и распаковка управляющих слов программирования кодеком
+ControlWordCodec (целые массивы NumPy) сравнивается с поэлементным
+циклом Python (как слова собирались раньше). Для каждого размера
+выводится число слов в секунду; результат кодека проверяется обратным
+декодированием.
+
+Запуск:
+    python3 benchmarks/bench_control_word.py --words 1000 1000000 10000000
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import control_word
+
+LOOP_LIMIT = 1000000 # максимальное число слов для цикла Python
+
+
+def best_time(function, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def random_fields(codec, count, rng):
+    return {name: rng.integers(0, codec.limit(name) + 1, size=count, dtype=np.int64) for name in codec.fields}
+
+
+def loop_encode(codec, fields):
+    columns = [(fields[name].tolist(), shift) for name, (shift, width) in codec.fields.items()]
+    words = []
+    for values in zip(*(column for column, shift in columns)):
+        word = 0
+        for value, (column, shift) in zip(values, columns):
+            word |= value << shift
+        words.append(word)
+    return words
+
+
+def loop_decode(codec, words):
+    return [codec.decode_word(word) for word in words]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, nargs='+', default=[1000, 1000000, 10000000], help='Numbers of words')
+    parser.add_argument('--repeats', type=int, default=3, help='Repeats per size (best time is taken)')
+    args = parser.parse_args()
+
+    codec = control_word.ControlWordCodec()
+    rng = np.random.default_rng(0)
+    print(f'{"words":>9} {"encode, w/s":>13} {"decode, w/s":>13} {"loop enc, w/s":>14} {"loop dec, w/s":>14}')
+    for count in args.words:
+        fields = random_fields(codec, count, rng)
+        words = codec.encode(verify=True, **fields)
+        encode_time = best_time(lambda: codec.encode(**fields), args.repeats)
+        decode_time = best_time(lambda: codec.decode(words), args.repeats)
+        if count <= LOOP_LIMIT:
+            if loop_encode(codec, fields) != words.tolist():
+                raise RuntimeError('Loop and codec words differ')
+            loop_encode_rate = f'{count/best_time(lambda: loop_encode(codec, fields), 1):>14.0f}'
+            loop_decode_rate = f'{count/best_time(lambda: loop_decode(codec, words), 1):>14.0f}'
+        else:
+            loop_encode_rate = loop_decode_rate = f'{"-":>14}'
+        print(f'{count:>9} {count/encode_time:>13.0f} {count/decode_time:>13.0f} {loop_encode_rate} {loop_decode_rate}')
+
+
+if __name__ == '__main__':
+    main()
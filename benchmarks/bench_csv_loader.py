@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Chunked CSV ingestion vs a single pd.read_csv.
+
+Генерируется CSV вида titanic (целые, вещественные с пропусками,
+категории и уникальные строки) заданного числа строк. Для обоих способов
+выводится время загрузки и размер итоговой таблицы в памяти.
+
+Запуск:
+    python3 benchmarks/bench_csv_loader.py --rows 100000 1000000 --chunk 100000
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import csv_loader
+
+
+def make_csv(path, rows, rng):
+    data = pd.DataFrame({'PassengerId': np.arange(1, rows + 1),
+                         'Survived': rng.integers(0, 2, rows),
+                         'Pclass': rng.integers(1, 4, rows),
+                         'Name': [f'Passenger {i}' for i in range(rows)],
+                         'Sex': rng.choice(['male', 'female'], rows),
+                         'Age': np.where(rng.random(rows) < 0.2, np.nan, rng.integers(1, 160, rows)/2),
+                         'Fare': rng.gamma(2.0, 16.0, rows).round(4),
+                         'Embarked': rng.choice(['S', 'C', 'Q'], rows)})
+    data.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000], help='Rows in generated CSV')
+    parser.add_argument('--chunk', type=int, default=csv_loader.CHUNK_SIZE, help='Rows per chunk')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f'{"rows":>9} {"MiB":>7} {"read_csv, s":>12} {"memory, MiB":>12} {"chunked, s":>11} {"memory, MiB":>12}')
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = os.path.join(directory, f'data_{rows}.csv')
+            make_csv(path, rows, rng)
+            start = time.perf_counter()
+            data = pd.read_csv(path)
+            plain_time = time.perf_counter() - start
+            plain_memory = data.memory_usage(deep=True).sum()/2**20
+            del data
+            start = time.perf_counter()
+            data, stats = csv_loader.read_csv_chunked(path, args.chunk)
+            chunked_time = time.perf_counter() - start
+            chunked_memory = data.memory_usage(deep=True).sum()/2**20
+            print(f'{rows:>9} {os.path.getsize(path)/2**20:>7.1f} {plain_time:>12.2f} {plain_memory:>12.1f} '
+                  f'{chunked_time:>11.2f} {chunked_memory:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Matrix-vector multiply throughput: crossbar vs CPU.
+
+Crossbar.mvm через сервер и эмулятор платы сравнивается с программной
+моделью reference_mvm (NumPy) на пакетах разного размера. Для каждого
+пакета выводится число векторов в секунду и ошибка относительно модели.
+
+Запуск:
+    python3 benchmarks/bench_mvm.py --geometry 4x4 --batch 1 32 256 1024
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import bench_stack
+import emulator
+import crossbar
+from memory_control import MemoryController
+
+V_MAX = 200 # максимальное входное напряжение (мВ)
+
+
+def best_time(function, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--geometry', type=str, default='4x4', help='Crossbar geometry')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 32, 256, 1024], help='Batch sizes')
+    parser.add_argument('--repeats', type=int, default=5, help='Repeats per batch (best time is taken)')
+    args = parser.parse_args()
+
+    server, thread = bench_stack.start_server(False)
+    server.board.emulator = emulator.FPGAEmulator(args.geometry, seed=0, threaded=False).start()
+    server.board.controller = MemoryController(driver=server.board.emulator)
+    client = bench_stack.connect(server.port)
+    board = crossbar.Crossbar(client, args.geometry)
+    conductance = server.board.emulator.conductance()
+    rng = np.random.default_rng(0)
+
+    print(f'{"batch":>7} {"crossbar, vec/s":>16} {"cpu, vec/s":>12} {"error":>9}')
+    for batch in args.batch:
+        vectors = rng.integers(-V_MAX, V_MAX + 1, size=(batch, board.geometry.cols))
+        currents, reference, error = board.verify_mvm(vectors, conductance)
+        crossbar_time = best_time(lambda: board.mvm(vectors), args.repeats)
+        cpu_time = best_time(lambda: crossbar.reference_mvm(conductance, vectors), args.repeats)
+        print(f'{batch:>7} {batch/crossbar_time:>16.0f} {batch/cpu_time:>12.0f} {error:>9.2e}')
+
+    client.close_connection()
+    server.stop()
+    thread.join(5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Benchmark of the wire protocol.
+
+Сравнивает пропускную способность прежнего обмена (pickle + один recv(2048))
+и кадрового протокола (заголовок длины + бинарное тело + recv_into)
+на блочном чтении разного размера через пару локальных сокетов.
+
+Запуск:
+    python3 benchmarks/bench_protocol.py --repeat 200
+'''
+
+import os
+import sys
+import time
+import pickle
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import protocol
+
+BLOCK_SIZES = (1, 16, 461, 10000, 50000) # число слов в ответе
+LEGACY_CHUNK_SIZE = 2048 # размер приема в прежнем клиенте
+
+
+def legacy_server(sock, answer):
+    '''
+    Прежний сервер: pickle на запрос и ответ
+    '''
+    reply = pickle.dumps(answer)
+    while True:
+        request = sock.recv(LEGACY_CHUNK_SIZE)
+        if not request:
+            break
+        sock.sendall(reply)
+
+
+def legacy_exchange(sock, request):
+    sock.send(pickle.dumps(request))
+    return pickle.loads(sock.recv(LEGACY_CHUNK_SIZE))
+
+
+def framed_server(sock, answer):
+    '''
+    Сервер на кадровом протоколе
+    '''
+    reader = protocol.MessageReader(sock)
+    while True:
+        try:
+            request_id, request = reader.read_message()
+        except BrokenPipeError:
+            break
+        protocol.send_message(sock, answer, request_id)
+
+
+def run_case(server, exchange, num_words, repeat):
+    '''
+    Прогнать repeat запросов блочного чтения num_words слов
+    Возвращает:
+        (elapsed, ok) - время и признак корректного приема всех ответов
+    '''
+    client_sock, server_sock = socket.socketpair()
+    answer = [(0xC0000000 + i) & 0xFFFFFFFF for i in range(num_words)]
+    thread = threading.Thread(target=server, args=(server_sock, answer), daemon=True)
+    thread.start()
+    request = [3, 0xC0004000, num_words, 4]
+    ok = True
+    start = time.perf_counter()
+    try:
+        for i in range(repeat):
+            if len(exchange(client_sock, request)) != num_words:
+                ok = False
+                break
+    except Exception:
+        ok = False
+    elapsed = time.perf_counter() - start
+    client_sock.close()
+    thread.join(timeout=1)
+    server_sock.close()
+    return elapsed, ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200, help='Requests per case')
+    args = parser.parse_args()
+
+    framed_reader = {}
+    def framed_exchange(sock, request):
+        reader = framed_reader.get(sock)
+        if reader is None:
+            reader = framed_reader[sock] = protocol.MessageReader(sock)
+        protocol.send_message(sock, request)
+        return reader.read_message()[1]
+
+    print(f'{"words":>8} {"path":>8} {"req/s":>10} {"Mword/s":>10}')
+    for num_words in BLOCK_SIZES:
+        for name, server, exchange in (('legacy', legacy_server, legacy_exchange),
+                                       ('framed', framed_server, framed_exchange)):
+            elapsed, ok = run_case(server, exchange, num_words, args.repeat)
+            if ok:
+                rate = args.repeat / elapsed
+                print(f'{num_words:>8} {name:>8} {rate:>10.0f} {rate*num_words/1e6:>10.2f}')
+            else:
+                print(f'{num_words:>8} {name:>8} {"failed (truncated reply)":>21}')
+
+
+if __name__ == '__main__':
+    main()
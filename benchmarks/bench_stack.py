@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+End-to-end benchmark of the FPGA control stack.
+
+FPGAClient -> fpga_server (loopback) -> MemoryController -> FPGAEmulator.
+Для каждого сценария и уровня параллельности (число клиентов) измеряются
+задержки p50/p99 и число операций в секунду. Результаты пишутся в JSON,
+чтобы сравнивать версии между собой.
+
+Запуск:
+    python3 benchmarks/bench_stack.py --ops 500 --concurrency 1 4 16 --output bench_stack.json
+'''
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import emulator
+import fpga_client
+import fpga_server
+from memory_control import MemoryController
+
+PROGRAM_WORD = (0 << 28) | (1 << 27) | (3 << 24) | (20 << 12) | 2000 # элемент 1, история, 3 попытки
+
+SCENARIOS = {
+    'read_word': [1, emulator.PROG_RESULT_REG],
+    'write_word': [2, emulator.PROG_RESULT_REG, 0x5A],
+    'read_block_16': [3, emulator.TEST_DATA_ADDR, 16, 4],
+    'read_block_461': [3, emulator.HISTORY_ADDR, 461, 4],
+    'wait_flag': [5, emulator.STATE_REG, 0x1, 1],
+    'test_sequence': [6, [[5, emulator.STATE_REG, 0x1, 10],
+                          [2, emulator.FIFO_ADDR, emulator.CMD_TEST],
+                          [5, emulator.FLAGS_REG, emulator.RESULT_TEST, 10],
+                          [3, emulator.TEST_DATA_ADDR, 16, 4]], True],
+    'program_sequence': [6, [[5, emulator.STATE_REG, 0x1, 10],
+                             [4, emulator.FIFO_ADDR, [emulator.CMD_PROGRAM, PROGRAM_WORD], 0],
+                             [5, emulator.FLAGS_REG, emulator.RESULT_PROGRAM, 20],
+                             [1, emulator.PROG_RESULT_REG],
+                             [3, emulator.HISTORY_ADDR, 461, 4]], True],
+}
+
+
+def start_server(threaded_emulator):
+    '''
+    Запустить сервер с эмулятором в отдельном потоке
+    '''
+    server = fpga_server.FPGAServer('127.0.0.1', 0)
+    server.board.emulator = emulator.FPGAEmulator(seed=0, threaded=threaded_emulator).start()
+    server.board.controller = MemoryController(driver=server.board.emulator)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve(),), daemon=True)
+    thread.start()
+    while server._stop is None or server.port == 0:
+        time.sleep(0.01)
+    return server, thread
+
+
+def connect(port):
+    client = fpga_client.FPGAClient()
+    client.logger.setLevel(logging.WARNING)
+    client._NAME_C_DRIVER = 'emulator'
+    client.set_host_port('127.0.0.1', port)
+    client.connect_to_server()
+    client.thread_conn.join()
+    return client
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction*len(ordered)))]
+
+
+def answer_ok(request, answer):
+    '''
+    Запрос выполнен: ответ получен и не является ошибкой, ожидание флага
+    успешно, пакет (запрос 6) выполнен целиком
+    '''
+    if not answer or answer in MemoryController.ERROR_ANSWERS:
+        return False
+    if request[0] in (5, 6):
+        return answer[0] is True
+    return True
+
+
+def run_scenario(clients, request, num_ops):
+    '''
+    Каждый клиент выполняет num_ops запросов, задержки успешных запросов
+    собираются вместе; клиент прекращает работу после первого неудачного запроса
+    Возвращает:
+        result (dict) - p50, p99 (мс), ops/s по успешным запросам, число неудачных
+    '''
+    latencies = [[] for client in clients]
+    failures = [0 for client in clients]
+    barrier = threading.Barrier(len(clients) + 1)
+
+    def worker(number, client, out):
+        barrier.wait()
+        for i in range(num_ops):
+            start = time.perf_counter()
+            answer = client.send(request)
+            latency = time.perf_counter() - start
+            if not answer_ok(request, answer):
+                failures[number] += 1
+                break
+            out.append(latency)
+
+    threads = [threading.Thread(target=worker, args=(number, client, out))
+               for number, (client, out) in enumerate(zip(clients, latencies))]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ordered = sorted(latency for out in latencies for latency in out)
+    if not ordered:
+        return {'p50_ms': None, 'p99_ms': None, 'ops_per_s': 0.0, 'ok': 0, 'failed': sum(failures)}
+    return {'p50_ms': 1e3*percentile(ordered, 0.5),
+            'p99_ms': 1e3*percentile(ordered, 0.99),
+            'ops_per_s': len(ordered)/elapsed,
+            'ok': len(ordered),
+            'failed': sum(failures)}
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ops', type=int, default=500, help='Requests per client and scenario')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Numbers of clients')
+    parser.add_argument('--scenarios', type=str, nargs='+', default=list(SCENARIOS), help='Scenarios to run')
+    parser.add_argument('--threaded-emulator', action='store_true', help='Run emulator commands in a thread')
+    parser.add_argument('--output', type=str, default=None, help='JSON file for results')
+    args = parser.parse_args()
+
+    server, thread = start_server(args.threaded_emulator)
+    results = []
+    print(f'{"scenario":>18} {"clients":>8} {"p50, ms":>9} {"p99, ms":>9} {"ops/s":>9} {"failed":>7}')
+    for concurrency in args.concurrency:
+        clients = [connect(server.port) for i in range(concurrency)]
+        for name in args.scenarios:
+            result = run_scenario(clients, SCENARIOS[name], args.ops)
+            result.update(scenario=name, clients=concurrency)
+            results.append(result)
+            if result['failed']:
+                print(f'{name:>18} {concurrency:>8} {"FAILED":>9} {"":>9} {"":>9} {result["failed"]:>7}')
+            else:
+                print(f'{name:>18} {concurrency:>8} {result["p50_ms"]:>9.3f} {result["p99_ms"]:>9.3f} '
+                      f'{result["ops_per_s"]:>9.0f} {0:>7}')
+        for client in clients:
+            client.close_connection()
+    server.stop()
+    thread.join(5)
+    failed = [f'{result["scenario"]} x{result["clients"]}' for result in results if result['failed']]
+
+    if args.output:
+        report = {'version': git_version(),
+                  'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'ops_per_client': args.ops,
+                  'threaded_emulator': args.threaded_emulator,
+                  'results': results}
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f'Results have been written to {args.output}')
+    if failed:
+        sys.exit(f'Scenarios with failed requests: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+ADC <-> resistance calibration tables.
+
+Показания платы - 12-битные коды АЦП (0..4095), поэтому перевод в
+сопротивление для каждого канала - таблица из 4096 значений. Перевод
+массивов любого размера (ячейки матрицы, история программирования,
+журналы измерений) выполняется одной выборкой по индексам.
+
+Встроенные калибровки 'first' и 'second' (geometry.CALIBRATIONS) строятся
+по tools.conv_to_resistance и tools.conv_to_resistance_second. Файл
+калибровки заменяет таблицы по именам:
+    .npz - массивы из 4096 сопротивлений (кОм), имя массива - имя калибровки;
+    .csv - столбцы из 4096 строк, имена калибровок в заголовке.
+Таблицы файла кешируются и перечитываются при изменении файла (время
+изменения и размер).
+
+Целевые значения программирования переводятся в коды, как и раньше,
+функцией tools.conv_to_voltage (одной для всех каналов). Ее обратная
+таблица - границы сопротивлений, на которых меняется код; границы
+находятся делением пополам до соседних чисел float64, поэтому выборка
+по таблице дает те же коды, что и сама функция (она монотонна). Значения
+вне диапазона таблицы переводятся функцией напрямую.
+'''
+
+import os
+
+import numpy as np
+
+import tools
+
+ADC_CODES = 4096 # число кодов 12-битного АЦП
+BUILTIN = {'first': tools.conv_to_resistance,
+           'second': tools.conv_to_resistance_second}
+
+_builtin_tables = {} # имя -> таблица встроенной калибровки
+_file_cache = {} # путь -> ((время изменения, размер), таблицы)
+_voltage_table = None # (low, high, границы, код в low, направление) для tools.conv_to_voltage
+
+
+def build_table(conversion):
+    '''
+    Таблица сопротивлений для всех кодов АЦП по функции перевода
+    '''
+    return np.array([conversion(code) for code in range(ADC_CODES)], dtype=np.float64)
+
+
+def builtin_tables():
+    if not _builtin_tables:
+        for name, conversion in BUILTIN.items():
+            _builtin_tables[name] = build_table(conversion)
+    return _builtin_tables
+
+
+def _read_file(path):
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            tables = {name: np.asarray(data[name], dtype=np.float64) for name in data.files}
+    else:
+        data = np.genfromtxt(path, delimiter=',', names=True, dtype=np.float64)
+        tables = {name: np.asarray(data[name]) for name in data.dtype.names}
+    for name, table in tables.items():
+        if table.shape != (ADC_CODES,):
+            raise ValueError(f'Calibration {name} in {path} must have {ADC_CODES} values, got {table.shape}')
+    return tables
+
+
+def load_tables(path):
+    '''
+    Таблицы калибровок файла (из кеша, если файл не изменился)
+    Возвращает:
+        tables (dict) - имя калибровки -> таблица
+        version (tuple) - время изменения и размер файла
+    '''
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_cache.get(path)
+    if cached is None or cached[0] != version:
+        cached = _file_cache[path] = (version, _read_file(path))
+    return cached[1], version
+
+
+def _bits(values):
+    return np.asarray(values, dtype=np.float64).view(np.int64)
+
+
+def _codes(conversion, values):
+    return np.array([conversion(value) for value in np.asarray(values, dtype=np.float64)], dtype=np.int64)
+
+
+def build_voltage_table(conversion, low, high):
+    '''
+    Обратная таблица монотонной функции перевода сопротивления в код на отрезке [low, high]
+    Возвращает:
+        bounds (np.ndarray) - границы: наименьшие сопротивления, с которых код
+                              изменяется на 1, 2, ... относительно кода в low
+        first (int) - код в low
+        step (int) - направление изменения кода (1 или -1)
+    '''
+    first, last = _codes(conversion, [low, high])
+    step = 1 if last >= first else -1
+    levels = np.arange(1, step*(last - first) + 1)
+    low_bits = np.full(len(levels), _bits(low)) # код еще не изменился на level
+    high_bits = np.full(len(levels), _bits(high)) # код изменился на level (или больше)
+    while True:
+        active = np.flatnonzero(high_bits - low_bits > 1)
+        if not len(active):
+            break
+        middle = low_bits[active] + (high_bits[active] - low_bits[active]) // 2
+        reached = step*(_codes(conversion, middle.view(np.float64)) - first) >= levels[active]
+        high_bits[active[reached]] = middle[reached]
+        low_bits[active[~reached]] = middle[~reached]
+    return high_bits.view(np.float64), int(first), step
+
+
+def voltage_table():
+    '''
+    Обратная таблица tools.conv_to_voltage на диапазоне встроенных калибровок (строится один раз)
+    '''
+    global _voltage_table
+    if _voltage_table is None:
+        values = np.concatenate(list(builtin_tables().values()))
+        values = values[np.isfinite(values) & (values > 0)]
+        low, high = float(values.min()), float(values.max())
+        _voltage_table = (low, high) + build_voltage_table(tools.conv_to_voltage, low, high)
+    return _voltage_table
+
+
+def to_voltage_code(resistance):
+    '''
+    Перевод сопротивлений в коды (то же, что tools.conv_to_voltage для каждого значения)
+    Принимает:
+        resistance (array) - сопротивления (кОм)
+    Возвращает:
+        codes (np.ndarray) - коды (int64) формы resistance
+    '''
+    resistance = np.asarray(resistance, dtype=np.float64)
+    low, high, bounds, first, step = voltage_table()
+    inside = (resistance >= low) & (resistance <= high)
+    codes = np.empty(resistance.shape, dtype=np.int64)
+    codes[inside] = first + step*np.searchsorted(bounds, resistance[inside], side='right')
+    if not inside.all():
+        codes[~inside] = _codes(tools.conv_to_voltage, resistance[~inside])
+    return codes
+
+
+class Calibration():
+    '''
+    Калибровка каналов кроссбара: таблица на каждый канал (строку)
+    '''
+
+    def __init__(self, geometry, path=None):
+        '''
+        Принимает:
+            geometry (CrossbarGeometry) - описание кроссбара (калибровка каналов)
+            path (str) - файл калибровки (необязательно)
+        '''
+        self.geometry = geometry
+        self.path = path
+        self._version = None
+        self._tables = None # таблицы каналов подряд: канал*ADC_CODES + код
+
+    def _check(self):
+        '''
+        Собрать таблицы каналов (заново, если файл калибровки изменился)
+        '''
+        tables = dict(builtin_tables())
+        version = None
+        if self.path is not None:
+            file_tables, version = load_tables(self.path)
+            tables.update(file_tables)
+        if self._tables is not None and version == self._version:
+            return
+        unknown = set(self.geometry.calibration) - set(tables)
+        if unknown:
+            raise ValueError(f'Unknown calibrations: {sorted(unknown)}')
+        self._tables = np.concatenate([tables[name] for name in self.geometry.calibration])
+        self._version = version
+
+    def _channels(self, shape, cells):
+        if cells is None:
+            cells = np.arange(int(np.prod(shape))).reshape(shape)
+        return np.broadcast_to(self.geometry.channel(np.asarray(cells, dtype=np.int64)), shape)
+
+    def table(self, channel):
+        '''
+        Таблица канала (4096 сопротивлений)
+        '''
+        self._check()
+        return self._tables[channel*ADC_CODES:(channel + 1)*ADC_CODES]
+
+    def to_resistance(self, codes, cells=None):
+        '''
+        Перевод кодов АЦП в сопротивления
+        Принимает:
+            codes (array) - коды АЦП
+            cells (array или int) - номера ячеек (от 0) той же формы или одна ячейка;
+                                    по умолчанию коды идут в порядке номеров ячеек
+        Возвращает:
+            resistance (np.ndarray) - сопротивления (кОм) формы codes
+        '''
+        self._check()
+        codes = np.clip(np.asarray(codes, dtype=np.int64), 0, ADC_CODES - 1)
+        return self._tables[self._channels(codes.shape, cells)*ADC_CODES + codes]
+
+    def to_code(self, resistance):
+        '''
+        Перевод целевых сопротивлений в коды управляющего слова (tools.conv_to_voltage)
+        Принимает:
+            resistance (array) - сопротивления (кОм)
+        Возвращает:
+            codes (np.ndarray) - коды (int64) формы resistance
+        '''
+        return to_voltage_code(resistance)
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Incremental column profiles of a versioned dataset.
+
+Профиль столбца: число значений, пропусков и бесконечностей, минимум,
+максимум, среднее, СКО, число различных значений и гистограмма (для
+чисел - по интервалам, для категорий - число повторений значений).
+Профили считаются один раз векторными проходами NumPy по строкам версии
+(dataset_versions.py), а при переходе к другой версии (удаление строк,
+отмена, повтор) обновляются только по изменившимся строкам: из сумм
+вычитаются удаленные строки и прибавляются вернувшиеся. Заполнение
+пропусков не меняет накопленных сумм - значение заполнения учитывается
+при выдаче профиля (k пропусков со значением v).
+
+Среднее и СКО хранятся суммами отклонений от опорного значения (среднего
+всего столбца), поэтому вычитание строк не теряет точность. Минимум и
+максимум пересчитываются по текущим строкам, только если удалено крайнее
+значение; число различных значений для столбцов с большим числом
+значений - тоже по запросу. Суммы, минимум, максимум и интервалы
+гистограммы считаются только по конечным значениям (inf и -inf из CSV
+учитываются отдельным числом infinite).
+'''
+
+import numpy as np
+import pandas as pd
+
+HISTOGRAM_BINS = 20 # число интервалов гистограммы числового столбца
+MAX_DISTINCT = 4096 # больше различных значений - счетчики значений не ведутся
+
+
+def as_mask(version):
+    return np.ones(len(version.base), dtype=bool) if version.mask is None else version.mask
+
+
+class ColumnProfile():
+    '''
+    Накопленная статистика столбца по строкам версии (без учета заполнения)
+    '''
+
+    def __init__(self, name, series, mask):
+        self.name = name
+        self.dtype = series.dtype
+        self.numeric = series.dtype.kind in 'biuf'
+        self._values = series.to_numpy() if self.numeric else None # без копирования для типов NumPy
+        self._nulls = series.isna().to_numpy()
+        self._finite = None # маска конечных значений (числовые столбцы)
+        if self.numeric:
+            self._finite = ~self._nulls & (np.isfinite(self._values) if self._values.dtype.kind == 'f' else True)
+        self._series = series
+        self._codes = None # номера значений (-1 - пропуск) для подсчета повторений
+        self._distinct = None # (маска строк, число различных значений) для столбцов без счетчиков
+        self._all_unique = False # все значения столбца различны (и в любой части строк)
+        self.labels = None
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            self._codes = series.cat.codes.to_numpy()
+            self.labels = series.cat.categories
+        else:
+            codes, labels = pd.factorize(series)
+            if len(labels) <= MAX_DISTINCT:
+                self._codes = codes.astype(np.int16)
+                self.labels = labels
+            else:
+                self._all_unique = len(labels) == np.count_nonzero(~self._nulls)
+                if mask.all():
+                    self._distinct = (mask, len(labels))
+        self._first_pass(mask)
+
+    def _first_pass(self, mask):
+        self.nulls = int(np.count_nonzero(self._nulls & mask))
+        self.count = int(np.count_nonzero(mask)) - self.nulls
+        self.infinite = 0
+        self.value_counts = None
+        if self._codes is not None:
+            codes = self._codes[mask]
+            self.value_counts = np.bincount(codes[codes >= 0], minlength=len(self.labels)).astype(np.int64)
+        self.edges = None
+        if not self.numeric:
+            return
+        # опорное значение и интервалы гистограммы - по всем строкам base,
+        # чтобы строки, возвращаемые отменой, попадали в те же интервалы
+        self.infinite = self.count - int(np.count_nonzero(self._finite & mask))
+        known = self._values[self._finite]
+        if not len(known):
+            return
+        self.reference = float(known.mean(dtype=np.float64))
+        self.edges = np.histogram_bin_edges(np.array([known.min(), known.max()], dtype=np.float64),
+                                            bins=HISTOGRAM_BINS)
+        values = self._numbers(np.flatnonzero(mask & self._finite))
+        self.sum = float((values - self.reference).sum())
+        self.sum_squares = float(((values - self.reference)**2).sum())
+        self.minimum = float(values.min()) if len(values) else None
+        self.maximum = float(values.max()) if len(values) else None
+        self._extremes_valid = True
+        self.bin_counts = np.bincount(self._bins(values), minlength=HISTOGRAM_BINS).astype(np.int64)
+
+    def _numbers(self, positions):
+        return self._values[positions].astype(np.float64)
+
+    def _bins(self, values):
+        return np.clip(np.searchsorted(self.edges, values, side='right') - 1, 0, len(self.edges) - 2)
+
+    def change(self, positions, sign):
+        '''
+        Учесть удаленные (sign=-1) или добавленные (sign=1) строки base
+        '''
+        if not len(positions):
+            return
+        nulls = self._nulls[positions]
+        null_count = int(np.count_nonzero(nulls))
+        self.nulls += sign*null_count
+        self.count += sign*(len(positions) - null_count)
+        if self._codes is not None:
+            codes = self._codes[positions]
+            self.value_counts += sign*np.bincount(codes[codes >= 0], minlength=len(self.labels))
+        if self._finite is not None:
+            finite = self._finite[positions]
+            self.infinite += sign*(len(positions) - null_count - int(np.count_nonzero(finite)))
+        if self.edges is None:
+            return
+        values = self._numbers(positions[finite])
+        if not len(values):
+            return
+        shifted = values - self.reference
+        self.sum += sign*float(shifted.sum())
+        self.sum_squares += sign*float((shifted*shifted).sum())
+        self.bin_counts += sign*np.bincount(self._bins(values), minlength=HISTOGRAM_BINS)
+        if sign < 0:
+            # удалено крайнее значение - пересчет по запросу
+            if self.minimum is None or values.min() <= self.minimum or values.max() >= self.maximum:
+                self._extremes_valid = False
+        elif self._extremes_valid:
+            self.minimum = min(self.minimum, float(values.min())) if self.minimum is not None else float(values.min())
+            self.maximum = max(self.maximum, float(values.max())) if self.maximum is not None else float(values.max())
+
+    def extremes(self, mask):
+        if not self._extremes_valid:
+            values = self._values[mask & self._finite]
+            self.minimum = float(values.min()) if len(values) else None
+            self.maximum = float(values.max()) if len(values) else None
+            self._extremes_valid = True
+        return self.minimum, self.maximum
+
+    def distinct(self, mask, fill=None):
+        '''
+        Число различных значений (с учетом значения заполнения); без счетчиков
+        значений считается по текущим строкам и запоминается до смены строк
+        '''
+        if self.value_counts is not None:
+            present = self.labels[self.value_counts > 0]
+            return len(present) + (fill is not None and self.nulls > 0 and fill not in set(present))
+        if self._all_unique:
+            unique = self.count
+        elif self._distinct is not None and self._distinct[0] is mask:
+            unique = self._distinct[1]
+        else:
+            unique = len(pd.unique(self._series[mask & ~self._nulls].to_numpy()))
+            self._distinct = (mask, unique)
+        if fill is not None and self.nulls:
+            unique += not (self._series[mask & ~self._nulls] == fill).any()
+        return unique
+
+    def report(self, mask, fill=None):
+        '''
+        Профиль столбца с учетом заполнения пропусков значением fill
+        '''
+        filled = self.nulls if fill is not None else 0
+        result = {'dtype': str(self.dtype), 'count': self.count + filled, 'nulls': self.nulls - filled,
+                  'infinite': self.infinite, 'filled': filled, 'min': None, 'max': None, 'mean': None, 'std': None,
+                  'unique': self.distinct(mask, fill)}
+        if self.edges is not None:
+            count, total, squares = self.count - self.infinite, self.sum, self.sum_squares
+            minimum, maximum = self.extremes(mask)
+            if filled:
+                shifted = float(fill) - self.reference
+                count, total, squares = count + filled, total + filled*shifted, squares + filled*shifted*shifted
+                minimum = float(fill) if minimum is None else min(minimum, float(fill))
+                maximum = float(fill) if maximum is None else max(maximum, float(fill))
+            if count:
+                variance = max(squares - total*total/count, 0.0)/(count - 1) if count > 1 else float('nan')
+                result.update(min=minimum, max=maximum, mean=self.reference + total/count,
+                              std=float(np.sqrt(variance)))
+        return result
+
+    def histogram(self, fill=None):
+        '''
+        Гистограмма: (границы интервалов, числа) для чисел, (значения, числа) для категорий
+        '''
+        filled = self.nulls if fill is not None else 0
+        if self.numeric and self.edges is not None:
+            counts = self.bin_counts.copy()
+            if filled:
+                counts[self._bins(np.array([float(fill)]))[0]] += filled
+            return self.edges, counts
+        if self.value_counts is None:
+            return None, None
+        counts = pd.Series(self.value_counts, index=self.labels)
+        if filled:
+            counts = counts.add(pd.Series({fill: filled}), fill_value=0).astype(np.int64)
+        counts = counts[counts > 0].sort_values(ascending=False)
+        return counts.index, counts.to_numpy()
+
+
+class DatasetProfiler():
+    '''
+    Профили всех столбцов, следующие за текущей версией набора данных
+    '''
+
+    def __init__(self, version):
+        '''
+        Принимает:
+            version (DatasetVersion) - версия для первого прохода
+        '''
+        self.base = version.base
+        self.version = version
+        self.mask = as_mask(version)
+        self.columns = {name: ColumnProfile(name, self.base[name], self.mask) for name in self.base.columns}
+
+    def update(self, version):
+        '''
+        Перейти к версии version: пересчет только по изменившимся строкам
+        '''
+        if version is self.version:
+            return
+        if version.base is not self.base:
+            self.__init__(version)
+            return
+        old_mask, new_mask = self.version.mask, version.mask
+        if old_mask is not new_mask:
+            old_mask, new_mask = as_mask(self.version), as_mask(version)
+            removed = np.flatnonzero(old_mask & ~new_mask)
+            added = np.flatnonzero(new_mask & ~old_mask)
+            for profile in self.columns.values():
+                profile.change(removed, -1)
+                profile.change(added, 1)
+            self.mask = new_mask
+        self.version = version
+
+    def profile(self, version=None):
+        '''
+        Профили столбцов версии
+        Возвращает:
+            profile (pd.DataFrame) - строка на столбец: dtype, count, nulls,
+                infinite, filled, min, max, mean, std, unique (min, max,
+                mean, std - по конечным значениям)
+        '''
+        if version is not None:
+            self.update(version)
+        return pd.DataFrame([self.columns[name].report(self.mask, self.version.fills.get(name))
+                             for name in self.version.columns], index=self.version.columns)
+
+    def histogram(self, name):
+        return self.columns[name].histogram(self.version.fills.get(name))
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Command executor for board operations.
+
+Операции с платой (тестирование, программирование, ...) блокируются на
+обмене с сервером и ожидании флагов, поэтому из обработчиков Tk они
+не вызываются напрямую, а ставятся в ограниченную очередь и выполняются
+по одной в рабочем потоке. Изменения состояния команд передаются в поток
+Tk через очередь, которую окно опрашивает через after(), там же
+вызываются обработчики результата:
+    executor = CommandExecutor(window)
+    executor.submit('Test matrix', main_app.test_matrix, on_done=show_results)
+
+Команды с аргументом command=True получают объект Command и могут
+сообщать прогресс (command.report) и проверять отмену (command.cancelled).
+'''
+
+import queue
+import logging
+import itertools
+import threading
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+DEFAULT_QUEUE_SIZE = 64 # максимальное число команд в очереди
+POLL_MS = 50 # период опроса событий в потоке Tk (мс)
+
+
+class CommandCancelled(Exception):
+    '''
+    Команда отменена во время выполнения
+    '''
+
+
+class Command():
+    '''
+    Команда исполнителя
+    '''
+
+    def __init__(self, number, name, function, args, kwargs, on_done=None, on_error=None):
+        self.number = number
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done # on_done(command) в потоке Tk
+        self.on_error = on_error # on_error(command) в потоке Tk
+        self.state = QUEUED
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._executor = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        '''
+        Отменить команду (выполняемая команда завершится, когда проверит отмену)
+        '''
+        self._cancel.set()
+
+    def check_cancelled(self):
+        '''
+        Прервать выполнение, если команда отменена
+        '''
+        if self.cancelled:
+            raise CommandCancelled(self.name)
+
+    def report(self, progress, message=''):
+        '''
+        Сообщить прогресс (0..1) из рабочего потока
+        '''
+        self.progress = progress
+        self.message = message
+        self._executor._post(self)
+
+    def __repr__(self):
+        return f'Command({self.number}, {self.name!r}, {self.state})'
+
+
+class CommandExecutor():
+    '''
+    Рабочий поток с ограниченной очередью команд
+    '''
+
+    def __init__(self, widget, queue_size=DEFAULT_QUEUE_SIZE, logger=None):
+        '''
+        Принимает:
+            widget (tkinter.Misc) - виджет для опроса событий через after()
+            queue_size (int) - максимальное число команд в очереди
+            logger (logging.Logger) - логгер
+        '''
+        self.widget = widget
+        self.logger = logger or logging.getLogger(__name__)
+        self.listeners = [] # listener(command) в потоке Tk при каждом изменении команды
+        self.commands = {} # номер -> команда (в очереди и выполняемая)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._events = queue.SimpleQueue()
+        self._numbers = itertools.count(1)
+        self._stopping = False # shutdown: рабочий поток завершается, не беря новых команд
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._poll_id = self.widget.after(POLL_MS, self._poll)
+
+    def submit(self, name, function, *args, on_done=None, on_error=None, command=False, **kwargs):
+        '''
+        Поставить команду в очередь
+        Принимает:
+            name (str) - название для панели очереди
+            function - выполняемая функция function(*args, **kwargs)
+            on_done, on_error - обработчики результата и ошибки (в потоке Tk)
+            command (bool) - передать в function объект Command (аргумент command)
+        Возвращает:
+            command (Command)
+        Исключения:
+            queue.Full - очередь заполнена
+        '''
+        item = Command(next(self._numbers), name, function, args, kwargs, on_done, on_error)
+        item._executor = self
+        if command:
+            item.kwargs = dict(kwargs, command=item)
+        self._queue.put_nowait(item)
+        self.commands[item.number] = item
+        self._notify(item)
+        return item
+
+    def cancel(self, number):
+        command = self.commands.get(number)
+        if command is not None:
+            command.cancel()
+
+    def cancel_all(self):
+        for command in list(self.commands.values()):
+            command.cancel()
+
+    def shutdown(self):
+        '''
+        Отменить команды и остановить рабочий поток (без ожидания выполняемой команды)
+        '''
+        self.cancel_all()
+        self._stopping = True
+        try:
+            while True:
+                self._queue.get_nowait() # отмененные команды не выполняются
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass # рабочий поток остановится по флагу _stopping после текущей команды
+        if self._poll_id is not None:
+            self.widget.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def _run(self):
+        while True:
+            command = self._queue.get()
+            if command is None or self._stopping:
+                break
+            if command.cancelled:
+                command.state = CANCELLED
+                self._post(command)
+                continue
+            command.state = RUNNING
+            self._post(command)
+            try:
+                command.result = command.function(*command.args, **command.kwargs)
+                command.state = DONE
+                command.progress = 1.0
+            except CommandCancelled:
+                command.state = CANCELLED
+            except Exception as error:
+                command.error = error
+                command.state = FAILED
+                self.logger.exception(f'Command "{command.name}" has failed')
+            self._post(command)
+
+    def _post(self, command):
+        '''
+        Передать изменение команды в поток Tk
+        '''
+        self._events.put((command, command.state))
+
+    def _poll(self):
+        '''
+        Обработка событий в потоке Tk (следующий опрос назначается и при ошибке)
+        '''
+        try:
+            while True:
+                command, state = self._events.get_nowait()
+                self._notify(command, state)
+        except queue.Empty:
+            pass
+        finally:
+            if not self._stopping: # shutdown мог быть вызван обработчиком
+                self._poll_id = self.widget.after(POLL_MS, self._poll)
+
+    def _notify(self, command, state=None):
+        state = state or command.state
+        if state in (DONE, FAILED, CANCELLED):
+            if self.commands.pop(command.number, None) is None:
+                return # о завершении уже сообщено
+            handler = command.on_done if state == DONE else command.on_error if state == FAILED else None
+            if handler is not None:
+                try:
+                    handler(command)
+                except Exception:
+                    self.logger.exception(f'Handler of command "{command.name}" has failed')
+        for listener in self.listeners:
+            try:
+                listener(command)
+            except Exception:
+                self.logger.exception(f'Listener of command "{command.name}" has failed')
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Programming control word codec.
+
+Единственное описание управляющего слова программирования для хоста
+(crossbar.py) и эмулятора платы. Массивы слов кодируются и декодируются
+целиком битовыми операциями NumPy, значения полей проверяются на
+диапазон:
+    codec = ControlWordCodec()
+    words = codec.encode(target=codes, tolerance=10, attempts=3, history=0, element=cells)
+    fields = codec.decode(words)
+
+Поля по умолчанию (от младших бит):
+    11..0 - целевое значение сопротивления, переведенное в значение АЦП;
+    23..12 - допустимое отклонение от целевого значения;
+    26..24 - максимальное количество попыток программирования;
+    27 - режим измерения "гребенки" (сохранять историю);
+    31..28 - номер программируемого элемента (от 0).
+'''
+
+import numpy as np
+
+WORD_BITS = 32
+
+FIELDS = {'target': (0, 12), # поле -> (сдвиг, ширина)
+          'tolerance': (12, 12),
+          'attempts': (24, 3),
+          'history': (27, 1),
+          'element': (28, 4)}
+
+
+class ControlWordCodec():
+    '''
+    Кодек управляющего слова: поле -> (сдвиг, ширина)
+    '''
+
+    def __init__(self, fields=None):
+        self.fields = dict(fields or FIELDS)
+        used = 0
+        for name, (shift, width) in self.fields.items():
+            mask = ((1 << width) - 1) << shift
+            if width < 1 or shift < 0 or shift + width > WORD_BITS:
+                raise ValueError(f'Field {name} does not fit the {WORD_BITS}-bit word')
+            if used & mask:
+                raise ValueError(f'Field {name} overlaps another field')
+            used |= mask
+
+    def limit(self, field):
+        '''
+        Максимальное значение поля
+        '''
+        return (1 << self.fields[field][1]) - 1
+
+    def encode(self, verify=False, **values):
+        '''
+        Упаковать слова
+        Принимает:
+            values - значения полей (массивы одной формы или числа);
+                     не заданные поля равны 0
+            verify (bool) - проверить, что слова декодируются в те же значения
+        Возвращает:
+            words (np.ndarray) - слова uint32
+        Исключения:
+            ValueError - неизвестное поле или значение вне диапазона поля
+        '''
+        unknown = set(values) - set(self.fields)
+        if unknown:
+            raise ValueError(f'Unknown control word fields: {sorted(unknown)}')
+        arrays = {name: np.asarray(value) for name, value in values.items()}
+        shape = np.broadcast_shapes(*(array.shape for array in arrays.values())) if arrays else ()
+        words = np.zeros(shape, dtype=np.uint32)
+        for name, array in arrays.items():
+            shift, width = self.fields[name]
+            if array.dtype.kind not in 'biu':
+                raise ValueError(f'Field {name} must be integer, got {array.dtype}')
+            if array.size and (array.min() < 0 or array.max() > self.limit(name)):
+                bad = array[(array < 0) | (array > self.limit(name))]
+                raise ValueError(f'Field {name} must be in 0..{self.limit(name)}, '
+                                 f'{bad.size} value(s) out of range (e.g. {bad.flat[0]})')
+            words |= array.astype(np.uint32) << np.uint32(shift)
+        if verify:
+            decoded = self.decode(words)
+            for name, array in arrays.items():
+                if not np.array_equal(np.broadcast_to(array, shape), decoded[name]):
+                    raise ValueError(f'Field {name} does not survive the encode/decode round trip')
+        return words
+
+    def decode(self, words):
+        '''
+        Распаковать слова
+        Возвращает:
+            fields (dict) - поле -> массив значений (uint32) формы words
+        '''
+        words = np.asarray(words, dtype=np.uint32)
+        return {name: (words >> np.uint32(shift)) & np.uint32((1 << width) - 1)
+                for name, (shift, width) in self.fields.items()}
+
+    def decode_word(self, word):
+        '''
+        Распаковать одно слово в числа Python (для поячеечной обработки)
+        '''
+        return {name: (int(word) >> shift) & ((1 << width) - 1) for name, (shift, width) in self.fields.items()}
@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Memristor crossbar operations over FPGAClient.
+
+Размер кроссбара, адреса регистров, калибровка каналов и формат слова
+берутся из описания geometry.CrossbarGeometry. Тестирование читает
+результаты всех ячеек одним блоком. Программирование всей матрицы
+выполняется одной задачей: управляющие слова всех ячеек упаковываются
+векторно и отправляются пакетами (запрос 6), пакеты идут подряд без
+ожидания ответов, поэтому матрица 4x4 программируется за один обмен
+с сервером, а большие матрицы - за время одного обмена плюс работа платы.
+Ответ на пакет ждется не дольше суммы ожиданий платы в нем плюс
+REPLY_TIMEOUT, поэтому обрыв соединения или зависший сервер не блокирует
+вызывающий поток.
+
+Умножение на кроссбаре (mvm): напряжения столбцов V (мВ) дают токи строк
+I = G·V (мкА при G в мСм). Векторы пакета передаются так же подряд, без
+ожидания ответов. Программная модель reference_mvm считает то же по
+заданным проводимостям ячеек и служит для проверки (verify_mvm).
+'''
+
+import time
+import logging
+from concurrent import futures as concurrent_futures
+
+import numpy as np
+
+import calibration
+import geometry as geometry_module
+
+READY_TIMEOUT = 10 # ожидание готовности ПЛИС (секунды)
+TEST_TIMEOUT = 10 # ожидание окончания тестирования (секунды)
+PROGRAM_TIMEOUT = 20 # ожидание окончания программирования ячейки (секунды)
+PROGRAM_CHUNK = 64 # число ячеек в одном пакете
+PROGRAM_PIPELINE = 2 # число пакетов программирования, отправленных без ответа
+MVM_TIMEOUT = 1 # ожидание окончания умножения (секунды)
+MVM_CHUNK = 32 # число векторов в одном пакете
+REPLY_TIMEOUT = 60 # ожидание ответа на пакет сверх суммы ожиданий платы в нем (секунды)
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+HISTORY_LENGTH = geometry_module.HISTORY_LENGTH # длина истории программирования
+
+
+class CrossbarError(Exception):
+    '''
+    Ошибка выполнения операции на кроссбаре
+    '''
+
+
+def reference_mvm(conductance, vectors):
+    '''
+    Программная модель умножения
+    Принимает:
+        conductance (2-D array) - проводимости ячеек (мСм), rows x cols
+        vectors (array) - напряжения столбцов (мВ): вектор или пакет векторов (n x cols)
+    Возвращает:
+        currents (np.ndarray) - токи строк (мкА): вектор или n x rows
+    '''
+    return np.asarray(vectors, dtype=np.float64) @ np.asarray(conductance, dtype=np.float64).T
+
+
+def wait_answer(answer):
+    '''
+    Разобрать ответ ожидания флага (запрос 5)
+    Возвращает:
+        (ready, waited) или None, если ответ - ошибка или имеет другой вид
+    '''
+    if (isinstance(answer, list) and len(answer) == 2 and isinstance(answer[0], bool)
+            and isinstance(answer[1], (int, float))):
+        return answer[0], float(answer[1])
+    return None
+
+
+def words_answer(answer, count=None):
+    '''
+    Разобрать ответ чтения count слов (запросы 1, 3, 4; None - любое число слов)
+    Возвращает:
+        words (list) или None, если ответ - ошибка или имеет другой вид
+    '''
+    if (isinstance(answer, list) and (count is None or len(answer) == count)
+            and all(type(word) is int and 0 <= word <= 0xFFFFFFFF for word in answer)):
+        return answer
+    return None
+
+
+class ProgramResult():
+    '''
+    Результат программирования матрицы
+    Атрибуты:
+        values (np.ndarray) - итоговые коды АЦП ячеек
+        resistance (np.ndarray) - итоговые сопротивления ячеек (кОм)
+        attempts (np.ndarray) - число выполненных попыток
+        ok (np.ndarray) - ячейка запрограммирована (ожидание флагов успешно)
+        done (np.ndarray) - ответ по ячейке получен
+        history (np.ndarray) - истории программирования (если запрошены)
+        cancelled (bool) - программирование прервано (не все ячейки запрограммированы)
+        elapsed (float) - полное время (секунды)
+        hardware_time (float) - суммарное время ожидания флагов на сервере (секунды)
+        round_trips (int) - число обменов с сервером
+    '''
+
+    def __init__(self, shape):
+        self.values = np.zeros(shape, dtype=np.uint32)
+        self.resistance = np.zeros(shape, dtype=np.float64)
+        self.attempts = np.zeros(shape, dtype=np.uint8)
+        self.ok = np.zeros(shape, dtype=bool)
+        self.done = np.zeros(shape, dtype=bool)
+        self.history = None
+        self.cancelled = False
+        self.elapsed = 0.0
+        self.hardware_time = 0.0
+        self.round_trips = 0
+
+    def __repr__(self):
+        return (f'ProgramResult({self.ok.sum()}/{self.ok.size} cells, '
+                f'{self.elapsed:.3f}s, {self.round_trips} round trip(s))')
+
+
+class Crossbar():
+    '''
+    Операции с кроссбаром мемристоров
+    '''
+
+    def __init__(self, fpga_client, geometry='4x4', logger=None, calibration_path=None):
+        '''
+        Принимает:
+            fpga_client (FPGAClient) - клиент сервера платы
+            geometry (CrossbarGeometry или str) - описание кроссбара
+            logger (logging.Logger) - логгер
+            calibration_path (str) - файл калибровки каналов
+        '''
+        self.fpga_client = fpga_client
+        self.geometry = geometry_module.get_geometry(geometry)
+        self.registers = self.geometry.registers
+        self.calibration = calibration.Calibration(self.geometry, calibration_path)
+        self.logger = logger or logging.getLogger(__name__)
+
+    def conv_to_resistance(self, values, cells=None):
+        '''
+        Перевод кодов АЦП в сопротивления с калибровкой канала каждой ячейки
+        Принимает:
+            values (array) - коды АЦП
+            cells (array или int) - номера ячеек (по умолчанию все ячейки по порядку)
+        '''
+        return self.calibration.to_resistance(values, cells)
+
+    def test(self):
+        '''
+        Тестирование матрицы: результаты всех ячеек читаются одним блоком
+        Возвращает:
+            values (np.ndarray) - коды АЦП ячеек (rows x cols)
+        '''
+        registers = self.registers
+        ok, results = self.fpga_client.batch([[5, registers['state'], 0x1, READY_TIMEOUT],
+                                              [2, registers['fifo'], geometry_module.CMD_TEST],
+                                              [5, registers['flags'], geometry_module.RESULT_TEST, TEST_TIMEOUT],
+                                              [3, registers['test_data'], self.geometry.cells, 4]])
+        if not ok:
+            raise CrossbarError('Matrix test has failed')
+        values = np.asarray(results[3], dtype=np.uint32)
+        if len(values) != self.geometry.cells:
+            raise CrossbarError(f'Data size is not correct ({len(values)} of {self.geometry.cells})')
+        return values.reshape(self.geometry.rows, self.geometry.cols)
+
+    def pack_program_words(self, cells, targets, tolerances, attempts, save_history=False):
+        '''
+        Упаковать управляющие слова программирования ячеек
+        Принимает:
+            cells (array) - номера ячеек (от 0)
+            targets (array) - целевые сопротивления (кОм)
+            tolerances (array или число) - допустимое отклонение (%)
+            attempts (array или число) - максимальное число попыток
+            save_history (bool) - сохранять историю программирования
+        Возвращает:
+            words (np.ndarray) - слова uint32 (кодек geometry.word_format)
+                (номер элемента - 0, если он передается отдельным словом)
+        '''
+        word_format = self.geometry.word_format
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1)
+        targets = np.asarray(targets, dtype=np.float64)
+        tolerances = np.broadcast_to(np.asarray(tolerances, dtype=np.float64), targets.shape).reshape(-1)
+        attempts = np.broadcast_to(np.asarray(attempts, dtype=np.int64), targets.shape).reshape(-1)
+        targets = targets.reshape(-1)
+        if len(targets) != len(cells):
+            raise ValueError(f'Got {len(targets)} targets for {len(cells)} cells')
+        if np.any((cells < 0) | (cells >= self.geometry.cells)):
+            raise ValueError(f'Cell numbers must be in 0..{self.geometry.cells - 1}')
+
+        target_codes = self.calibration.to_code(targets)
+        tolerance_codes = np.abs(self.calibration.to_code(targets*(1 + tolerances/100)) - target_codes)
+        if np.any((target_codes < 0) | (target_codes > word_format.limit('target'))):
+            raise ValueError('Target resistance is out of the ADC range')
+        if np.any(attempts < 1) or np.any(attempts > word_format.limit('attempts')):
+            raise ValueError(f'Number of attempts must be in 1..{word_format.limit("attempts")}')
+        tolerance_codes = np.minimum(tolerance_codes, word_format.limit('tolerance'))
+        elements = cells if self.geometry.program_command == geometry_module.CMD_PROGRAM else np.zeros_like(cells)
+
+        return word_format.encode(target=target_codes, tolerance=tolerance_codes, attempts=attempts,
+                                  history=int(bool(save_history)), element=elements)
+
+    def _program_ops(self, cell, word, save_history):
+        '''
+        Операции программирования одной ячейки для пакетного запроса
+        '''
+        registers = self.registers
+        command = self.geometry.program_command
+        fifo_words = [command, int(word)] if command == geometry_module.CMD_PROGRAM else [command, int(cell), int(word)]
+        ops = [[5, registers['state'], 0x1, READY_TIMEOUT],
+               [4, registers['fifo'], fifo_words, 0],
+               [5, registers['flags'], geometry_module.RESULT_PROGRAM, PROGRAM_TIMEOUT],
+               [1, registers['prog_result']],
+               [1, registers['prog_attempts']]]
+        if save_history:
+            ops.append([3, registers['history'], HISTORY_LENGTH, 4])
+        return ops
+
+    def program_cells(self, cells, targets, tolerances, attempts, save_history=False, progress=None, cancelled=None):
+        '''
+        Запрограммировать ячейки
+        Принимает:
+            cells (array) - номера ячеек (от 0)
+            targets (array) - целевые сопротивления (кОм), форма задает форму результата
+            tolerances (array или число) - допустимое отклонение (%)
+            attempts (array или число) - максимальное число попыток
+            save_history (bool) - сохранять истории программирования
+            progress - progress(доля, сообщение) после каждого пакета
+            cancelled - cancelled() -> True, если новые пакеты отправлять не нужно
+        Возвращает:
+            result (ProgramResult), result.cancelled - программирование прервано
+        '''
+        start = time.perf_counter()
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1)
+        targets = np.asarray(targets, dtype=np.float64)
+        words = self.pack_program_words(cells, targets, tolerances, attempts, save_history)
+        result = ProgramResult(targets.shape)
+        if save_history:
+            result.history = np.zeros(targets.shape + (HISTORY_LENGTH,), dtype=np.uint32)
+        step = len(self._program_ops(0, 0, save_history))
+
+        # пакеты идут подряд, без ожидания ответа на предыдущие, но не более
+        # PROGRAM_PIPELINE сразу, чтобы программирование можно было прервать
+        chunks = [range(first, min(first + PROGRAM_CHUNK, len(words))) for first in range(0, len(words), PROGRAM_CHUNK)]
+        in_flight = []
+        for chunk in chunks:
+            if cancelled is not None and cancelled():
+                result.cancelled = True
+                break
+            ops = []
+            for i in chunk:
+                ops += self._program_ops(cells[i], words[i], save_history)
+            in_flight += zip([(chunk, ops)], self.fpga_client.submit_many([[6, ops, False]]))
+            result.round_trips += 1
+            while len(in_flight) >= PROGRAM_PIPELINE or (in_flight and chunk is chunks[-1]):
+                done = self._collect_programmed(in_flight.pop(0), step, result)
+                if progress is not None:
+                    progress(done/len(words), f'{done}/{len(words)}')
+        for item in in_flight:
+            self._collect_programmed(item, step, result)
+
+        result.resistance[...] = self.conv_to_resistance(result.values, cells.reshape(targets.shape))
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _batch_result(self, future, ops):
+        '''
+        Ответ на пакетный запрос с ограниченным ожиданием: все ожидания платы
+        в пакете (запросы 5) плюс REPLY_TIMEOUT
+        Исключения:
+            concurrent.futures.TimeoutError - ответа нет (запрос забывается клиентом)
+        '''
+        timeout = sum(op[3] for op in ops if op[0] == 5) + REPLY_TIMEOUT
+        try:
+            return future.result(timeout)
+        except concurrent_futures.TimeoutError:
+            self.fpga_client.forget(future)
+            raise
+
+    def _collect_programmed(self, item, step, result):
+        '''
+        Разобрать ответ на пакет программирования
+        Возвращает:
+            done (int) - число ячеек до конца пакета
+        '''
+        (chunk, ops), future = item
+        values = result.values.reshape(-1)
+        cell_attempts = result.attempts.reshape(-1)
+        ok = result.ok.reshape(-1)
+        done = result.done.reshape(-1)
+        try:
+            chunk_ok, answers = self._batch_result(future, ops)
+        except concurrent_futures.TimeoutError:
+            self.logger.warning('No reply to the programming batch in time!')
+            return chunk.stop
+        except (OSError, ValueError, TypeError):
+            self.logger.warning('Programming batch has failed!')
+            return chunk.stop
+        if not isinstance(answers, list):
+            self.logger.warning(f'Programming batch has returned {answers!r}!')
+            return chunk.stop
+        for n, i in enumerate(chunk):
+            answer = answers[n*step:(n + 1)*step]
+            if len(answer) < step:
+                continue
+            done[i] = True
+            ready, program_done = wait_answer(answer[0]), wait_answer(answer[2])
+            value, attempts = words_answer(answer[3], 1), words_answer(answer[4], 1)
+            history = words_answer(answer[5], HISTORY_LENGTH) if result.history is not None else []
+            fifo = words_answer(answer[1])
+            if any(part is None for part in (ready, fifo, program_done, value, attempts, history)):
+                # ошибка на сервере: ячейка считается незапрограммированной
+                ok[i] = False
+                self.logger.warning(f'Cell {i} has not been programmed: {answer!r}')
+                continue
+            ok[i] = ready[0] and program_done[0]
+            result.hardware_time += ready[1] + program_done[1]
+            values[i] = value[0]
+            cell_attempts[i] = min(attempts[0], np.iinfo(cell_attempts.dtype).max)
+            if result.history is not None:
+                result.history.reshape(-1, HISTORY_LENGTH)[i] = history
+        return chunk.stop
+
+    def program_matrix(self, targets, tolerances, attempts, save_history=False, progress=None, cancelled=None):
+        '''
+        Запрограммировать всю матрицу
+        Принимает:
+            targets (2-D array) - целевые сопротивления (кОм), rows x cols
+            tolerances (array или число) - допустимое отклонение (%)
+            attempts (array или число) - максимальное число попыток
+            save_history (bool) - сохранять истории программирования
+            progress, cancelled - см. program_cells
+        Возвращает:
+            result (ProgramResult)
+        '''
+        targets = np.asarray(targets, dtype=np.float64)
+        shape = (self.geometry.rows, self.geometry.cols)
+        if targets.shape != shape:
+            raise ValueError(f'Targets must be {shape[0]}x{shape[1]}, got {targets.shape}')
+        result = self.program_cells(np.arange(self.geometry.cells), targets, tolerances, attempts, save_history,
+                                    progress, cancelled)
+        self.logger.info(f'Matrix has been programmed: {result}')
+        return result
+
+    def conductance(self):
+        '''
+        Проводимости ячеек по результатам тестирования (мСм, rows x cols)
+        '''
+        return 1/self.conv_to_resistance(self.test())
+
+    def _mvm_ops(self, words):
+        '''
+        Операции умножения на один вектор для пакетного запроса
+        '''
+        registers = self.registers
+        return [[5, registers['state'], 0x1, READY_TIMEOUT],
+                [4, registers['mvm_input'], words, 4],
+                [2, registers['fifo'], geometry_module.CMD_MVM],
+                [5, registers['flags'], geometry_module.RESULT_MVM, MVM_TIMEOUT],
+                [3, registers['mvm_output'], self.geometry.rows, 4]]
+
+    def mvm(self, vectors):
+        '''
+        Умножение матрицы проводимостей кроссбара на векторы напряжений
+        Принимает:
+            vectors (array) - напряжения столбцов (мВ): вектор из cols значений
+                              или пакет векторов n x cols
+        Возвращает:
+            currents (np.ndarray) - токи строк (мкА): вектор или n x rows
+        '''
+        vectors = np.asarray(vectors, dtype=np.float64)
+        single = vectors.ndim == 1
+        vectors = np.atleast_2d(vectors)
+        if vectors.ndim != 2 or vectors.shape[1] != self.geometry.cols:
+            raise ValueError(f'Vectors must have {self.geometry.cols} values, got shape {vectors.shape}')
+        words = np.rint(vectors)
+        if np.any((words < INT32_MIN) | (words > INT32_MAX)):
+            raise ValueError('Input voltages are out of the int32 range')
+        words = words.astype(np.int64)
+
+        # все пакеты отправляются подряд, ответы собираются после
+        step = 5
+        chunks = [range(first, min(first + MVM_CHUNK, len(words))) for first in range(0, len(words), MVM_CHUNK)]
+        requests = []
+        for chunk in chunks:
+            ops = []
+            for i in chunk:
+                ops += self._mvm_ops(words[i].tolist())
+            requests.append([6, ops, True])
+        futures = self.fpga_client.submit_many(requests)
+
+        currents = np.zeros((len(words), self.geometry.rows), dtype=np.float64)
+        for chunk, request, future in zip(chunks, requests, futures):
+            try:
+                ok, answers = self._batch_result(future, request[1])
+            except concurrent_futures.TimeoutError:
+                raise CrossbarError('No reply to the matrix-vector multiply in time')
+            except (OSError, ValueError) as error:
+                raise CrossbarError(f'Matrix-vector multiply has failed: {error}')
+            if not ok or len(answers) != step*len(chunk):
+                raise CrossbarError('Matrix-vector multiply has failed')
+            for n, i in enumerate(chunk):
+                currents[i] = np.asarray(answers[n*step + 4], dtype=np.uint32).view(np.int32)
+        currents /= 1e3 # нА -> мкА
+        return currents[0] if single else currents
+
+    def verify_mvm(self, vectors, conductance):
+        '''
+        Сравнение умножения на кроссбаре с программной моделью
+        Принимает:
+            vectors (array) - напряжения столбцов (мВ)
+            conductance (2-D array) - проводимости для модели (мСм) в том же масштабе,
+                что и у платы (для эмулятора - FPGAEmulator.conductance());
+                проводимости по калибровке (conductance) в общем случае другие
+        Возвращает:
+            currents, reference (np.ndarray) - токи кроссбара и модели (мкА)
+            error (float) - максимальная ошибка относительно максимального тока модели
+        '''
+        currents = self.mvm(vectors)
+        reference = reference_mvm(conductance, vectors)
+        scale = np.max(np.abs(reference))
+        error = float(np.max(np.abs(currents - reference))/scale) if scale > 0 else 0.0
+        return currents, reference, error
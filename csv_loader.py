@@ -0,0 +1,319 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Chunked CSV ingestion with dtype downcasting.
+
+CSV читается частями по chunk_size строк (pd.read_csv(chunksize=...)),
+поэтому текстовый разбор всего файла в памяти не нужен. Каждая часть
+сразу уменьшается:
+    целые - наименьший подходящий тип (int8 ... int64, uint8 ...);
+    вещественные - float32, если значения представимы без потерь;
+    строки с небольшим числом различных значений (Sex, Embarked, ...) -
+        category, иначе остаются строками.
+Части склеиваются один раз в конце: категории объединяются, числовые
+столбцы приводятся к общему типу всех частей (np.result_type), а
+столбцы, числовые в одних частях и строковые в других, читаются заново
+строками, как их разбирает pd.read_csv по всему файлу.
+
+Ограничена только память разбора (одна часть): уменьшенные части всей
+таблицы хранятся до конца чтения. Склейка идет по столбцам, части
+столбца освобождаются сразу, поэтому пиковая память - уменьшенная
+таблица плюс один склеиваемый столбец (или одна разбираемая часть).
+Статистика по столбцам (CsvStats) считается по ходу чтения:
+    df, stats = read_csv_chunked('train.csv', progress=print)
+    print(stats.summary())
+'''
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 100000 # строк в части
+CATEGORY_RATIO = 0.5 # строки -> category, если различных значений не больше этой доли
+MAX_CATEGORIES = 4096 # больше различных значений - столбец остается строковым
+TOP_VALUES = 5 # число самых частых значений в статистике категорий
+
+
+def downcast_numeric(series):
+    '''
+    Наименьший тип для числового столбца (вещественные - только без потерь)
+    '''
+    kind = series.dtype.kind
+    if kind in 'iu':
+        unsigned = series.size and series.min() >= 0
+        narrow = pd.to_numeric(series, downcast='unsigned' if unsigned else 'integer')
+        # uint64 вместо int64 не экономит память, а при склейке с int64 дает float64
+        return series if narrow.dtype.itemsize == series.dtype.itemsize else narrow
+    if kind == 'f' and series.dtype.itemsize > 4:
+        values = series.to_numpy()
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(values.dtype), values, equal_nan=True):
+            return pd.Series(narrow, index=series.index, name=series.name)
+    return series
+
+
+def is_text(series):
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def value_kind(series):
+    '''
+    Вид значений части столбца: 'text', 'bool', 'number' или None (одни пропуски)
+    '''
+    if not series.count():
+        return None
+    if is_text(series) or isinstance(series.dtype, pd.CategoricalDtype):
+        return 'text'
+    return 'bool' if series.dtype.kind == 'b' else 'number'
+
+
+class ColumnStats():
+    '''
+    Статистика столбца, накапливаемая по частям
+    Атрибуты:
+        count, nulls (int) - число заполненных и пустых значений
+        minimum, maximum, mean, std - для числовых столбцов
+        values (pd.Series) - число повторений значений (для категорий)
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.dtype = None
+        self.count = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.mean = 0.0
+        self._m2 = 0.0 # сумма квадратов отклонений (метод Уэлфорда)
+        self.values = None
+
+    @property
+    def std(self):
+        return float(np.sqrt(self._m2/(self.count - 1))) if self.count > 1 else float('nan')
+
+    def update(self, series):
+        values = series.dropna()
+        self.dtype = series.dtype
+        self.count += len(values)
+        self.nulls += len(series) - len(values)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            counts = values.value_counts()
+            self.values = counts if self.values is None else self.values.add(counts, fill_value=0)
+            return
+        self.values = None # столбец перестал быть категорией
+        if series.dtype.kind in 'biuf' and len(values):
+            numbers = values.to_numpy(dtype=np.float64)
+            self.minimum = numbers.min() if self.minimum is None else min(self.minimum, numbers.min())
+            self.maximum = numbers.max() if self.maximum is None else max(self.maximum, numbers.max())
+            # объединение среднего и суммы квадратов отклонений двух выборок
+            count, mean = len(numbers), numbers.mean()
+            total = self.count
+            delta = mean - self.mean
+            self._m2 += ((numbers - mean)**2).sum() + delta*delta*count*(total - count)/total
+            self.mean += delta*count/total
+
+    def to_dict(self):
+        result = {'dtype': str(self.dtype), 'count': self.count, 'nulls': self.nulls}
+        if self.minimum is not None:
+            result.update(min=self.minimum, max=self.maximum, mean=self.mean, std=self.std)
+        if self.values is not None:
+            counts = self.values[self.values > 0].sort_values(ascending=False)
+            result.update(unique=len(counts), top=dict(counts.head(TOP_VALUES).astype(np.int64)))
+        return result
+
+
+class CsvStats():
+    '''
+    Статистика загрузки CSV
+    Атрибуты:
+        rows, chunks (int) - число строк и частей
+        bytes_read (int) - прочитано байт файла
+        elapsed (float) - время загрузки (секунды)
+        columns (dict) - имя столбца -> ColumnStats
+        memory (int) - размер итоговой таблицы без содержимого строк (байт)
+        cached (bool) - таблица загружена из кеша (dataset_cache.py)
+    '''
+
+    def __init__(self):
+        self.rows = 0
+        self.chunks = 0
+        self.bytes_read = 0
+        self.elapsed = 0.0
+        self.memory = 0
+        self.cached = False
+        self.columns = {}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        self.chunks += 1
+        for name in chunk.columns:
+            self.columns.setdefault(name, ColumnStats(name)).update(chunk[name])
+        return self
+
+    def summary(self):
+        '''
+        Таблица статистики: строка на столбец CSV
+        '''
+        return pd.DataFrame({name: column.to_dict() for name, column in self.columns.items()}).T
+
+    def __repr__(self):
+        return (f'CsvStats({self.rows} rows x {len(self.columns)} columns, {self.chunks} chunk(s), '
+                f'{self.memory/2**20:.1f} MiB, {self.elapsed:.2f}s{", cache" if self.cached else ""})')
+
+
+class ChunkedCsvReader():
+    '''
+    Чтение CSV частями с уменьшением типов
+    '''
+
+    def __init__(self, chunk_size=CHUNK_SIZE, category_ratio=CATEGORY_RATIO, max_categories=MAX_CATEGORIES,
+                 **read_options):
+        '''
+        Принимает:
+            chunk_size (int) - строк в части
+            category_ratio (float) - предельная доля различных значений для category
+            max_categories (int) - предельное число различных значений для category
+            read_options - дополнительные аргументы pd.read_csv (sep, usecols, ...)
+        '''
+        self.chunk_size = chunk_size
+        self.category_ratio = category_ratio
+        self.max_categories = max_categories
+        self.read_options = read_options
+
+    def _categorical(self, name, series):
+        '''
+        Решение о category принимается по первой части со значениями столбца
+        '''
+        if name not in self._categorical_columns:
+            count = series.count()
+            if not count:
+                return False
+            unique = series.nunique()
+            self._categorical_columns[name] = unique <= self.category_ratio*count and unique <= self.max_categories
+        return self._categorical_columns[name]
+
+    def _convert(self, chunk):
+        for name in chunk.columns:
+            kind = value_kind(chunk[name])
+            if kind is not None:
+                self._kinds.setdefault(name, set()).add(kind)
+            chunk[name] = self._convert_column(name, chunk[name])
+        return chunk
+
+    def _convert_column(self, name, series):
+        if is_text(series):
+            if self._categorical(name, series):
+                series = series.astype('category')
+                categories = self._categories.setdefault(name, set())
+                categories.update(series.cat.categories)
+                if len(categories) > self.max_categories:
+                    self._demote(name)
+                    series = series.astype(object)
+            elif name in self._categories:
+                series = series.astype(object)
+        elif series.dtype.kind in 'iuf':
+            series = downcast_numeric(series)
+        return series
+
+    def _demote(self, name):
+        '''
+        Слишком много различных значений: столбец становится строковым во всех частях
+        '''
+        self._categorical_columns[name] = False
+        for chunk in self._chunks:
+            chunk[name] = chunk[name].astype(object)
+
+    def _reread_text(self, path, names, stats):
+        '''
+        Столбцы, числовые в одних частях и строковые в других, читаются заново
+        строками (как их разбирает pd.read_csv по всему файлу), статистика по
+        ним считается заново
+        '''
+        options = dict(self.read_options, chunksize=self.chunk_size)
+        dtype = options.get('dtype')
+        options['dtype'] = {**(dtype if isinstance(dtype, dict) else {}), **{name: str for name in names}}
+        if 'index_col' not in options:
+            options['usecols'] = names
+        for name in names:
+            self._categorical_columns.pop(name, None)
+            self._categories.pop(name, None)
+            stats.columns[name] = ColumnStats(name)
+        with open(path, 'rb') as csv_file:
+            for chunk, text in zip(self._chunks, pd.read_csv(csv_file, **options)):
+                for name in names:
+                    series = self._convert_column(name, text[name].set_axis(chunk.index))
+                    stats.columns[name].update(series)
+                    chunk[name] = series
+
+    def _combine(self):
+        if not self._chunks:
+            return pd.DataFrame()
+        for name in self._chunks[0].columns:
+            # один тип числового столбца для всех частей (по правилам NumPy, без потерь)
+            dtypes = [chunk[name].dtype for chunk in self._chunks]
+            if all(isinstance(dtype, np.dtype) and dtype.kind in 'iuf' for dtype in dtypes):
+                target = np.result_type(*dtypes)
+                for chunk in self._chunks:
+                    if chunk[name].dtype != target:
+                        chunk[name] = chunk[name].astype(target)
+        for name, categories in self._categories.items():
+            if not self._categorical_columns.get(name):
+                continue
+            categories = pd.Index(sorted(categories))
+            for chunk in self._chunks:
+                chunk[name] = chunk[name].astype(pd.CategoricalDtype(categories))
+        if len(self._chunks) == 1:
+            data, self._chunks = self._chunks[0], []
+            return data
+        # склейка по столбцам: части столбца освобождаются сразу после склейки,
+        # поэтому сверх итоговой таблицы нужна память одного столбца
+        columns = {}
+        for name in list(self._chunks[0].columns):
+            parts = [chunk.pop(name) for chunk in self._chunks]
+            columns[name] = pd.concat(parts, ignore_index=True)
+            del parts
+        self._chunks = []
+        return pd.DataFrame(columns, copy=False)
+
+    def read(self, path, progress=None):
+        '''
+        Загрузить CSV
+        Принимает:
+            path (str) - путь к файлу
+            progress - progress(доля, сообщение) после каждой части
+        Возвращает:
+            data (pd.DataFrame) - таблица
+            stats (CsvStats) - статистика столбцов и загрузки
+        '''
+        start = time.perf_counter()
+        size = os.path.getsize(path)
+        stats = CsvStats()
+        self._chunks = []
+        self._categorical_columns = {}
+        self._categories = {}
+        self._kinds = {} # столбец -> виды значений по частям
+        with open(path, 'rb') as csv_file:
+            for chunk in pd.read_csv(csv_file, chunksize=self.chunk_size, **self.read_options):
+                chunk = self._convert(chunk)
+                stats.update(chunk)
+                self._chunks.append(chunk)
+                stats.bytes_read = csv_file.tell()
+                if progress is not None:
+                    progress(stats.bytes_read/size if size else 1.0, f'{stats.rows} rows')
+        mixed = [name for name, kinds in self._kinds.items() if len(kinds) > 1]
+        if mixed:
+            self._reread_text(path, mixed, stats)
+        data = self._combine()
+        stats.memory = int(data.memory_usage().sum())
+        stats.elapsed = time.perf_counter() - start
+        return data, stats
+
+
+def read_csv_chunked(path, chunk_size=CHUNK_SIZE, progress=None, **read_options):
+    '''
+    Загрузить CSV частями (см. ChunkedCsvReader.read)
+    '''
+    return ChunkedCsvReader(chunk_size, **read_options).read(path, progress)
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Columnar on-disk cache of parsed CSV datasets.
+
+Разобранная таблица сохраняется в каталоге кеша пользователя
+($XDG_CACHE_HOME/nnwizard, по умолчанию ~/.cache/nnwizard), а не рядом
+с данными. Каталог задается переменной окружения NNW_CACHE (путь или
+'off' - кеш выключен) или аргументом DatasetCache. На каждый файл -
+свой каталог:
+    schema.json - источник (путь, размер, время изменения, хеш
+        содержимого), версия pandas и схема столбцов;
+    colN.npy - числовые столбцы и коды категорий (категории - в схеме);
+    colN.txt, colN.mask.npy - строковые столбцы (значения через '\\0')
+        и маска пропусков.
+Повторное открытие отображает .npy в память (np.load(mmap_mode='c'),
+копия при записи), текст заново не разбирается. Запись считается
+актуальной, если совпадают размер и время изменения файла; при другом
+времени изменения сравнивается хеш содержимого. Устаревшие записи
+удаляются. Размер каталога (общий для всех файлов) ограничен, при
+превышении удаляются давно не использовавшиеся записи (время изменения
+schema.json).
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+CACHE_DIRECTORY = 'nnwizard' # каталог в кеше пользователя
+CACHE_ENV = 'NNW_CACHE' # переменная окружения: каталог кеша или 'off'
+CACHE_OFF = 'off' # значение CACHE_ENV, выключающее кеш
+SCHEMA_FILE = 'schema.json'
+MAX_CACHE_BYTES = 2*2**30 # предельный размер каталога кеша (байт)
+HASH_BLOCK = 4*2**20 # размер блока при хешировании файла (байт)
+SEPARATOR = '\0' # разделитель строковых значений
+
+
+def file_hash(path):
+    '''
+    Хеш содержимого файла (BLAKE2b, 128 бит)
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def default_directory():
+    '''
+    Каталог кеша по умолчанию (из NNW_CACHE или в кеше пользователя); None - кеш выключен
+    '''
+    directory = os.environ.get(CACHE_ENV, '').strip()
+    if directory.lower() == CACHE_OFF:
+        return None
+    if directory:
+        return os.path.abspath(os.path.expanduser(directory))
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, CACHE_DIRECTORY)
+
+
+def directory_size(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+class DatasetCache():
+    '''
+    Кеш разобранных CSV в столбцовом двоичном формате
+    '''
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, directory=None, enabled=True, logger=None):
+        '''
+        Принимает:
+            max_bytes (int) - предельный размер каталога кеша (байт)
+            directory (str) - каталог кеша или None (default_directory)
+            enabled (bool) - кеш включен (False - get и put ничего не делают)
+            logger (logging.Logger) - логгер
+        '''
+        self.max_bytes = max_bytes
+        self.directory = default_directory() if directory is None else directory
+        self.enabled = enabled and self.directory is not None
+        self.logger = logger or logging.getLogger(__name__)
+
+    def entry_path(self, source):
+        '''
+        Каталог записи файла source
+        '''
+        source = os.path.abspath(source)
+        key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f'{os.path.basename(source)}-{key}')
+
+    # ----- Чтение
+
+    def _fresh(self, entry, schema, source):
+        '''
+        Запись соответствует файлу (при другом времени изменения - по хешу)
+        '''
+        stat = os.stat(source)
+        if (schema.get('version') != CACHE_VERSION or schema.get('pandas') != pd.__version__
+                or schema['source']['size'] != stat.st_size):
+            return False
+        if schema['source']['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if schema['source']['hash'] != file_hash(source):
+            return False
+        schema['source']['mtime_ns'] = stat.st_mtime_ns # файл тот же, запоминается новое время
+        self._write_schema(entry, schema)
+        return True
+
+    def get(self, source):
+        '''
+        Таблица из кеша
+        Принимает:
+            source (str) - путь к исходному файлу
+        Возвращает:
+            data (pd.DataFrame) - таблица или None, если актуальной записи нет
+        '''
+        if not self.enabled:
+            return None
+        entry = self.entry_path(source)
+        schema_path = os.path.join(entry, SCHEMA_FILE)
+        if not os.path.exists(schema_path):
+            return None
+        try:
+            with open(schema_path, 'r') as schema_file:
+                schema = json.load(schema_file)
+            if not self._fresh(entry, schema, source):
+                self.logger.info(f'Cache entry of {source} is stale')
+                shutil.rmtree(entry, ignore_errors=True)
+                return None
+            data = self._read(entry, schema)
+        except (OSError, ValueError, KeyError) as error:
+            self.logger.warning(f'Cache entry of {source} is broken and will be removed: {error}')
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        os.utime(schema_path) # отметка использования для вытеснения
+        return data
+
+    def _read(self, entry, schema):
+        columns = {}
+        for number, column in enumerate(schema['columns']):
+            path = os.path.join(entry, f'col{number}')
+            if column['kind'] == 'text':
+                with open(path + '.txt', 'r', encoding='utf-8', newline='') as text_file:
+                    text = text_file.read()
+                values = np.array(text.split(SEPARATOR) if schema['rows'] else [], dtype=object)
+                if len(values) != schema['rows']:
+                    raise ValueError(f'Column {column["name"]} has {len(values)} values')
+                values[np.load(path + '.mask.npy')] = None
+                columns[column['name']] = pd.Series(values, dtype=column['dtype'], copy=False)
+                continue
+            values = np.asarray(np.load(path + '.npy', mmap_mode='c')) # представление без подкласса memmap
+            if len(values) != schema['rows']:
+                raise ValueError(f'Column {column["name"]} has {len(values)} values')
+            if column['kind'] == 'category':
+                values = pd.Categorical.from_codes(values, categories=pd.Index(column['categories']),
+                                                   ordered=column['ordered'])
+            columns[column['name']] = pd.Series(values, copy=False)
+        return pd.DataFrame(columns, copy=False)
+
+    # ----- Запись
+
+    def put(self, source, data):
+        '''
+        Сохранить таблицу, разобранную из файла source
+        Возвращает:
+            stored (bool) - таблица сохранена (столбцы неподдерживаемых типов не сохраняются)
+        '''
+        if not self.enabled:
+            return False
+        if not isinstance(data.index, pd.RangeIndex) or data.index.start != 0 or data.index.step != 1:
+            self.logger.info(f'{source} is not cached: only tables with a default index are supported')
+            return False
+        if not data.columns.is_unique:
+            self.logger.info(f'{source} is not cached: column names are not unique')
+            return False
+        stat = os.stat(source)
+        entry = self.entry_path(source)
+        temporary = f'{entry}.tmp{os.getpid()}'
+        try:
+            os.makedirs(temporary, exist_ok=True)
+            columns = [self._write_column(os.path.join(temporary, f'col{number}'), name, data[name])
+                       for number, name in enumerate(data.columns)]
+            schema = {'version': CACHE_VERSION, 'pandas': pd.__version__, 'rows': len(data), 'columns': columns,
+                      'source': {'path': os.path.abspath(source), 'size': stat.st_size,
+                                 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(source)}}
+            self._write_schema(temporary, schema)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(temporary, entry)
+        except (OSError, TypeError, ValueError) as error:
+            self.logger.warning(f'{source} is not cached: {error}')
+            shutil.rmtree(temporary, ignore_errors=True)
+            return False
+        self.evict(keep=entry)
+        return os.path.exists(entry)
+
+    def _write_column(self, path, name, series):
+        column = {'name': name, 'dtype': str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            if categories.dtype.kind not in 'biufO' and not isinstance(categories.dtype, pd.StringDtype):
+                raise TypeError(f'categories of column {name} have unsupported type {categories.dtype}')
+            column.update(kind='category', categories=categories.tolist(), ordered=bool(series.cat.ordered))
+            np.save(path + '.npy', series.cat.codes.to_numpy())
+        elif series.dtype.kind in 'biufmM':
+            column['kind'] = 'numeric'
+            np.save(path + '.npy', series.to_numpy())
+        elif series.dtype == object or isinstance(series.dtype, pd.StringDtype):
+            mask = series.isna().to_numpy()
+            values = series.to_numpy(dtype=object)[~mask]
+            if not all(isinstance(value, str) and SEPARATOR not in value for value in values):
+                raise TypeError(f'column {name} has values that are not plain strings')
+            column['kind'] = 'text'
+            text = np.full(len(series), '', dtype=object)
+            text[~mask] = values
+            with open(path + '.txt', 'w', encoding='utf-8', newline='') as text_file:
+                text_file.write(SEPARATOR.join(text))
+            np.save(path + '.mask.npy', mask)
+        else:
+            raise TypeError(f'column {name} has unsupported type {series.dtype}')
+        return column
+
+    def _write_schema(self, entry, schema):
+        path = os.path.join(entry, SCHEMA_FILE)
+        with open(path + '.tmp', 'w') as schema_file:
+            json.dump(schema, schema_file, indent=1)
+        os.replace(path + '.tmp', path)
+
+    # ----- Размер
+
+    def entries(self, directory):
+        '''
+        Записи каталога кеша: (время использования, размер, путь), давние - первыми
+        '''
+        if not os.path.isdir(directory):
+            return []
+        entries = []
+        for entry in os.scandir(directory):
+            schema_path = os.path.join(entry.path, SCHEMA_FILE)
+            if entry.is_dir() and os.path.exists(schema_path):
+                entries.append((os.stat(schema_path).st_mtime, directory_size(entry.path), entry.path))
+        return sorted(entries)
+
+    def evict(self, directory=None, keep=None):
+        '''
+        Удалить давно не использовавшиеся записи, пока каталог больше max_bytes
+        Принимает:
+            directory (str) - каталог кеша (по умолчанию - self.directory)
+            keep (str) - запись, удаляемая последней
+        '''
+        directory = directory or self.directory
+        entries = self.entries(directory)
+        total = sum(size for used, size, path in entries)
+        for used, size, path in sorted(entries, key=lambda entry: entry[2] == keep):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.logger.info(f'Cache entry {os.path.basename(path)} has been evicted ({size/2**20:.1f} MiB)')
+
+    def clear(self, source):
+        '''
+        Удалить запись файла source
+        '''
+        if self.directory is None:
+            return
+        shutil.rmtree(self.entry_path(source), ignore_errors=True)
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Copy-on-write versions of a dataset.
+
+Исходная таблица не копируется и не изменяется. Каждый шаг очистки или
+преобразования создает новую версию (DatasetVersion) поверх тех же
+столбцов:
+    mask - маска оставшихся строк исходной таблицы (bool, 1 байт на строку);
+    columns - выбранные столбцы;
+    fills - значения для заполнения пропусков по столбцам.
+Неизмененные части разделяются между версиями (заполнение не копирует
+маску, выбор столбцов - ни маску, ни заполнения), поэтому история
+версий и отмена/повтор (VersionedDataset.undo/redo) почти не занимают
+памяти. Таблица собирается целиком только при экспорте (materialize,
+to_csv пишет частями):
+    dataset = VersionedDataset(data)
+    dataset.drop_na(['Embarked'])
+    dataset.fill_na({'Age': 28.0})
+    dataset.undo()
+    dataset.current.to_csv('clean.csv')
+'''
+
+import operator
+
+import numpy as np
+import pandas as pd
+
+MAX_HISTORY = 50 # число хранимых версий
+EXPORT_CHUNK = 100000 # строк в части при записи CSV
+COMPARISONS = (('>=', operator.ge), ('<=', operator.le), ('!=', operator.ne), ('>', operator.gt),
+               ('<', operator.lt), ('=', operator.eq)) # операции условия match (длинные - первыми)
+
+
+def fill_series(series, value):
+    '''
+    Заполнить пропуски (в категории значение добавляется при необходимости)
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+def default_fill(series):
+    '''
+    Значение для заполнения по умолчанию: медиана числового столбца,
+    иначе самое частое значение
+    '''
+    values = series.dropna()
+    if not len(values):
+        return None
+    if series.dtype.kind in 'biuf':
+        return float(values.median())
+    return values.mode().iloc[0]
+
+
+class DatasetVersion():
+    '''
+    Версия набора данных поверх общей исходной таблицы
+    '''
+
+    def __init__(self, base, mask=None, columns=None, fills=None, operation='load'):
+        '''
+        Принимает:
+            base (pd.DataFrame) - исходная таблица (не изменяется)
+            mask (np.ndarray) - маска строк base или None (все строки)
+            columns (list) - выбранные столбцы или None (все)
+            fills (dict) - столбец -> значение для пропусков
+            operation (str) - описание шага, создавшего версию
+        '''
+        self.base = base
+        self.mask = mask
+        self.columns = list(base.columns if columns is None else columns)
+        self.fills = dict(fills or {})
+        self.operation = operation
+        self.rows = len(base) if mask is None else int(np.count_nonzero(mask))
+        self._positions = None # номера строк base (считаются один раз: версия не меняется)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def shape(self):
+        return (self.rows, len(self.columns))
+
+    def __repr__(self):
+        return f'DatasetVersion({self.rows}x{len(self.columns)}, {self.operation!r})'
+
+    def _derive(self, operation, **changes):
+        fields = {'mask': self.mask, 'columns': self.columns, 'fills': self.fills}
+        fields.update(changes)
+        version = DatasetVersion(self.base, operation=operation, **fields)
+        if version.mask is self.mask:
+            version._positions = self._positions
+        return version
+
+    # ----- Чтение
+
+    def positions(self):
+        '''
+        Номера строк исходной таблицы, входящих в версию (общий массив только для чтения)
+        '''
+        if self._positions is None:
+            positions = np.arange(len(self.base)) if self.mask is None else np.flatnonzero(self.mask)
+            positions.flags.writeable = False
+            self._positions = positions
+        return self._positions
+
+    def null_mask(self, name):
+        '''
+        Маска пропусков столбца по строкам исходной таблицы (с учетом заполнения)
+        '''
+        if name in self.fills:
+            return np.zeros(len(self.base), dtype=bool)
+        return self.base[name].isna().to_numpy()
+
+    def null_counts(self):
+        '''
+        Число пропусков по столбцам (pd.Series)
+        '''
+        counts = {}
+        for name in self.columns:
+            nulls = self.null_mask(name)
+            counts[name] = int(np.count_nonzero(nulls if self.mask is None else nulls & self.mask))
+        return pd.Series(counts, dtype=np.int64)
+
+    def take(self, positions=None, columns=None):
+        '''
+        Собрать таблицу из части строк
+        Принимает:
+            positions (array) - номера строк версии (от 0) или None (все строки)
+            columns (list) - столбцы или None (все столбцы версии)
+        Возвращает:
+            data (pd.DataFrame) - новая таблица с индексом от 0
+        '''
+        rows = self.positions() if positions is None else self.positions()[np.asarray(positions)]
+        data = {}
+        for name in self.columns if columns is None else columns:
+            series = self.base[name].iloc[rows].reset_index(drop=True)
+            data[name] = fill_series(series, self.fills[name]) if name in self.fills else series
+        return pd.DataFrame(data)
+
+    def column(self, name):
+        return self.take(columns=[name])[name]
+
+    def head(self, count=5):
+        return self.take(np.arange(min(count, self.rows)))
+
+    def sort_order(self, name, ascending=True):
+        '''
+        Порядок строк версии по столбцу (пропуски - в конце), сама версия не меняется
+        Возвращает:
+            order (np.ndarray) - номера строк версии (от 0)
+        '''
+        values = self.column(name)
+        return values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+    def match(self, name, condition):
+        '''
+        Маска строк версии, удовлетворяющих условию по столбцу:
+            '>30', '<=2', '!=0', '=S' - сравнение (для числовых столбцов - как чисел);
+            иначе - подстрока без учета регистра;
+        пропуски не удовлетворяют никакому условию
+        '''
+        values = self.column(name)
+        known = values.notna().to_numpy()
+        condition = condition.strip()
+        for sign, compare in COMPARISONS:
+            if condition.startswith(sign):
+                operand = condition[len(sign):].strip()
+                if values.dtype.kind in 'biuf':
+                    try:
+                        operand = float(operand)
+                    except ValueError:
+                        raise ValueError(f'Column {name} is numeric, {operand!r} is not a number')
+                else:
+                    values = values.astype(object).where(known, '').astype(str)
+                return compare(values, operand).fillna(False).to_numpy(dtype=bool) & known
+        text = values.astype(object).where(known, '').astype(str)
+        return text.str.contains(condition, case=False, regex=False).to_numpy(dtype=bool) & known
+
+    # ----- Шаги (возвращают новую версию)
+
+    def drop_na(self, columns=None):
+        '''
+        Удалить строки с пропусками в столбцах columns (по умолчанию - во всех)
+        '''
+        columns = self.columns if columns is None else list(columns)
+        mask = np.ones(len(self.base), dtype=bool) if self.mask is None else self.mask.copy()
+        for name in columns:
+            if name not in self.fills:
+                mask &= ~self.null_mask(name)
+        return self._derive(f'drop rows with nulls ({self.rows - int(np.count_nonzero(mask))} rows)', mask=mask)
+
+    def filter_rows(self, keep, operation='filter rows'):
+        '''
+        Оставить строки версии по маске keep (длина - число строк версии)
+        '''
+        keep = np.asarray(keep, dtype=bool)
+        if keep.shape != (self.rows,):
+            raise ValueError(f'Row mask must have {self.rows} values, got {keep.shape}')
+        mask = np.ones(len(self.base), dtype=bool) if self.mask is None else self.mask.copy()
+        mask[self.positions()[~keep]] = False
+        return self._derive(operation, mask=mask)
+
+    def fill_na(self, values=None):
+        '''
+        Заполнить пропуски
+        Принимает:
+            values (dict) - столбец -> значение; None - для всех столбцов с
+                            пропусками значение по умолчанию (default_fill)
+        '''
+        if values is None:
+            counts = self.null_counts()
+            values = {name: default_fill(self.column(name)) for name in counts.index[counts > 0]}
+            values = {name: value for name, value in values.items() if value is not None}
+        unknown = set(values) - set(self.columns)
+        if unknown:
+            raise ValueError(f'Unknown columns: {sorted(unknown)}')
+        return self._derive(f'fill nulls in {", ".join(map(str, values))}', fills={**self.fills, **values})
+
+    def select_columns(self, columns):
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError(f'Unknown columns: {sorted(unknown)}')
+        return self._derive(f'select {len(columns)} columns', columns=list(columns))
+
+    def drop_columns(self, columns):
+        return self._derive(f'drop columns {", ".join(map(str, columns))}',
+                            columns=[name for name in self.columns if name not in set(columns)])
+
+    # ----- Экспорт
+
+    def materialize(self):
+        '''
+        Собрать всю таблицу версии
+        '''
+        return self.take()
+
+    def to_csv(self, path, chunk_size=EXPORT_CHUNK):
+        '''
+        Записать версию в CSV частями (целиком таблица не собирается)
+        '''
+        positions = self.positions()
+        with open(path, 'w', newline='') as csv_file:
+            for start in range(0, max(len(positions), 1), chunk_size):
+                chunk = self.take(np.arange(start, min(start + chunk_size, len(positions))))
+                chunk.to_csv(csv_file, index=False, header=not start)
+
+
+class VersionedDataset():
+    '''
+    История версий набора данных с отменой и повтором шагов
+    '''
+
+    def __init__(self, data, max_history=MAX_HISTORY):
+        self.versions = [DatasetVersion(data)]
+        self.position = 0
+        self.max_history = max_history
+
+    @property
+    def current(self):
+        return self.versions[self.position]
+
+    @property
+    def can_undo(self):
+        return self.position > 0
+
+    @property
+    def can_redo(self):
+        return self.position < len(self.versions) - 1
+
+    def apply(self, version):
+        '''
+        Сделать версию текущей (отмененные шаги после текущего забываются)
+        '''
+        del self.versions[self.position + 1:]
+        self.versions.append(version)
+        del self.versions[:max(len(self.versions) - self.max_history, 0)]
+        self.position = len(self.versions) - 1
+        return version
+
+    def undo(self):
+        if self.can_undo:
+            self.position -= 1
+        return self.current
+
+    def redo(self):
+        if self.can_redo:
+            self.position += 1
+        return self.current
+
+    def drop_na(self, columns=None):
+        return self.apply(self.current.drop_na(columns))
+
+    def filter_rows(self, keep, operation='filter rows'):
+        return self.apply(self.current.filter_rows(keep, operation))
+
+    def fill_na(self, values=None):
+        return self.apply(self.current.fill_na(values))
+
+    def select_columns(self, columns):
+        return self.apply(self.current.select_columns(columns))
+
+    def drop_columns(self, columns):
+        return self.apply(self.current.drop_columns(columns))
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Continuous drift monitoring of the crossbar.
+
+Фоновый поток с заданным периодом тестирует матрицу (Crossbar.test) и
+пишет снимки (коды АЦП всех ячеек) в кольцевой буфер NumPy фиксированного
+размера, поэтому память не растет при многочасовых измерениях. Все снимки
+по желанию сохраняются на диск (ExperimentStore.record_test).
+
+Статистика по ячейкам в окне буфера (среднее, СКО) считается инкрементно:
+суммы обновляются добавлением нового и вычитанием вытесненного снимка.
+GUI не получает каждый снимок, а сам забирает последнее состояние
+(latest) со своей частотой, поэтому поток Tk не перегружается.
+'''
+
+import time
+import logging
+import threading
+
+import numpy as np
+
+import crossbar as crossbar_module
+
+DEFAULT_INTERVAL = 0.1 # период тестирования (секунды)
+DEFAULT_CAPACITY = 3600 # размер кольцевого буфера (снимков)
+FLUSH_INTERVAL = 5.0 # период сброса снимков на диск (секунды)
+ERROR_LOG_INTERVAL = 10.0 # не чаще одного сообщения об ошибках за период (секунды)
+
+
+class DriftSnapshot():
+    '''
+    Состояние мониторинга для отображения
+    Атрибуты:
+        timestamp (float) - время последнего снимка
+        values (np.ndarray) - последний снимок (коды АЦП, rows x cols)
+        mean, std (np.ndarray) - среднее и СКО ячеек в окне буфера (коды АЦП)
+        drift (np.ndarray) - отклонение среднего от первого снимка (коды АЦП)
+        window (int) - число снимков в окне
+        count (int) - число снимков с начала мониторинга
+        errors (int) - число неудачных тестирований
+        rate (float) - фактическая частота снимков (Гц)
+    '''
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class DriftMonitor():
+    '''
+    Периодическое тестирование матрицы в фоновом потоке
+    '''
+
+    def __init__(self, crossbar, interval=DEFAULT_INTERVAL, capacity=DEFAULT_CAPACITY, store=None, logger=None):
+        '''
+        Принимает:
+            crossbar (Crossbar) - кроссбар
+            interval (float) - период тестирования (секунды)
+            capacity (int) - размер кольцевого буфера (снимков)
+            store (ExperimentStore) - хранилище для сохранения всех снимков или None
+            logger (logging.Logger) - логгер
+        '''
+        self.crossbar = crossbar
+        self.interval = interval
+        self.capacity = capacity
+        self.store = store
+        self.logger = logger or logging.getLogger(__name__)
+        self.shape = (crossbar.geometry.rows, crossbar.geometry.cols)
+        cells = crossbar.geometry.cells
+        self.buffer = np.zeros((capacity, cells), dtype=np.uint16)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self._sum = np.zeros(cells, dtype=np.int64) # суммы по окну (точные в целых числах)
+        self._sum_squares = np.zeros(cells, dtype=np.int64)
+        self._baseline = None
+        self.count = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @interval.setter
+    def interval(self, interval):
+        # при нулевом периоде поток тестировал бы матрицу без пауз
+        if not interval > 0:
+            raise ValueError(f'Monitoring interval must be positive, got {interval}')
+        self._interval = interval
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        '''
+        Запустить мониторинг
+        '''
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.logger.info(f'Drift monitoring has been started ({1e3*self.interval:.0f} ms)')
+
+    def stop(self):
+        '''
+        Остановить мониторинг
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self.store is not None:
+            self.store.flush()
+        self.logger.info(f'Drift monitoring has been stopped ({self.count} snapshots, {self.errors} errors)')
+
+    def _run(self):
+        next_time = time.monotonic()
+        last_flush = time.monotonic()
+        last_error_log = None
+        while not self._stop.is_set():
+            try:
+                values = self.crossbar.test()
+            except (crossbar_module.CrossbarError, OSError) as error:
+                self.errors += 1
+                if last_error_log is None or time.monotonic() - last_error_log >= ERROR_LOG_INTERVAL:
+                    self.logger.warning(f'Drift monitoring: test has failed ({self.errors} errors): {error}')
+                    last_error_log = time.monotonic()
+            else:
+                self.add(values)
+                if self.store is not None and time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    self.store.flush()
+                    last_flush = time.monotonic()
+            # без накопления опоздания: пропущенные периоды не наверстываются
+            next_time = max(next_time + self.interval, time.monotonic())
+            self._stop.wait(next_time - time.monotonic())
+
+    def add(self, values, timestamp=None):
+        '''
+        Добавить снимок в буфер (и в хранилище)
+        '''
+        timestamp = time.time() if timestamp is None else timestamp
+        values = np.asarray(values, dtype=np.uint16).reshape(-1)
+        with self._lock:
+            slot = self.count % self.capacity
+            if self.count >= self.capacity:
+                evicted = self.buffer[slot].astype(np.int64)
+                self._sum -= evicted
+                self._sum_squares -= evicted*evicted
+            self.buffer[slot] = values
+            self.times[slot] = timestamp
+            added = values.astype(np.int64)
+            self._sum += added
+            self._sum_squares += added*added
+            if self._baseline is None:
+                self._baseline = values.astype(np.float64)
+            self.count += 1
+        if self.store is not None:
+            self.store.record_test(values, timestamp)
+
+    def history(self):
+        '''
+        Снимки буфера в порядке времени
+        Возвращает:
+            times (np.ndarray) - время снимков
+            values (np.ndarray) - снимки (число снимков x число ячеек)
+        '''
+        with self._lock:
+            window = min(self.count, self.capacity)
+            order = (np.arange(self.count - window, self.count)) % self.capacity
+            return self.times[order], self.buffer[order]
+
+    def latest(self):
+        '''
+        Текущее состояние (DriftSnapshot) или None, если снимков еще нет
+        '''
+        with self._lock:
+            if not self.count:
+                return None
+            window = min(self.count, self.capacity)
+            last = (self.count - 1) % self.capacity
+            first = (self.count - window) % self.capacity
+            mean = self._sum/window
+            variance = np.maximum(self._sum_squares/window - mean*mean, 0.0)
+            elapsed = self.times[last] - self.times[first]
+            return DriftSnapshot(timestamp=self.times[last],
+                                 values=self.buffer[last].reshape(self.shape).copy(),
+                                 mean=mean.reshape(self.shape),
+                                 std=np.sqrt(variance).reshape(self.shape),
+                                 drift=(mean - self._baseline).reshape(self.shape),
+                                 window=window, count=self.count, errors=self.errors,
+                                 rate=(window - 1)/elapsed if elapsed > 0 else 0.0)
@@ -1,170 +1,356 @@
 #!/usr/bin/python3
 #-*- coding: utf-8 -*-
 
+'''
+FPGA emulator.
+
+Эмулятор платы с кроссбаром мемристоров. Адресное пространство - массив
+NumPy uint32, состояние ячеек - коды АЦП (0..4095). Экземпляр подключается
+к MemoryController вместо библиотеки на C:
+    fpga = FPGAEmulator().start()
+    controller = MemoryController(driver=fpga)
+    ...
+    fpga.stop()
+
+Размер кроссбара и адреса регистров задает описание geometry.CrossbarGeometry
+(по умолчанию '4x4'). Команды записываются в FIFO (0xC0000010):
+    0xA1 - тестирование: коды всех ячеек в 0xC0000040..., флаг результата 0x1;
+    0xB2, слово - программирование одной ячейки: итог в 0xC0000080,
+        число попыток в 0xC0000084, история в 0xC0004000..., флаг результата 0x2;
+    0xB3, номер элемента, слово - то же для матриц, номер элемента
+        которых не помещается в слово;
+    0xC3 - умножение: I = G·V, V - напряжения столбцов (мВ, int32) из 0xC0008000...,
+        I - токи строк (нА, int32) в 0xC0008400..., флаг результата 0x3.
+Команда программирования ячейки вне кроссбара не принимается: запись
+в FIFO завершается IndexError, как и обращение вне адресного пространства.
+Проводимость ячейки пропорциональна ее коду: G = G_MAX*код/ADC_MAX.
+При приеме команды плата сразу становится занятой (0xC0000000 = 0)
+и сбрасывает флаг результата (0xC0000004 = 0).
+'''
+
 import time
-import random
-import threading, queue
+import queue
+import ctypes
+import threading
+
+import numpy as np
+
+import geometry as geometry_module
+
+BASE_ADDRESS = 0xC0000000 # начало адресного пространства платы
+MEMORY_SIZE = 0x40000 # размер адресного пространства (байт)
+
+# адреса регистров платы 4x4
+STATE_REG = geometry_module.REGISTERS['state']
+FLAGS_REG = geometry_module.REGISTERS['flags']
+FIFO_ADDR = geometry_module.REGISTERS['fifo']
+TEST_DATA_ADDR = geometry_module.REGISTERS['test_data']
+PROG_RESULT_REG = geometry_module.REGISTERS['prog_result']
+PROG_ATTEMPTS_REG = geometry_module.REGISTERS['prog_attempts']
+HISTORY_ADDR = geometry_module.REGISTERS['history']
+MVM_INPUT_ADDR = geometry_module.REGISTERS['mvm_input']
+MVM_OUTPUT_ADDR = geometry_module.REGISTERS['mvm_output']
+
+CMD_TEST = geometry_module.CMD_TEST
+CMD_PROGRAM = geometry_module.CMD_PROGRAM
+CMD_PROGRAM_CELL = geometry_module.CMD_PROGRAM_CELL
+CMD_MVM = geometry_module.CMD_MVM
+CMD_STOP = 777
+COMMAND_ARGS = {CMD_TEST: 0, CMD_PROGRAM: 1, CMD_PROGRAM_CELL: 2, CMD_MVM: 0} # число слов данных после команды
+
+RESULT_TEST = geometry_module.RESULT_TEST
+RESULT_PROGRAM = geometry_module.RESULT_PROGRAM
+RESULT_MVM = geometry_module.RESULT_MVM
+
+ADC_MAX = 4095 # максимальный код АЦП
+G_MAX = 1.0 # проводимость ячейки с кодом ADC_MAX (мСм)
+HISTORY_LENGTH = geometry_module.HISTORY_LENGTH # длина истории программирования
 
-class FPGA():
+
+class TimingModel():
     '''
-    FPGA
+    Модель времени работы платы (по умолчанию - без задержек)
     '''
 
-    def __init__(self):
-        pass
-
-    def ready(self):
+    def test_time(self, cells):
         '''
-        Готова работать
+        Время тестирования cells ячеек (секунды)
         '''
-        RAM[0xC0000000] = 0x1
-        print('    FPGA: пишу в адрес 0xC0000000 - %s, жду...' % (hex(0x1)))
+        return 0.0
 
-    def busy(self):
+    def program_time(self, attempts):
         '''
-        Занята работой
+        Время программирования ячейки за attempts попыток (секунды)
         '''
-        RAM[0xC0000000] = 0x0
-        print('    FPGA: пишу в адрес 0xC0000000 - %s, занята...' % (hex(0x0)))
+        return 0.0
 
-    def run(self):
+    def mvm_time(self, cells):
         '''
-        Работа ПЛИС
+        Время умножения на кроссбаре из cells ячеек (секунды)
         '''
-        self.ready()
-        while True:
-            mode = RAM[0xC0000010].get() # это дыра
-            print('    FPGA: читаю адрес 0xC0000010 - %s' % (hex(mode)))
-            if mode == 777:  break
-            self.work(mode)
-        print('    FPGA: Эмулятор корректно завершил работу!')
-
-    def set_result_id(self, result_id):
-        '''
-        Изменение флага результата
-        '''
-        RAM[0xC0000004] = result_id
-        print('    FPGA: пишу в адрес 0xC0000004 - %s' % (hex(result_id)))
-
-    def write_word(self, addr, word):
-        '''
-        Изменение флага результата
-        '''
-        RAM[addr] = word
-        print('    FPGA: пишу в адрес %s - %s' % (hex(addr), hex(word)))
-
-    def work(self, mode):
-        '''
-        Работа ПЛИС в отдельном потоке
-        '''
-        if mode == 0xA1:
-            '''
-            Работа в режиме тестирования
-            '''
-            self.busy() # ПЛИС не готова выполнять другие команды
-            self.set_result_id(0x0) # Результата работы нет
-            print('    FPGA: работаю в режиме тестирования')
-            # пишем в память результаты тестирования 40, 44, 48, 4C... 7C 4 байта (32 бит шина)
-            addrs = [0xC0000040+i*4 for i in range(16)]
-            for addr in addrs:
-                value = random.randint(0, 4095)
-                print('    FPGA: пишу в адрес %s - %s' % (hex(addr), hex(value)))
-                RAM[addr] = value
-            self.set_result_id(0x1)
-            self.ready()
-
-        elif mode == 0xB2:
-            '''
-            Работа в режиме программирования
-            '''
-            self.busy() # ПЛИС не готова выполнять другие команды
-            self.set_result_id(0x0) # Результата работы нет
-            print('    FPGA: работаю в режиме программирования')
-            print('    FPGA: жду слово данных...')
-            data = RAM[0xC0000010].get()
-            print('    FPGA: слово данных получено!')
-            '''
-
-            '0b00000000000000000000000000000000'
-            '0b 0000 0 000 000000000000 000000000000'
-            data = int('0b11111101000000100001001100001001', 2)
-            11..0 - целевое значение сопротивления, переведенное в значение АЦП;
-            23..12 - допустимое отклонение от целевого значения;
-            26..24 - максимальное количество попыток программирования;
-            27 - режим измерения “гребенки” (1 - включено, 0 - выключено);
-            31..28 - номер программируемого элемента (от 0 до 15).
-            '''
-
-            mask = int('0b00000000000000000000111111111111', 2)
-            target_R = data & mask
-            print('    FPGA: целевое значение сопротивления %d' % (target_R))
-
-            mask = int('0b00000000111111111111000000000000', 2)
-            tolerance_R = (data & mask) >> 12
-            print('    FPGA: допустимое отклонение сопротивления %d' % (tolerance_R))
-
-            mask = int('0b00000111000000000000000000000000', 2)
-            number_prog = (data & mask) >> 24
-            print('    FPGA: количество попыток %d' % (number_prog))
-
-            mask = int('0b00001000000000000000000000000000', 2)
-            mode_prog = (data & mask) >> 27
-            print('    FPGA: режим программирования %d' % (mode_prog))
-
-            mask = int('0b11110000000000000000000000000000', 2)
-            number_elem = (data & mask) >> 28
-            print('    FPGA: номер программируемого элемента %d' % (number_elem))
-
-
-            step = 4095 / 461
-            num = int((target_R*461) / 4095)
-            resistance = 0
-            for i in range(num):
-                resistance = resistance + step
-                if mode_prog == 1: # сохранять историю
-                    self.write_word(0xC0004000 + i*4, int(resistance))
-
-            self.write_word(0xC0000080, int(resistance))
-            self.set_result_id(0x2)
-            self.ready()
-
-class read_data():
+        return 0.0
+
+
+class LinearTiming(TimingModel):
     '''
-    обработка функции чтения данных по адресу в памяти
+    Время, линейно зависящее от числа ячеек и попыток
     '''
-    def __call__(self, addr):
-        print('    ДРАЙВЕР: читаю адрес %s' % (hex(addr)))
-        if addr == 0xC0000010:
-            data = 0
-            print('    ДРАЙВЕР: прочитал %s' % (hex(0x0)))
-        else:
-            print('    ДРАЙВЕР: прочитал %s' % (hex(RAM[addr])))
-            data = RAM[addr]
-        return data
 
-class write_data():
+    def __init__(self, test_per_cell=5e-6, program_per_attempt=50e-6, overhead=10e-6, mvm_per_cell=0.0):
+        self.test_per_cell = test_per_cell
+        self.program_per_attempt = program_per_attempt
+        self.overhead = overhead
+        self.mvm_per_cell = mvm_per_cell
+
+    def test_time(self, cells):
+        return self.overhead + self.test_per_cell*cells
+
+    def program_time(self, attempts):
+        return self.overhead + self.program_per_attempt*attempts
+
+    def mvm_time(self, cells):
+        return self.overhead + self.mvm_per_cell*cells
+
+
+class FPGAEmulator():
     '''
-    обработка функции записи данных
+    Эмулятор ПЛИС с интерфейсом драйвера памяти
+    (read_data, write_data, read_block, write_block)
     '''
-    def __call__(self, addr, data):
-        if addr == 0xC0000010:
-            RAM[addr].put(data)
+
+    def __init__(self, geometry='4x4', timing=None, read_noise=0.0, seed=None, threaded=True):
+        '''
+        Принимает:
+            geometry (CrossbarGeometry или str) - описание кроссбара
+            timing (TimingModel) - модель времени работы
+            read_noise (float) - СКО шума чтения (коды АЦП)
+            seed (int) - зерно генератора случайных чисел
+            threaded (bool) - выполнять команды в отдельном потоке (иначе сразу при записи в FIFO)
+        '''
+        self.geometry = geometry_module.get_geometry(geometry)
+        self.registers = self.geometry.registers
+        self.rows = self.geometry.rows
+        self.cols = self.geometry.cols
+        self.timing = timing or TimingModel()
+        self.read_noise = read_noise
+        self.threaded = threaded
+        self.rng = np.random.default_rng(seed)
+        self.memory = np.zeros(MEMORY_SIZE // 4, dtype=np.uint32)
+        self.cells = self.rng.integers(0, ADC_MAX + 1, size=self.geometry.cells).astype(np.float64)
+        self._commands = queue.Queue()
+        self._command = None # принимаемая команда и ее данные
+        self._thread = None
+        self._lock = threading.Lock()
+        self.commands_done = 0
+
+    # ----- Жизненный цикл
+
+    def start(self):
+        '''
+        Запустить эмулятор
+        '''
+        self._set(self.registers['state'], 1)
+        if self.threaded and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Остановить эмулятор
+        '''
+        if self._thread is not None:
+            self._commands.put((CMD_STOP, []))
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ----- Интерфейс драйвера
+
+    def _index(self, address):
+        index = (address - BASE_ADDRESS) >> 2
+        if not 0 <= index < len(self.memory):
+            raise IndexError(f'Address {hex(address)} is out of the emulator memory')
+        return index
+
+    def _set(self, address, word):
+        self.memory[self._index(address)] = word
+
+    def read_data(self, address):
+        if address == self.registers['fifo']:
+            return 0
+        return int(self.memory[self._index(address & 0xFFFFFFFF)])
+
+    def write_data(self, address, word):
+        address &= 0xFFFFFFFF
+        word &= 0xFFFFFFFF
+        if address == self.registers['fifo']:
+            self._feed(word)
         else:
-            RAM[addr] = data
-        print('    ДРАЙВЕР: Запись по адресу %s данных %s' % (hex(addr),hex(data)))
+            self.memory[self._index(address)] = word
 
-class CDLL():
-    '''
-    Класс эмулятор работы ctypes
-    '''
-    def __init__(self, path):
-        self.path = path
-        self.read_data = read_data()
-        self.write_data = write_data()
-
-c_int = None
-RAM = {0xC0000000+i: 0 for i in range(30000)}
-RAM[0xC0000010] = queue.Queue()
-fpga = FPGA()
-thread_fpga = threading.Thread(target=fpga.run)
-thread_fpga.start()
\ No newline at end of file
+    def _block(self, address, num_elements, shift):
+        '''
+        Индексы блока слов (или None для FIFO)
+        '''
+        if address == self.registers['fifo'] and shift == 0:
+            return None
+        start = self._index(address)
+        if num_elements:
+            self._index(address + (num_elements - 1)*shift)
+        return start + np.arange(num_elements)*(shift >> 2)
+
+    def read_block(self, address, num_elements, shift, data):
+        out = np.ctypeslib.as_array(ctypes.cast(data, ctypes.POINTER(ctypes.c_uint32)), shape=(num_elements,))
+        index = self._block(address, num_elements, shift)
+        out[:] = 0 if index is None else self.memory[index]
+        return num_elements
+
+    def write_block(self, address, data, num_elements, shift):
+        words = np.ctypeslib.as_array(ctypes.cast(data, ctypes.POINTER(ctypes.c_uint32)), shape=(num_elements,))
+        index = self._block(address, num_elements, shift)
+        if index is None:
+            for word in words.tolist():
+                self._feed(word)
+        else:
+            self.memory[index] = words
+        return num_elements
+
+    # ----- Работа ПЛИС
+
+    def _feed(self, word):
+        '''
+        Прием слова FIFO: команда и ее данные
+        '''
+        with self._lock:
+            if self._command is None:
+                if word not in COMMAND_ARGS:
+                    return # неизвестная команда игнорируется
+                # плата сразу занята, результата нет
+                self._set(self.registers['state'], 0)
+                self._set(self.registers['flags'], 0)
+                self._command = (word, [])
+            else:
+                self._command[1].append(word)
+            command, args = self._command
+            if len(args) < COMMAND_ARGS[command]:
+                return
+            self._command = None
+            try:
+                self._check(command, args)
+            except IndexError:
+                self._set(self.registers['state'], 1) # команда не принята, плата свободна
+                raise
+        if self.threaded:
+            self._commands.put((command, args))
+        else:
+            self._execute(command, args)
+
+    def _element(self, word, element=None):
+        '''
+        Номер программируемой ячейки (из слова, если element не задан)
+        '''
+        if element is None:
+            element = self.geometry.word_format.decode_word(word)['element']
+        if not 0 <= element < len(self.cells):
+            raise IndexError(f'Element {element} is out of the crossbar ({len(self.cells)} cells)')
+        return element
+
+    def _check(self, command, args):
+        '''
+        Проверка данных команды при приеме (ошибка адресации - исключение в write_data)
+        '''
+        if command == CMD_PROGRAM:
+            self._element(args[0])
+        elif command == CMD_PROGRAM_CELL:
+            self._element(args[1], element=args[0])
+
+    def _run(self):
+        while True:
+            command, args = self._commands.get()
+            if command == CMD_STOP:
+                break
+            self._execute(command, args)
+
+    def _execute(self, command, args):
+        if command == CMD_TEST:
+            self.test()
+        elif command == CMD_PROGRAM:
+            self.program(args[0])
+        elif command == CMD_PROGRAM_CELL:
+            self.program(args[1], element=args[0])
+        elif command == CMD_MVM:
+            self.mvm()
+        self.commands_done += 1
+        self._set(self.registers['state'], 1)
+
+    def _sleep(self, duration):
+        if duration > 0:
+            time.sleep(duration)
+
+    def test(self):
+        '''
+        Тестирование: коды АЦП всех ячеек
+        '''
+        values = self.cells
+        if self.read_noise:
+            values = values + self.rng.normal(0, self.read_noise, size=values.shape)
+        start = self._index(self.registers['test_data'])
+        self.memory[start:start+len(values)] = np.clip(np.rint(values), 0, ADC_MAX)
+        self._sleep(self.timing.test_time(len(values)))
+        self._set(self.registers['flags'], RESULT_TEST)
+
+    def program(self, word, element=None):
+        '''
+        Программирование ячейки по управляющему слову (см. control_word.py);
+        номер элемента берется из слова, если element не задан,
+        номер вне кроссбара - IndexError
+        '''
+        fields = self.geometry.word_format.decode_word(word)
+        target = fields['target']
+        tolerance = fields['tolerance']
+        max_attempts = fields['attempts']
+        save_history = fields['history']
+        element = self._element(word, fields['element'] if element is None else element)
+
+        initial = value = self.cells[element]
+        attempts = 0
+        while attempts < max_attempts and abs(value - target) > tolerance:
+            # каждая попытка приближает состояние к цели на случайную долю
+            value += (target - value)*self.rng.uniform(0.5, 1.0)
+            attempts += 1
+        value = float(np.clip(value, 0, ADC_MAX))
+        self.cells[element] = value
+
+        if save_history:
+            start = self._index(self.registers['history'])
+            self.memory[start:start+HISTORY_LENGTH] = np.rint(np.linspace(initial, value, HISTORY_LENGTH))
+        self._set(self.registers['prog_result'], int(round(value)))
+        self._set(self.registers['prog_attempts'], attempts)
+        self._sleep(self.timing.program_time(attempts))
+        self._set(self.registers['flags'], RESULT_PROGRAM)
+
+    def conductance(self):
+        '''
+        Матрица проводимостей ячеек (мСм, rows x cols)
+        '''
+        return (G_MAX/ADC_MAX*self.cells).reshape(self.rows, self.cols)
+
+    def mvm(self):
+        '''
+        Умножение: токи строк I = G·V (нА) по напряжениям столбцов V (мВ)
+        '''
+        start = self._index(self.registers['mvm_input'])
+        voltages = self.memory[start:start+self.cols].view(np.int32).astype(np.float64)
+        currents = 1e3*(self.conductance() @ voltages) # мСм*мВ = мкА
+        if self.read_noise:
+            currents += self.rng.normal(0, self.read_noise, size=currents.shape)
+        start = self._index(self.registers['mvm_output'])
+        self.memory[start:start+self.rows] = np.clip(np.rint(currents), -2**31, 2**31 - 1).astype(np.int32).view(np.uint32)
+        self._sleep(self.timing.mvm_time(len(self.cells)))
+        self._set(self.registers['flags'], RESULT_MVM)
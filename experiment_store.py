@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Append-only on-disk store of programming histories and matrix test runs.
+
+Данные хранятся в каталоге эксперимента:
+    programs.u16, programs.idx - истории программирования (блоки uint16
+        по 461 отсчету) и индекс (время, элемент, цель, допуск, попытки,
+        итоговое значение, номер блока истории);
+    tests.u16, tests.idx - результаты тестирования (блок uint16 на матрицу)
+        и индекс (время, номер блока);
+    store.json - размеры блоков, по ним проверяется совместимость.
+Записи только дописываются в конец файлов. Чтение идет через np.memmap,
+поэтому выборки по элементу или интервалу времени не загружают весь
+файл в память. Значения хранятся кодами АЦП, перевод в сопротивления -
+при чтении (calibration.py), чтобы калибровку можно было поменять позже.
+'''
+
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+HISTORY_LENGTH = 461 # длина истории программирования
+STORE_VERSION = 1
+META_FILE = 'store.json'
+
+PROGRAM_INDEX = np.dtype([('timestamp', '<f8'), # время записи (секунды от эпохи)
+                          ('element', '<u4'), # номер элемента (от 0)
+                          ('target', '<f4'), # целевое сопротивление (кОм)
+                          ('tolerance', '<f4'), # допустимое отклонение (%)
+                          ('max_attempts', '<u1'), # максимальное число попыток
+                          ('attempts', '<u1'), # выполненные попытки
+                          ('final', '<u2'), # итоговое значение (код АЦП)
+                          ('block', '<i8')]) # номер блока истории (-1 - без истории)
+TEST_INDEX = np.dtype([('timestamp', '<f8'),
+                       ('block', '<i8')])
+
+
+class BlockStore():
+    '''
+    Файл блоков uint16 фиксированной длины и индекс записей к ним
+    '''
+
+    def __init__(self, directory, name, block_length, index_dtype):
+        self.block_length = block_length
+        self.index_dtype = index_dtype
+        self.blocks_path = os.path.join(directory, f'{name}.u16')
+        self.index_path = os.path.join(directory, f'{name}.idx')
+        self._repair()
+        self._blocks_file = open(self.blocks_path, 'ab')
+        self._index_file = open(self.index_path, 'ab')
+        self._records = os.path.getsize(self.index_path) // index_dtype.itemsize
+        self._num_blocks = os.path.getsize(self.blocks_path) // (2*block_length)
+        self._index_map = None
+        self._blocks_map = None
+        self._lock = threading.Lock() # записи могут идти из нескольких потоков
+
+    def _repair(self):
+        '''
+        Отбросить недописанный хвост файлов (после аварийного завершения):
+        неполные записи и блоки, записи индекса, блоки которых не дописаны
+        (индекс мог быть сброшен на диск раньше блоков), и блоки без записей
+        '''
+        record_size, block_size = self.index_dtype.itemsize, 2*self.block_length
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        blocks_size = os.path.getsize(self.blocks_path) if os.path.exists(self.blocks_path) else 0
+        records, num_blocks = index_size // record_size, blocks_size // block_size
+        used_blocks = 0
+        if records:
+            block_numbers = np.array(np.memmap(self.index_path, dtype=self.index_dtype, mode='r',
+                                               shape=(records,))['block'])
+            broken = np.flatnonzero(block_numbers >= num_blocks)
+            if len(broken):
+                records = int(broken[0]) # записи дописываются по порядку - отбрасывается хвост
+            used_blocks = int(block_numbers[:records].max(initial=-1)) + 1
+        for path, size, valid in ((self.index_path, index_size, records*record_size),
+                                  (self.blocks_path, blocks_size, used_blocks*block_size)):
+            if size != valid:
+                os.truncate(path, valid)
+
+    def __len__(self):
+        return self._records
+
+    def append(self, records, blocks=None):
+        '''
+        Дописать записи
+        Принимает:
+            records (np.ndarray) - записи индекса (index_dtype); поле block
+                                   заполняется здесь для строк blocks
+            blocks (2-D array) - блоки, по одному на запись, или None
+        Возвращает:
+            numbers (np.ndarray) - номера записей
+        '''
+        records = np.array(records, dtype=self.index_dtype, ndmin=1)
+        if blocks is not None:
+            blocks = np.asarray(blocks)
+            if blocks.shape != (len(records), self.block_length):
+                raise ValueError(f'Expected {len(records)} blocks of {self.block_length} samples, got {blocks.shape}')
+            blocks = np.clip(blocks, 0, 0xFFFF).astype('<u2')
+        with self._lock:
+            if blocks is not None:
+                records['block'] = self._num_blocks + np.arange(len(records))
+                self._blocks_file.write(blocks.tobytes())
+                self._num_blocks += len(records)
+            self._index_file.write(records.tobytes())
+            numbers = self._records + np.arange(len(records))
+            self._records += len(records)
+        return numbers
+
+    def flush(self):
+        with self._lock:
+            self._blocks_file.flush()
+            self._index_file.flush()
+
+    @property
+    def index(self):
+        '''
+        Индекс всех записей (np.memmap, только чтение)
+        '''
+        if self._index_map is None or len(self._index_map) != self._records:
+            self.flush()
+            self._index_map = (np.memmap(self.index_path, dtype=self.index_dtype, mode='r', shape=(self._records,))
+                               if self._records else np.zeros(0, dtype=self.index_dtype))
+        return self._index_map
+
+    def blocks(self, numbers=None):
+        '''
+        Блоки записей numbers (или все блоки как np.memmap)
+        Возвращает:
+            blocks (np.ndarray) - массив (len(numbers), block_length) uint16
+        '''
+        if self._blocks_map is None or len(self._blocks_map) != self._num_blocks:
+            self.flush()
+            self._blocks_map = (np.memmap(self.blocks_path, dtype='<u2', mode='r',
+                                          shape=(self._num_blocks, self.block_length))
+                                if self._num_blocks else np.zeros((0, self.block_length), dtype='<u2'))
+        if numbers is None:
+            return self._blocks_map
+        block_numbers = self.index['block'][numbers]
+        if np.any(block_numbers < 0):
+            raise ValueError('Some of the records have no data block')
+        return self._blocks_map[block_numbers]
+
+    def select(self, start=None, stop=None, **fields):
+        '''
+        Номера записей в интервале времени [start, stop) с заданными значениями полей
+        '''
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+        if start is not None:
+            mask &= index['timestamp'] >= start
+        if stop is not None:
+            mask &= index['timestamp'] < stop
+        for field, value in fields.items():
+            if value is not None:
+                mask &= np.isin(index[field], value)
+        return np.flatnonzero(mask)
+
+    def close(self):
+        self._index_map = None
+        self._blocks_map = None
+        self._blocks_file.close()
+        self._index_file.close()
+
+
+class ExperimentStore():
+    '''
+    Хранилище экспериментов с кроссбаром
+    '''
+
+    def __init__(self, directory, cells, history_length=HISTORY_LENGTH):
+        '''
+        Принимает:
+            directory (str) - каталог хранилища (создается при необходимости)
+            cells (int) - число ячеек кроссбара (длина блока тестирования)
+            history_length (int) - длина истории программирования
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        meta = {'version': STORE_VERSION, 'cells': cells, 'history_length': history_length}
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                stored = json.load(meta_file)
+            if stored != meta:
+                raise ValueError(f'Store {directory} has another layout: {stored}')
+        else:
+            with open(meta_path, 'w') as meta_file:
+                json.dump(meta, meta_file)
+        self.programs = BlockStore(directory, 'programs', history_length, PROGRAM_INDEX)
+        self.tests = BlockStore(directory, 'tests', cells, TEST_INDEX)
+
+    def record_programs(self, elements, targets, tolerances, max_attempts, attempts, finals,
+                        histories=None, timestamp=None):
+        '''
+        Записать результаты программирования ячеек (массивы или числа)
+        Принимает:
+            elements (array) - номера элементов (от 0)
+            targets, tolerances - целевые сопротивления (кОм) и допуски (%)
+            max_attempts, attempts - максимальное и выполненное число попыток
+            finals (array) - итоговые значения (коды АЦП)
+            histories (2-D array) - истории (коды АЦП), по одной на элемент, или None
+            timestamp (float) - время (по умолчанию текущее)
+        Возвращает:
+            numbers (np.ndarray) - номера записей
+        '''
+        elements = np.asarray(elements).reshape(-1)
+        records = np.zeros(len(elements), dtype=PROGRAM_INDEX)
+        records['timestamp'] = time.time() if timestamp is None else timestamp
+        records['element'] = elements
+        shape = np.shape(targets)
+        records['target'] = np.asarray(targets).reshape(-1)
+        records['tolerance'] = np.broadcast_to(tolerances, shape).reshape(-1)
+        records['max_attempts'] = np.broadcast_to(max_attempts, shape).reshape(-1)
+        records['attempts'] = np.asarray(attempts).reshape(-1)
+        records['final'] = np.asarray(finals).reshape(-1)
+        records['block'] = -1
+        if histories is not None:
+            histories = np.asarray(histories).reshape(len(elements), -1)
+        return self.programs.append(records, histories)
+
+    def record_program_result(self, elements, targets, tolerances, max_attempts, result):
+        '''
+        Записать результат Crossbar.program_cells/program_matrix (crossbar.ProgramResult):
+        только ячейки, по которым получен ответ
+        '''
+        shape = np.shape(targets)
+        done = result.done.reshape(-1)
+        return self.record_programs(np.asarray(elements).reshape(-1)[done], np.asarray(targets).reshape(-1)[done],
+                                    np.broadcast_to(tolerances, shape).reshape(-1)[done],
+                                    np.broadcast_to(max_attempts, shape).reshape(-1)[done],
+                                    result.attempts.reshape(-1)[done], result.values.reshape(-1)[done],
+                                    None if result.history is None else result.history.reshape(done.size, -1)[done])
+
+    def record_test(self, values, timestamp=None):
+        '''
+        Записать результат тестирования матрицы (коды АЦП всех ячеек)
+        '''
+        record = np.zeros(1, dtype=TEST_INDEX)
+        record['timestamp'] = time.time() if timestamp is None else timestamp
+        return self.tests.append(record, np.asarray(values).reshape(1, -1))[0]
+
+    def program_histories(self, element=None, start=None, stop=None):
+        '''
+        Истории программирования элемента (или всех) за интервал времени
+        Возвращает:
+            records (np.ndarray) - записи индекса
+            histories (np.ndarray) - истории (коды АЦП)
+        '''
+        numbers = self.programs.select(start, stop, element=element)
+        numbers = numbers[self.programs.index['block'][numbers] >= 0]
+        return self.programs.index[numbers], self.programs.blocks(numbers)
+
+    def test_runs(self, start=None, stop=None):
+        '''
+        Результаты тестирования за интервал времени
+        Возвращает:
+            timestamps (np.ndarray) - время тестирования
+            values (np.ndarray) - коды АЦП (число тестов x число ячеек)
+        '''
+        numbers = self.tests.select(start, stop)
+        return self.tests.index['timestamp'][numbers], self.tests.blocks(numbers)
+
+    def flush(self):
+        self.programs.flush()
+        self.tests.flush()
+
+    def close(self):
+        self.programs.close()
+        self.tests.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -5,13 +5,17 @@
 FPGA Client oblect.
 '''
 
-import sys
 import time
-import pickle
 import socket
+import logging
+import itertools
 import threading
+from concurrent import futures as concurrent_futures
+from concurrent.futures import Future
 
 import app_logger
+import protocol
+import tracing
 import tools
 
 class FPGAClient():
@@ -29,8 +33,9 @@ class FPGAClient():
 
     #todo: какие константы можно вынести во внешний файл?
     _CONNECTION_ATTEMPT_NUM = 10 # число попыток подключения к серверу
-    _TRANSMIT_CHUNK_SIZE = 2048 # размер передаваемого сообщения
+    _RECEIVE_BUFFER_SIZE = protocol.RECEIVE_BUFFER_SIZE # начальный размер приемного буфера
     _TIME_TRY_TO_CONNECT = 1 # интервал попытки подключения к серверу
+    _REPLY_TIMEOUT = 60 # ожидание ответа сервера в send (секунды)
     _NAME_C_DRIVER = 'mem_access.so' # путь к драйверу управления ОЗУ
 
     def __init__(self):
@@ -40,6 +45,8 @@ class FPGAClient():
         '''
         self.logger = app_logger.get_logger(__name__)
         self.logger.addHandler(app_logger.get_stream_handler())
+        self.trace_logger = tracing.get_logger('client') # сообщения горячих путей
+        self.trace = tracing.OpTrace() # последние запросы для разбора ошибок
 
     def get_logger(self, name):
         '''
@@ -89,6 +96,7 @@ class FPGAClient():
             self.logger.debug(f'Attempt №{count}')
             try:
                 self.sock.connect((self._host, self._port))
+                self._start_receiving()
                 self._flag_server_connected = True # успешное подключение
                 self.logger.info(f'Connected successfully!')
                 self.create_controller()
@@ -100,43 +108,178 @@ class FPGAClient():
                 self.logger.warning(f'Failed!')
         self._flag_connection_process = False
 
-    def send(self, data):
+    def _start_receiving(self):
         '''
-        Отправка данных на сервер
+        Запустить поток приема ответов сервера
+        '''
+        self._reader = protocol.MessageReader(self.sock, self._RECEIVE_BUFFER_SIZE)
+        self._pending = {} # ожидающие ответа запросы: идентификатор -> Future
+        self._pending_lock = threading.Lock()
+        self._receiving = True # поток приема работает (меняется под _pending_lock)
+        self._send_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self.thread_recv = threading.Thread(target=self._receive_replies, args=(self.sock, self._reader), daemon=True)
+        self.thread_recv.start()
+
+    def _receive_replies(self, sock, reader):
+        '''
+        Прием ответов сервера и их сопоставление с запросами по идентификатору
+        '''
+        while True:
+            try:
+                request_id, answer = reader.read_message()
+            except protocol.ProtocolError as exc:
+                # после ошибки разбора поток кадров рассинхронизирован
+                self.logger.warning(f'Can\'t receive data: {exc}')
+                self.trace.dump(self.logger)
+                error = BrokenPipeError(str(exc))
+                break
+            except OSError as exc:
+                error = BrokenPipeError(str(exc))
+                break
+            with self._pending_lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                self.logger.warning(f'Unexpected reply №{request_id}!')
+            else:
+                self.trace_logger.debug('Reply №%d received', request_id)
+                future.set_result(answer)
+        self._fail_pending(error)
+        if self._flag_server_connected and getattr(self, 'sock', None) is sock:
+            # соединение разорвано со стороны сервера
+            self.logger.info('Connection is lost!')
+            self.trace.dump(self.logger, logging.DEBUG)
+            self.close_connection()
+
+    def _fail_pending(self, error):
+        '''
+        Завершить ошибкой все запросы, ожидающие ответа; после этого новые
+        запросы не регистрируются (submit_many проверяет флаг под той же блокировкой)
+        '''
+        with self._pending_lock:
+            self._receiving = False
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(error)
+
+    def submit_many(self, requests):
+        '''
+        Отправить несколько запросов подряд, не дожидаясь ответов
+        Принимает:
+            requests (list) - список запросов
+        Возвращает:
+            futures (list) - Future для каждого запроса, результат - ответ сервера
+        '''
+        futures = [Future() for request in requests]
+        if not self._flag_server_connected:
+            for future in futures:
+                future.set_exception(BrokenPipeError('FPGAClient is not connected'))
+            return futures
+        request_ids = []
+        try:
+            frames = bytearray()
+            with self._pending_lock:
+                if not self._receiving:
+                    raise BrokenPipeError('Connection is lost')
+                for request, future in zip(requests, futures):
+                    request_id = next(self._request_ids)
+                    future.request_id = request_id # для отмены ожидания (send)
+                    frames += protocol.encode_frame(request, request_id)
+                    self._pending[request_id] = future
+                    request_ids.append(request_id)
+                    address = request[1] if len(request) > 1 and type(request[1]) is int else 0
+                    self.trace.record(request[0], address, request_id)
+            with self._send_lock:
+                self.sock.sendall(frames)
+            self.trace_logger.debug('%d request(s) transmitted successfully!', len(requests))
+        except (protocol.ProtocolError, OSError, AttributeError) as error:
+            with self._pending_lock:
+                for request_id in request_ids:
+                    self._pending.pop(request_id, None)
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+        return futures
+
+    def submit(self, data):
+        '''
+        Отправить запрос, не дожидаясь ответа
+        Возвращает:
+            future (Future) - результат - ответ сервера
+        '''
+        return self.submit_many([data])[0]
+
+    def forget(self, future):
+        '''
+        Перестать ждать ответа на запрос (после истечения времени ожидания):
+        поздний ответ будет отброшен как неожиданный
+        '''
+        request_id = getattr(future, 'request_id', None)
+        if request_id is not None:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+    def send(self, data, timeout=None):
+        '''
+        Отправка данных на сервер с ожиданием ответа
+        Принимает:
+            data (list) - запрос
+            timeout (float) - ожидание ответа (секунды), None - _REPLY_TIMEOUT
+        Возвращает:
+            answer (list) - ответ сервера (пустой список при ошибке)
         '''
         self._flag_sending_status = False
-        self.data_from_server = []
+        answer = []
         if self._flag_server_connected:
+            future = self.submit(data)
             try:
-                request = pickle.dumps(data)
-                data_size = sys.getsizeof(request)
-                #todo: получение и передача всех данных???
-                assert data_size <= self._TRANSMIT_CHUNK_SIZE
-                self.sock.send(request)
-                self.logger.debug(f'Data transmitted successfully!')
-                data = self.sock.recv(self._TRANSMIT_CHUNK_SIZE)
-                if not data:
-                    raise BrokenPipeError
-                self.data_from_server = pickle.loads(data)
-                self.logger.debug(f'Data received successfully!')
+                answer = future.result(self._REPLY_TIMEOUT if timeout is None else timeout)
                 self._flag_sending_status = True
-            except AssertionError:
-                # размер данных слишком большой
-                self.logger.warning(f'Can\'t transmit data, because it has big size!')
-            except BrokenPipeError:
+            except concurrent_futures.TimeoutError:
+                self.forget(future)
+                self.logger.warning(f'No reply from the server in time!')
+            except protocol.ProtocolError as error:
+                # кадр не удалось сформировать
+                self.logger.warning(f'Can\'t transmit data: {error}')
+            except OSError:
                 # соединение отсутствует
-                self.logger.info('Connection is lost!')
-                self.close_connection()
+                if self._flag_server_connected:
+                    self.logger.info('Connection is lost!')
+                    self.close_connection()
+        return answer
+
+    def batch(self, ops, abort_on_failure=True, timeout=None):
+        '''
+        Выполнить список операций на сервере за один обмен (запрос 6)
+        Принимает:
+            ops (list) - операции в формате запросов 1-5
+            abort_on_failure (bool) - прекратить выполнение при ошибке или неудачном ожидании
+            timeout (float) - ожидание ответа (секунды), None - _REPLY_TIMEOUT
+        Возвращает:
+            ok (bool) - все операции выполнены успешно
+            results (list) - ответы выполненных операций
+        '''
+        answer = self.send([6, ops, abort_on_failure], timeout)
+        if len(answer) != 2:
+            return False, []
+        return answer[0], answer[1]
 
     def close_connection(self):
         '''
         Закрываем сокет, отключаемся от сервера
         '''
         try:
-            self.sock.close()
+            sock = self.sock
+            self._flag_server_connected = False
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # будим поток приема ответов
+            except OSError:
+                pass
+            sock.close()
             del self.sock
+            self._reader = None
             del self.thread_conn
-            self._flag_server_connected = False
             self.logger.info(f'Connection closed!')
         except AttributeError:
             self.logger.info(f'FPGAClient has no attribute sock!')
@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Asyncio FPGA Client object.
+
+Клиент на потоках asyncio с тем же протоколом, что и FPGAClient.
+Соединение поддерживает супервизор: при обрыве он переподключается
+с экспоненциально растущей паузой, а ожидающие запросы завершаются ошибкой.
+Для окна Tk предусмотрен мост TkBridge: цикл событий работает в отдельном
+потоке, а результаты возвращаются в главный цикл Tk через after().
+'''
+
+import queue
+import random
+import asyncio
+import itertools
+import threading
+
+import app_logger
+import protocol
+import tools
+
+class AsyncFPGAClient():
+    '''
+    Асинхронный FPGA-клиент.
+    '''
+
+    _host = 'localhost' # хост по умолчанию
+    _port = 49094 # порт по умолчанию
+
+    _RECONNECT_DELAY_MIN = 0.1 # начальная пауза между попытками подключения
+    _RECONNECT_DELAY_MAX = 5.0 # максимальная пауза между попытками подключения
+    _RECONNECT_JITTER = 0.1 # случайная добавка к паузе (доля)
+    _CONNECT_TIMEOUT = 10 # время ожидания соединения для запроса (секунды)
+    _NAME_C_DRIVER = 'mem_access.so' # путь к драйверу управления ОЗУ
+
+    def __init__(self):
+        '''
+        При инициализации создаем логгер по умолчанию (в консоль)
+        '''
+        self.logger = app_logger.get_logger(__name__)
+        self.logger.addHandler(app_logger.get_stream_handler())
+        self._supervisor = None
+        self._writer = None
+        self._pending = {} # ожидающие ответа запросы: идентификатор -> Future
+        self._request_ids = itertools.count(1)
+
+    def get_logger(self, name):
+        '''
+        Получить логгер от основного приложения
+        '''
+        self.logger = app_logger.get_logger(name)
+
+    def set_host_port(self, host, *port):
+        '''
+        Задание хоста и порта (по умолчанию localhost:49094)
+        '''
+        if type(host) == str:
+            if tools.check_ip_adress(host):
+                self._host = host
+                self.logger.debug(f'Host has been changed to {self._host}!')
+        if len(port) == 1:
+            if type(port[0]) == int:
+                self._port = port[0]
+                self.logger.debug(f'Port has been changed to {self._port}!')
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def start(self):
+        '''
+        Запустить супервизор соединения
+        '''
+        if self._supervisor is None or self._supervisor.done():
+            self._connected = asyncio.Event()
+            self._supervisor = asyncio.get_running_loop().create_task(self._supervise())
+
+    async def _supervise(self):
+        '''
+        Подключение к серверу и переподключение с экспоненциальной паузой
+        '''
+        delay = self._RECONNECT_DELAY_MIN
+        while True:
+            self.logger.info(f'Connecting to the server {self._host}:{self._port}...')
+            try:
+                reader, writer = await asyncio.open_connection(self._host, self._port)
+            except OSError:
+                pause = delay * (1 + self._RECONNECT_JITTER*random.random())
+                self.logger.warning(f'Failed! Next attempt in {pause:.2f}s')
+                await asyncio.sleep(pause)
+                delay = min(2*delay, self._RECONNECT_DELAY_MAX)
+                continue
+            delay = self._RECONNECT_DELAY_MIN
+            self._writer = writer
+            self._connected.set()
+            self.logger.info(f'Connected successfully!')
+            receiver = asyncio.get_running_loop().create_task(self._receive_replies(reader))
+            try:
+                try:
+                    await self.create_controller()
+                except OSError:
+                    pass
+                await receiver
+            finally:
+                receiver.cancel()
+                self._connected.clear()
+                self._writer = None
+                self._fail_pending(BrokenPipeError('Connection is lost'))
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+            self.logger.info('Connection is lost!')
+
+    async def _receive_replies(self, reader):
+        '''
+        Прием ответов сервера и их сопоставление с запросами по идентификатору
+        '''
+        try:
+            await self._dispatch_replies(reader)
+        finally:
+            self._fail_pending(BrokenPipeError('Connection is lost'))
+
+    async def _dispatch_replies(self, reader):
+        while True:
+            try:
+                header = await reader.readexactly(protocol.HEADER.size)
+                size, request_id = protocol.HEADER.unpack(header)
+                if size > protocol.MAX_MESSAGE_SIZE:
+                    raise protocol.ProtocolError(f'Frame is too big ({size} bytes)')
+                answer = protocol.decode(await reader.readexactly(size))
+            except protocol.ProtocolError as error:
+                self.logger.warning(f'Can\'t receive data: {error}')
+                return
+            except (asyncio.IncompleteReadError, OSError):
+                return
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                self.logger.warning(f'Unexpected reply №{request_id}!')
+            elif not future.done():
+                future.set_result(answer)
+
+    def _fail_pending(self, error):
+        '''
+        Завершить ошибкой все запросы, ожидающие ответа
+        '''
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, data):
+        '''
+        Отправить запрос и дождаться ответа
+        Возвращает:
+            answer (list) - ответ сервера
+        '''
+        if self._supervisor is None:
+            raise BrokenPipeError('AsyncFPGAClient is not started')
+        writer = None
+        while writer is None:
+            # соединение может оборваться, пока мы ждали события
+            await asyncio.wait_for(self._connected.wait(), self._CONNECT_TIMEOUT)
+            writer = self._writer
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            writer.write(protocol.encode_frame(data, request_id))
+            await writer.drain()
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def request_many(self, requests):
+        '''
+        Отправить несколько запросов подряд и собрать ответы
+        Возвращает:
+            answers (list) - ответы в порядке запросов
+        '''
+        return await asyncio.gather(*[self.request(data) for data in requests])
+
+    async def batch(self, ops, abort_on_failure=True):
+        '''
+        Выполнить список операций на сервере за один обмен (запрос 6)
+        Возвращает:
+            ok (bool) - все операции выполнены успешно
+            results (list) - ответы выполненных операций
+        '''
+        ok, results = await self.request([6, ops, abort_on_failure])
+        return ok, results
+
+    async def close(self):
+        '''
+        Остановить супервизор и закрыть соединение
+        '''
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+            self.logger.info(f'Connection closed!')
+
+    async def check_connection(self):
+        '''
+        Проверить соединение с сервером
+        '''
+        return await self.request([254, ])
+
+    async def create_controller(self):
+        '''
+        Создаем контроллер памяти на сервере
+        '''
+        self.logger.info(f'Trying to create memory controller on the server!')
+        return await self.request([252, self._NAME_C_DRIVER])
+
+    async def stop_server(self):
+        '''
+        Остановка сервера посылкой команды 255
+        '''
+        self.logger.info(f'Trying to shut down the server!')
+        try:
+            answer = await self.request([255, ])
+        finally:
+            await self.close()
+        return answer
+
+    async def read_word(self, address):
+        return (await self.request([1, address]))[0]
+
+    async def write_word(self, address, word):
+        return (await self.request([2, address, word]))[0]
+
+    async def read_data(self, address, num_elements, shift):
+        return await self.request([3, address, num_elements, shift])
+
+    async def write_data(self, address, data, shift):
+        return await self.request([4, address, data, shift])
+
+    async def wait_flag(self, address, value, timing, poll_floor=None):
+        request = [5, address, value, timing]
+        if poll_floor is not None:
+            request.append(poll_floor)
+        return (await self.request(request))[0]
+
+
+class TkBridge():
+    '''
+    Мост между главным циклом Tk и циклом событий asyncio.
+    Цикл событий работает в отдельном потоке, готовые результаты
+    складываются в очередь, которую окно Tk разбирает через after().
+    '''
+
+    POLL_INTERVAL = 20 # период разбора очереди результатов (мс)
+
+    def __init__(self, client, widget):
+        self.client = client
+        self.widget = widget
+        self.loop = asyncio.new_event_loop()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._poll_job = None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+            # оставшиеся задачи отменяются и завершаются до закрытия цикла
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        finally:
+            self.loop.close()
+
+    def start(self):
+        '''
+        Запустить цикл событий и супервизор соединения клиента
+        '''
+        self._thread.start()
+        self.submit(self.client.start())
+        self._poll_job = self.widget.after(self.POLL_INTERVAL, self._poll)
+
+    def submit(self, coroutine, callback=None):
+        '''
+        Запустить корутину в цикле событий
+        Принимает:
+            coroutine - корутина (например, client.read_word(address))
+            callback - функция от concurrent.futures.Future, вызывается в потоке Tk
+        Возвращает:
+            future (concurrent.futures.Future)
+        '''
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if callback is not None:
+            future.add_done_callback(lambda done: self._results.put((callback, done)))
+        return future
+
+    def _poll(self):
+        '''
+        Вызвать обработчики готовых результатов в потоке Tk
+        (ошибка обработчика не останавливает разбор очереди)
+        '''
+        try:
+            while True:
+                try:
+                    callback, future = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    callback(future)
+                except Exception:
+                    self.client.logger.exception('Error in a result callback')
+        finally:
+            self._poll_job = self.widget.after(self.POLL_INTERVAL, self._poll)
+
+    def shutdown(self, timeout=5):
+        '''
+        Отменить все операции, закрыть соединение, остановить и закрыть цикл событий
+        '''
+        if self._poll_job is not None:
+            self.widget.after_cancel(self._poll_job)
+            self._poll_job = None
+        if self._thread.is_alive():
+            try:
+                asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result(timeout)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+        elif self._thread.ident is None:
+            self.loop.close() # цикл не запускался
@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+FPGA Server.
+
+Сервер принимает одновременно несколько клиентов (asyncio) и передает
+их запросы контроллеру памяти MemoryController через очередь платы.
+Доступ к плате последователен: запросы выполняет один рабочий поток,
+а очередь выбирает следующий запрос по приоритету соединения и по кругу
+между клиентами одного приоритета, поэтому активный клиент не может
+занять плату целиком. Запросы одного соединения выполняются по порядку.
+
+Служебные запросы (выполняются сразу, без очереди):
+    [251, priority] - задать приоритет соединения (целое >= 0, 0 - высший,
+                      по умолчанию 1);
+    [252, library] - создать контроллер памяти с драйвером library
+                     ('emulator' - эмулятор платы в процессе сервера,
+                     'emulator:32x32' - эмулятор кроссбара другого размера);
+    [253] - статистика: [глубина очереди, [[код, число, p50, p99, max], ...]]
+            (время выполнения в секундах);
+    [254] - проверка соединения;
+    [255] - остановка сервера.
+На служебный запрос с неверными аргументами, как и на запрос не в виде
+непустого списка, сервер отвечает ['Error in request'], соединение
+сохраняется.
+
+Запуск:
+    python3 fpga_server.py --port 49094
+    python3 fpga_server.py --library emulator
+    python3 fpga_server.py --library emulator:64x64
+'''
+
+import time
+import asyncio
+import logging
+import argparse
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol
+import emulator
+from memory_control import MemoryController
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 49094
+DEFAULT_PRIORITY = 1 # приоритет соединения по умолчанию
+STATS_WINDOW = 1000 # число последних операций для расчета задержек
+EMULATOR_LIBRARY = 'emulator' # имя драйвера, заменяемого эмулятором платы
+ERROR_REQUEST = 'Error in request' # ответ на запрос с неверными аргументами
+
+OP_SET_PRIORITY = 251
+OP_CREATE_CONTROLLER = 252
+OP_STATS = 253
+OP_CHECK = 254
+OP_STOP = 255
+
+
+class FairQueue():
+    '''
+    Очередь с приоритетами и круговым обходом клиентов внутри приоритета
+    '''
+
+    def __init__(self):
+        self._levels = {} # приоритет -> OrderedDict(клиент -> deque заданий)
+        self._size = 0
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, priority, client, job):
+        clients = self._levels.setdefault(priority, collections.OrderedDict())
+        clients.setdefault(client, collections.deque()).append(job)
+        self._size += 1
+        self._ready.set()
+
+    async def get(self):
+        '''
+        Взять следующее задание
+        '''
+        while not self._size:
+            self._ready.clear()
+            await self._ready.wait()
+        priority = min(level for level, clients in self._levels.items() if clients)
+        clients = self._levels[priority]
+        client, jobs = next(iter(clients.items()))
+        job = jobs.popleft()
+        if jobs:
+            clients.move_to_end(client) # следующий клиент этого приоритета
+        else:
+            del clients[client]
+        self._size -= 1
+        return job
+
+    def drop(self, client):
+        '''
+        Удалить задания отключившегося клиента
+        '''
+        for clients in self._levels.values():
+            jobs = clients.pop(client, None)
+            if jobs:
+                self._size -= len(jobs)
+
+
+class OpStats():
+    '''
+    Статистика времени выполнения операций одного кода
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.max = 0.0
+        self.latencies = collections.deque(maxlen=STATS_WINDOW)
+
+    def add(self, latency):
+        self.count += 1
+        self.max = max(self.max, latency)
+        self.latencies.append(latency)
+
+    def percentile(self, fraction):
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction*len(ordered)))]
+
+
+class Board():
+    '''
+    Плата: контроллер памяти, очередь запросов и рабочий поток
+    '''
+
+    def __init__(self):
+        self.controller = None
+        self.emulator = None
+        self.queue = FairQueue()
+        self.stats = collections.defaultdict(OpStats)
+        self._executor = ThreadPoolExecutor(max_workers=1) # доступ к плате последователен
+        self.logger = logging.getLogger(__name__)
+
+    async def create_controller(self, library):
+        '''
+        Создать контроллер памяти (если он еще не создан)
+        '''
+        if self.controller is None:
+            name, _, geometry = library.partition(':')
+            if name == EMULATOR_LIBRARY:
+                self.emulator = emulator.FPGAEmulator(geometry or '4x4').start()
+                self.controller = MemoryController(driver=self.emulator)
+            else:
+                loop = asyncio.get_running_loop()
+                self.controller = await loop.run_in_executor(self._executor, MemoryController, library)
+            self.logger.info('Memory controller has been created with %s', library)
+        return [True]
+
+    async def run(self):
+        '''
+        Выполнение запросов из очереди
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            request, reply = await self.queue.get()
+            if self.controller is None:
+                reply(['Memory controller is not created'])
+                continue
+            start = time.perf_counter()
+            answer = await loop.run_in_executor(self._executor, self.controller.request, request)
+            self.stats[request[0]].add(time.perf_counter() - start)
+            reply(answer)
+
+    def report(self):
+        '''
+        Глубина очереди и задержки по кодам операций
+        '''
+        rows = []
+        for op, stats in sorted(self.stats.items()):
+            rows.append([op, stats.count, stats.percentile(0.5), stats.percentile(0.99), stats.max])
+        return [len(self.queue), rows]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        if self.emulator is not None:
+            self.emulator.stop()
+
+
+class FPGAServer():
+    '''
+    Сервер управления платой для нескольких клиентов
+    '''
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, library=None):
+        self.host = host
+        self.port = port
+        self.library = library # драйвер, заменяющий указанный клиентом
+        self.board = Board()
+        self.logger = logging.getLogger(__name__)
+        self._stop = None
+        self._loop = None # цикл событий serve (stop может вызываться из других потоков)
+        self._clients = itertools.count(1) # идентификаторы клиентов
+        self._handlers = {} # задачи обслуживания соединений -> writer
+
+    async def serve(self):
+        '''
+        Запустить сервер и работать до запроса остановки
+        '''
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        worker = asyncio.get_running_loop().create_task(self.board.run())
+        self.logger.info('Server is listening on %s:%d', self.host, self.port)
+        async with server:
+            await self._stop.wait()
+        for writer in list(self._handlers.values()):
+            writer.close() # соединения завершатся сами
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        worker.cancel()
+        self.board.shutdown()
+        self.logger.info('Server has been stopped')
+
+    def stop(self):
+        '''
+        Запросить остановку сервера (из любого потока)
+        '''
+        if self._stop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _handle_client(self, reader, writer):
+        '''
+        Обслуживание одного соединения
+        '''
+        client = next(self._clients)
+        self._handlers[asyncio.current_task()] = writer
+        priority = DEFAULT_PRIORITY
+        peer = writer.get_extra_info('peername')
+        self.logger.info('Client %d connected from %s', client, peer)
+
+        def reply_to(request_id):
+            def reply(answer):
+                if not writer.is_closing():
+                    writer.write(protocol.encode_frame(answer, request_id))
+            return reply
+
+        try:
+            while True:
+                header = await reader.readexactly(protocol.HEADER.size)
+                size, request_id = protocol.HEADER.unpack(header)
+                if size > protocol.MAX_MESSAGE_SIZE:
+                    raise protocol.ProtocolError(f'Frame is too big ({size} bytes)')
+                request = protocol.decode(await reader.readexactly(size))
+                reply = reply_to(request_id)
+                op = request[0] if type(request) is list and request else None
+                if op is None:
+                    self.logger.warning('Client %d sent a request that is not a list: %r', client, request)
+                    reply([ERROR_REQUEST])
+                elif op == OP_SET_PRIORITY:
+                    if len(request) != 2 or type(request[1]) is not int or request[1] < 0:
+                        self.logger.warning('Client %d sent a bad priority request: %r', client, request)
+                        reply([ERROR_REQUEST])
+                    else:
+                        priority = request[1]
+                        reply([True])
+                elif op == OP_CREATE_CONTROLLER:
+                    library = self.library or (request[1] if len(request) == 2 else None)
+                    if type(library) is not str:
+                        self.logger.warning('Client %d sent a bad controller request: %r', client, request)
+                        reply([ERROR_REQUEST])
+                    else:
+                        try:
+                            reply(await self.board.create_controller(library))
+                        except (OSError, ValueError, KeyError, TypeError): # нет драйвера или неверное описание кроссбара
+                            self.logger.exception('Can\'t create memory controller')
+                            reply(['Error in MemoryController'])
+                elif op == OP_STATS:
+                    reply(self.board.report())
+                elif op == OP_CHECK:
+                    reply([True])
+                elif op == OP_STOP:
+                    reply([True])
+                    await writer.drain()
+                    self.stop()
+                    break
+                else:
+                    self.board.queue.put(priority, client, (request, reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except protocol.ProtocolError as error:
+            self.logger.warning('Client %d sent a bad frame: %s', client, error)
+        finally:
+            self.board.queue.drop(client)
+            self._handlers.pop(asyncio.current_task(), None)
+            writer.close()
+            self.logger.info('Client %d disconnected', client)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='Host to listen')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen')
+    parser.add_argument('--library', type=str, default=None, help='Driver library (overrides the client one)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(FPGAServer(args.host, args.port, args.library).serve())
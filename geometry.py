@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Crossbar geometry descriptor.
+
+Описание кроссбара: размер, карта регистров платы, калибровка каналов
+и формат управляющего слова программирования. Все пути (тестирование,
+программирование, эмулятор, GUI) берут размеры и адреса отсюда.
+
+Готовые описания: '4x4' (текущая плата), '32x32', '64x64'. Описание
+можно загрузить из JSON-файла:
+    {"rows": 32, "cols": 32, "registers": {"test_data": 3221291008},
+     "calibration": ["first", "second", ...]}
+'''
+
+import json
+import itertools
+
+import control_word
+
+# карта регистров платы 4x4
+REGISTERS = {
+    'state': 0xC0000000, # 1 - ПЛИС готова, 0 - занята
+    'flags': 0xC0000004, # флаг результата
+    'fifo': 0xC0000010, # FIFO команд
+    'test_data': 0xC0000040, # результаты тестирования (по слову на ячейку)
+    'prog_result': 0xC0000080, # итоговое значение программирования
+    'prog_attempts': 0xC0000084, # число выполненных попыток
+    'history': 0xC0004000, # история программирования
+    'mvm_input': 0xC0008000, # входной вектор умножения (мВ, int32 на столбец)
+    'mvm_output': 0xC0008400, # выходные токи умножения (нА, int32 на строку)
+}
+LARGE_TEST_DATA_ADDR = 0xC0010000 # результаты тестирования больших матриц (до 0xC0020000)
+
+CMD_TEST = 0xA1
+CMD_PROGRAM = 0xB2 # [0xB2, слово], номер элемента в слове
+CMD_PROGRAM_CELL = 0xB3 # [0xB3, номер элемента, слово], номер элемента отдельным словом
+CMD_MVM = 0xC3 # умножение матрицы проводимостей на входной вектор
+RESULT_TEST = 0x1
+RESULT_PROGRAM = 0x2
+RESULT_MVM = 0x3
+
+CALIBRATIONS = ('first', 'second') # калибровки каналов (tools.conv_to_resistance, ..._second)
+HISTORY_LENGTH = 461 # длина истории программирования
+
+
+class CrossbarGeometry():
+    '''
+    Описание кроссбара
+    '''
+
+    def __init__(self, rows=4, cols=4, registers=None, calibration=None, word_format=None):
+        '''
+        Принимает:
+            rows, cols (int) - размер кроссбара
+            registers (dict) - адреса регистров, отличающиеся от REGISTERS
+            calibration (list) - калибровка каждой строки-канала (из CALIBRATIONS, см. calibration.py)
+            word_format (ControlWordCodec) - формат управляющего слова
+        '''
+        self.rows = rows
+        self.cols = cols
+        self.registers = dict(REGISTERS)
+        self.registers.update(registers or {})
+        self.calibration = list(calibration or ['first']*rows)
+        self.word_format = word_format or control_word.ControlWordCodec()
+        self.validate()
+
+    @property
+    def cells(self):
+        return self.rows*self.cols
+
+    @property
+    def program_command(self):
+        '''
+        Команда программирования: номер элемента в слове, если он помещается
+        в поле слова, иначе отдельным словом
+        '''
+        if self.cells - 1 <= self.word_format.limit('element'):
+            return CMD_PROGRAM
+        return CMD_PROGRAM_CELL
+
+    def validate(self):
+        if self.rows < 1 or self.cols < 1:
+            raise ValueError(f'Wrong crossbar size {self.rows}x{self.cols}')
+        if len(self.calibration) != self.rows:
+            raise ValueError(f'Calibration is needed for each of {self.rows} channels')
+        unknown = set(self.calibration) - set(CALIBRATIONS)
+        if unknown:
+            raise ValueError(f'Unknown calibrations: {sorted(unknown)}')
+        blocks = self.blocks()
+        for first, second in itertools.combinations(sorted(blocks, key=blocks.get), 2):
+            (start, size), (other_start, other_size) = blocks[first], blocks[second]
+            if other_start < start + size and start < other_start + other_size:
+                raise ValueError(f'Register block {first} ({size} bytes) overlaps {second} '
+                                 f'in {self.rows}x{self.cols} geometry')
+
+    def blocks(self):
+        '''
+        Области памяти регистров: имя -> (адрес, размер в байтах)
+        '''
+        sizes = {'test_data': 4*self.cells, 'history': 4*HISTORY_LENGTH,
+                 'mvm_input': 4*self.cols, 'mvm_output': 4*self.rows}
+        return {name: (address, sizes.get(name, 4)) for name, address in self.registers.items()}
+
+    def cell_number(self, row, col):
+        '''
+        Номер ячейки (от 0) по строке и столбцу
+        '''
+        return row*self.cols + col
+
+    def channel(self, cell):
+        '''
+        Канал (строка) ячейки
+        '''
+        return cell // self.cols
+
+    def to_dict(self):
+        return {'rows': self.rows, 'cols': self.cols, 'registers': self.registers,
+                'calibration': self.calibration, 'word_format': self.word_format.fields}
+
+    @classmethod
+    def from_dict(cls, description):
+        word_format = description.get('word_format')
+        return cls(description['rows'], description['cols'], description.get('registers'),
+                   description.get('calibration'),
+                   control_word.ControlWordCodec({name: tuple(field) for name, field in word_format.items()})
+                   if word_format else None)
+
+    def __repr__(self):
+        return f'CrossbarGeometry({self.rows}x{self.cols})'
+
+
+PRESETS = {
+    '4x4': lambda: CrossbarGeometry(4, 4, calibration=['first', 'second', 'first', 'first']),
+    '32x32': lambda: CrossbarGeometry(32, 32, registers={'test_data': LARGE_TEST_DATA_ADDR}),
+    '64x64': lambda: CrossbarGeometry(64, 64, registers={'test_data': LARGE_TEST_DATA_ADDR}),
+}
+
+
+def get_geometry(name='4x4'):
+    '''
+    Описание кроссбара по имени готового описания или пути к JSON-файлу
+    '''
+    if isinstance(name, CrossbarGeometry):
+        return name
+    if name in PRESETS:
+        return PRESETS[name]()
+    with open(name) as description_file:
+        return CrossbarGeometry.from_dict(json.load(description_file))
@@ -10,7 +10,6 @@ GUI for the Data Manager
 
 import os
 import pickle
-import pandastable as pdt
 import tkinter as tkn
 import tkinter.ttk as ttk
 from tkinter import filedialog as fd
@@ -46,6 +45,11 @@ class DataManager(tkn.Frame):
         clear_button.pack(side=tkn.LEFT)
         gui_elements.create_alt_window(clear_button,'Clear Data')
 
+        self.import_progress = ttk.Progressbar(load_tab, length=200, maximum=100)
+        self.import_progress.pack(side=tkn.LEFT, padx=5)
+        self.import_progress_label = ttk.Label(load_tab, text='')
+        self.import_progress_label.pack(side=tkn.LEFT)
+
         # --- Очистка
         clean_tab = tkn.Frame(top_part)
         top_part.add(clean_tab, text ='Очистка')
@@ -80,28 +84,37 @@ class DataManager(tkn.Frame):
         bottom_part = ttk.Frame(self)
         bottom_part.pack(fill=tkn.BOTH, expand=True)
 
-        self.current_table = pdt.Table(bottom_part, dataframe=None, showtoolbar=0, showstatusbar=1)
-        self.current_table.enable_menus = False
+        bottom_part.grid_rowconfigure(0, weight=1)
+        bottom_part.grid_columnconfigure(0, weight=1)
+
+        # показываются только видимые строки текущей версии набора данных
+        self.current_table = gui_elements.VirtualTable(bottom_part)
         self.current_table.grid(row=0, column=0, sticky=tkn.NSEW)
-        self.current_table.show()
 
     def click_export_button(self, export_type):
         '''
         датасет разбивается здесь
         второй файл можно добавить здесь
 
+        Сохраняется текущая версия набора данных (после очистки),
+        целиком таблица собирается только здесь
         '''
-        #open save file dialog получить имя файла для экспорта
-        #file_path =
+        if self.data_storage.dataset is None:
+            return
+        file_path = fd.asksaveasfilename(defaultextension='.'+export_type,
+                                         filetypes=((export_type, '*.'+export_type), ("All files", "*.*")))
+        if not file_path:
+            return
 
         if export_type == 'csv':
             # просто сохраняем последний вариант таблицы
-            pass
+            self.data_storage.export_csv(file_path)
         elif export_type == 'pickle':
             #1 Спросить нужно ли добавить тестовую выборку или разбить датасет
             #2 Проверить датасет на выполнение условий
             #3 Только потом сохранить
-            if self.controller.data.check_dataset(processed_data_set) == True:
+            processed_data_set = self.data_storage.export_data()
+            if self.data_storage.check_dataset(processed_data_set) == True:
                 '''
                 Это всё относится к хранилищу данных
 
@@ -110,21 +123,34 @@ class DataManager(tkn.Frame):
                 with open(file_path, 'wb') as file:
                     pickle.dump(processed_data_set, file, pickle.HIGHEST_PROTOCOL)
                     print('Результаты эксперимента сохранены!')
-                    self.controller.update_message('Сеть успешно пересохранена \n')
 
     def click_import_button(self):
-
-        self.current_table.importCSV(dialog=True)
-        self.data_storage.set_csv_data(self.current_table.model.df)
+        '''
+        CSV загружается в хранилище частями, таблица показывает его текущую версию
+        '''
+        file_path = fd.askopenfilename(filetypes=(("csv", "*.csv"), ("All files", "*.*")))
+        if not file_path:
+            return
+        self.data_storage.file_path = file_path
+        self.data_storage.load_csv(progress=self.show_import_progress)
+        self.import_progress_label['text'] = str(self.data_storage.csv_stats)
+        self.current_table.set_source(self.data_storage.dataset.current)
+
+    def show_import_progress(self, fraction, message):
+        self.import_progress['value'] = 100*fraction
+        self.import_progress_label['text'] = message
+        self.update_idletasks()
 
     def click_clear_button(self):
         #todo: через датаменеджер!!!
 
-        self.current_table.clearTable()
+        self.current_table.set_source(None)
 
     def clear_set(self):
-        # create local copy of a dataset
-        self.local_dataset = self.controller.data.csv_data.copy()
+        if self.data_storage.dataset is None:
+            return
+        # шаги очистки записываются версиями набора данных, копия не создается
+        self.local_dataset = self.data_storage.dataset
 
         # create new window
         self.clear_set_window = tkn.Toplevel(self)
@@ -139,8 +165,14 @@ class DataManager(tkn.Frame):
         fill_button = ttk.Button(button_frame, text='Fill', command=self.fill_lines_set)
         fill_button.grid(row=0, column=1)
 
+        self.clear_set_window.undo_button = ttk.Button(button_frame, text='Undo', command=self.undo_clean_set)
+        self.clear_set_window.undo_button.grid(row=0, column=2)
+
+        self.clear_set_window.redo_button = ttk.Button(button_frame, text='Redo', command=self.redo_clean_set)
+        self.clear_set_window.redo_button.grid(row=0, column=3)
+
         apply_button = ttk.Button(button_frame, text='Apply', command=self.apply_clean_set)
-        apply_button.grid(row=0, column=2)
+        apply_button.grid(row=0, column=4)
 
         # Local Viewer Frame
         local_viewer_frame = tkn.Frame(self.clear_set_window)
@@ -155,33 +187,42 @@ class DataManager(tkn.Frame):
 
         # Info Frame
         self.clear_set_window.info_frame = tkn.Frame(self.clear_set_window)
-        self.clear_set_window.info_frame.grid(row=0, column=1, rowspan=2)
+        self.clear_set_window.info_frame.grid(row=0, column=1, rowspan=2, sticky='news')
 
-        #todo: заменить на таблицу
-        self.clear_set_window.info_viewer = tkn.Text(self.clear_set_window.info_frame, width=50, height=20)
-        scy = ttk.Scrollbar(local_viewer_frame,command=self.clear_set_window.info_viewer.yview)
-        self.clear_set_window.info_viewer.configure(yscrollcommand=scy.set)
-        self.clear_set_window.info_viewer.grid(row=0, column=0, sticky='news')
-        scy.grid(row=0, column=1, sticky='ns')
+        self.clear_set_window.info_label = ttk.Label(self.clear_set_window.info_frame, text='')
+        self.clear_set_window.info_label.grid(row=0, column=0, sticky=tkn.W)
+        self.clear_set_window.profile_table = gui_elements.ProfileTable(self.clear_set_window.info_frame)
+        self.clear_set_window.profile_table.grid(row=1, column=0, sticky='news')
 
         # выбрать столбцы участвующие в обучении
         pass
 
-        # обновили вид локальной таблицы
-        data = self.local_dataset.head()
+        self.update_clean_set()
+
+    def update_clean_set(self):
+        '''
+        Обновить вид локальной таблицы и информацию для очистки по текущей версии
+        '''
+        version = self.local_dataset.current
         table = self.clear_set_window.local_dataset_viewer
-        self.update_local_table(table,data)
+        self.update_local_table(table, version.head())
 
-        # обновим информацию для очистки
-        data = self.local_dataset.isnull().sum()
-        table = self.clear_set_window.info_viewer
-        self.update_local_table(table, data)
+        # профили обновляются только по строкам, изменившимся после прошлого шага
+        self.clear_set_window.info_label['text'] = (f'{version.shape[0]} rows x {version.shape[1]} columns, '
+                                                    f'last step: {version.operation}')
+        self.clear_set_window.profile_table.set_profile(self.data_storage.get_profile())
+
+        self.clear_set_window.undo_button.state(['!disabled' if self.local_dataset.can_undo else 'disabled'])
+        self.clear_set_window.redo_button.state(['!disabled' if self.local_dataset.can_redo else 'disabled'])
 
     def update_data_set(self):
         '''
         обновлять данные в дата DataStorage
+        (версии общие с хранилищем, сюда попадает только итог очистки)
         '''
-        pass
+        version = self.local_dataset.current
+        self.import_progress_label['text'] = f'{version.shape[0]} rows x {version.shape[1]} columns ({version.operation})'
+        self.current_table.set_source(version)
 
     def apply_clean_set(self):
         self.clear_set_window.destroy()
@@ -195,22 +236,22 @@ class DataManager(tkn.Frame):
         table.insert(1.0, data)
 
     def drop_lines_set(self):
-        # удалили строки
-        self.local_dataset.dropna(inplace=True)
-        # обновили вид локальной таблицы
-        data = self.local_dataset.head()
-        table = self.clear_set_window.local_dataset_viewer
-        self.update_local_table(table,data)
-        # обновим информацию для очистки
-        data = self.local_dataset.isnull().sum()
-        table = self.clear_set_window.info_viewer
-        self.update_local_table(table, data)
+        # удалили строки с пропусками (новая версия, исходная таблица не меняется)
+        self.local_dataset.drop_na()
+        self.update_clean_set()
 
     def fill_lines_set(self):
-        # удалили строки
-        pass
-        # обновили вид локальной таблицы
-        self.update_local_table()
+        # заполнили пропуски медианой или самым частым значением
+        self.local_dataset.fill_na()
+        self.update_clean_set()
+
+    def undo_clean_set(self):
+        self.local_dataset.undo()
+        self.update_clean_set()
+
+    def redo_clean_set(self):
+        self.local_dataset.redo()
+        self.update_clean_set()
 
     def transf_set(self):
         pass
@@ -6,6 +6,14 @@ Different elements for the GUI
 '''
 
 import tkinter as tkn
+import tkinter.ttk as ttk
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+import dataset_versions
 
 class AltWindow():
     '''
@@ -29,4 +37,481 @@ def create_alt_window(obj, text):
     popup_window = AltWindow()
     popup_window.text = text
     obj.bind('<Enter>',popup_window._create)
-    obj.bind('<Leave>',popup_window._destroy)
\ No newline at end of file
+    obj.bind('<Leave>',popup_window._destroy)
+
+class MatrixView(tkn.Canvas):
+    '''
+    Карта матрицы на одном Canvas: ячейка - прямоугольник, цвет - значение,
+    подписи выводятся, пока ячейки достаточно крупные. Нажатие на ячейку
+    передается в on_click(номер ячейки от 1).
+    '''
+
+    MAX_SIZE = 320 # размер карты (пикселей)
+    MIN_LABEL_CELL = 24 # минимальный размер ячейки с подписью (пикселей)
+    EMPTY_COLOR = '#d9d9d9'
+
+    def __init__(self, master, rows, cols, on_click=None, **kwargs):
+        self.rows = rows
+        self.cols = cols
+        self.cell_size = max(2, min(self.MAX_SIZE // max(rows, cols), 2*self.MIN_LABEL_CELL))
+        tkn.Canvas.__init__(self, master, width=cols*self.cell_size, height=rows*self.cell_size,
+                            highlightthickness=0, **kwargs)
+        self.on_click = on_click
+        self.show_labels = self.cell_size >= self.MIN_LABEL_CELL
+        self.rects = []
+        self.labels = []
+        self.range = (0, 0) # диапазон значений для цвета
+        size = self.cell_size
+        for k in range(rows*cols):
+            i, j = divmod(k, cols)
+            self.rects.append(self.create_rectangle(j*size, i*size, (j + 1)*size, (i + 1)*size, fill=self.EMPTY_COLOR,
+                                                    outline='gray' if self.show_labels else ''))
+            if self.show_labels:
+                self.labels.append(self.create_text((j + 0.5)*size, (i + 0.5)*size, text=f'{k+1}'))
+        self.bind('<Button-1>', self._click)
+
+    def cell_at(self, x, y):
+        '''
+        Номер ячейки (от 1) по координатам или None
+        '''
+        i, j = int(y // self.cell_size), int(x // self.cell_size)
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            return i*self.cols + j + 1
+        return None
+
+    def _click(self, event):
+        cell = self.cell_at(event.x, event.y)
+        if cell is not None and self.on_click is not None:
+            self.on_click(cell)
+
+    @staticmethod
+    def _color(level):
+        '''
+        Цвет значения от 0 до 1 (синий - красный)
+        '''
+        red = int(255*level)
+        return f'#{red:02x}40{255-red:02x}'
+
+    def set_value(self, cell, value, low=None, high=None):
+        '''
+        Обновить одну ячейку (номер от 1)
+        '''
+        if low is None or high is None:
+            low, high = min(self.range[0], value), max(self.range[1], value)
+        level = 0.0 if high <= low else min(1.0, max(0.0, (value - low)/(high - low)))
+        self.itemconfigure(self.rects[cell - 1], fill=self._color(level))
+        if self.show_labels:
+            self.itemconfigure(self.labels[cell - 1], text=f'{int(value)}')
+
+    def set_values(self, values):
+        '''
+        Обновить все ячейки по списку значений (в порядке номеров ячеек)
+        '''
+        values = list(values)
+        low, high = self.range = min(values), max(values)
+        for cell, value in enumerate(values, 1):
+            self.set_value(cell, value, low, high)
+
+
+def minmax_decimate(values, max_points):
+    '''
+    Прореживание по минимумам и максимумам: ряд делится на max_points//2
+    интервалов, от каждого остаются минимум и максимум, поэтому выбросы
+    не пропадают; интервал из одних NaN дает NaN (разрыв линии сохраняется)
+    Возвращает:
+        x, y (np.ndarray) - номера отсчетов и значения
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    buckets = max_points // 2
+    if len(values) <= max_points or buckets < 1:
+        return np.arange(len(values)), values
+    size = -(-len(values) // buckets) # округление вверх
+    padded = np.full(buckets*size, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(buckets, size)
+    starts = np.arange(buckets)*size
+    used = starts < len(values) # интервалы только из дополнения отбрасываются
+    padded, starts = padded[used], starts[used]
+    # в интервале из одних NaN оба индекса - 0, значение - NaN
+    with np.errstate(invalid='ignore'):
+        low_index = np.nanargmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+        high_index = np.nanargmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    first = np.minimum(low_index, high_index) # порядок точек внутри интервала сохраняется
+    second = np.maximum(low_index, high_index)
+    rows = np.arange(len(padded))
+    x = np.column_stack([starts + first, starts + second]).reshape(-1)
+    y = np.column_stack([padded[rows, first], padded[rows, second]]).reshape(-1)
+    return x, y
+
+
+class HistoryPlot(tkn.Frame):
+    '''
+    Встроенный график историй программирования. Линия каждого элемента
+    создается один раз и дальше обновляется через set_data; длинные ряды
+    прореживаются по минимумам и максимумам до max_points точек.
+    '''
+
+    def __init__(self, master, max_points=1000, min_value=None, figsize=(4, 2.5), **kwargs):
+        '''
+        Принимает:
+            max_points (int) - максимальное число точек линии
+            min_value (float) - значения меньше не отображаются (разрывы линии)
+        '''
+        tkn.Frame.__init__(self, master, **kwargs)
+        self.max_points = max_points
+        self.min_value = min_value
+        self.figure = Figure(figsize=figsize, dpi=100)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.axes.set_xlabel('Sample')
+        self.axes.set_ylabel('kOhm')
+        self.figure.tight_layout()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(fill=tkn.BOTH, expand=True)
+        self.lines = {} # элемент -> линия
+        self.data = {} # элемент -> (буфер значений, число значений)
+
+    def _values(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self.min_value is not None:
+            values = np.where(values < self.min_value, np.nan, values)
+        return values
+
+    def set_data(self, element, values):
+        '''
+        Заменить историю элемента
+        '''
+        values = self._values(values)
+        buffer, count = self.data.get(element, (None, 0))
+        if buffer is None or len(buffer) < len(values):
+            buffer = np.empty(max(len(values), 16))
+        buffer[:len(values)] = values
+        self.data[element] = (buffer, len(values))
+        self._update(element)
+
+    def append(self, element, values):
+        '''
+        Дописать отсчеты к истории элемента (буфер растет удвоением)
+        '''
+        values = self._values(values)
+        buffer, count = self.data.get(element, (np.empty(16), 0))
+        if count + len(values) > len(buffer):
+            grown = np.empty(max(2*len(buffer), count + len(values)))
+            grown[:count] = buffer[:count]
+            buffer = grown
+        buffer[count:count+len(values)] = values
+        self.data[element] = (buffer, count + len(values))
+        self._update(element)
+
+    def _update(self, element):
+        buffer, count = self.data[element]
+        x, y = minmax_decimate(buffer[:count], self.max_points)
+        line = self.lines.get(element)
+        if line is None:
+            line, = self.axes.plot(x, y, linewidth=1, label=f'{element}')
+            self.lines[element] = line
+            self.axes.legend(loc='best', fontsize='small')
+        else:
+            line.set_data(x, y)
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.canvas.draw_idle() # перерисовка, когда Tk свободен
+
+    def remove(self, element):
+        line = self.lines.pop(element, None)
+        self.data.pop(element, None)
+        if line is not None:
+            line.remove()
+            if self.lines:
+                self.axes.legend(loc='best', fontsize='small')
+            elif self.axes.get_legend() is not None:
+                self.axes.get_legend().remove()
+            self.canvas.draw_idle()
+
+    def clear(self):
+        for element in list(self.lines):
+            self.remove(element)
+
+
+class CommandPanel(tkn.Frame):
+    '''
+    Панель очереди команд CommandExecutor: название, состояние, прогресс;
+    выбранные команды можно отменить
+    '''
+
+    MAX_FINISHED = 100 # число хранимых строк завершенных команд
+
+    def __init__(self, master, executor, **kwargs):
+        tkn.Frame.__init__(self, master, **kwargs)
+        self.executor = executor
+        self.tree = ttk.Treeview(self, columns=('state', 'progress'), height=8)
+        self.tree.heading('#0', text='Command')
+        self.tree.heading('state', text='State')
+        self.tree.heading('progress', text='Progress')
+        self.tree.column('#0', width=260)
+        self.tree.column('state', width=80)
+        self.tree.column('progress', width=160)
+        scy = ttk.Scrollbar(self, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scy.set)
+        self.tree.grid(row=0, column=0, columnspan=2, sticky='news')
+        scy.grid(row=0, column=2, sticky='ns')
+        ttk.Button(self, text='Cancel', command=self.cancel_selected).grid(row=1, column=0, sticky=tkn.W)
+        ttk.Button(self, text='Cancel all', command=self.executor.cancel_all).grid(row=1, column=1, sticky=tkn.W)
+        self.finished = []
+        executor.listeners.append(self.update_command)
+
+    def update_command(self, command):
+        '''
+        Обновить строку команды (вызывается исполнителем в потоке Tk)
+        '''
+        item = str(command.number)
+        progress = f'{100*command.progress:.0f}% {command.message}'.strip()
+        if self.tree.exists(item):
+            self.tree.item(item, values=(command.state, progress))
+        else:
+            self.tree.insert('', tkn.END, iid=item, text=command.name, values=(command.state, progress))
+        if command.number not in self.executor.commands and item not in self.finished:
+            self.finished.append(item)
+            while len(self.finished) > self.MAX_FINISHED:
+                self.tree.delete(self.finished.pop(0))
+
+    def cancel_selected(self):
+        for item in self.tree.selection():
+            self.executor.cancel(int(item))
+
+
+class ProfileTable(tkn.Frame):
+    '''
+    Таблица профилей столбцов (column_profile.DatasetProfiler.profile):
+    строка на столбец набора данных
+    '''
+
+    COLUMNS = ('dtype', 'count', 'nulls', 'infinite', 'filled', 'min', 'max', 'mean', 'std', 'unique')
+
+    def __init__(self, master, height=12, **kwargs):
+        tkn.Frame.__init__(self, master, **kwargs)
+        self.tree = ttk.Treeview(self, columns=self.COLUMNS, height=height)
+        self.tree.heading('#0', text='Column')
+        self.tree.column('#0', width=120)
+        for name in self.COLUMNS:
+            self.tree.heading(name, text=name.capitalize())
+            self.tree.column(name, width=70, anchor=tkn.E)
+        scy = ttk.Scrollbar(self, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scy.set)
+        self.tree.grid(row=0, column=0, sticky='news')
+        scy.grid(row=0, column=1, sticky='ns')
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+    @staticmethod
+    def format_value(value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ''
+        if isinstance(value, (float, np.floating)):
+            return f'{value:.4g}'
+        return str(value)
+
+    def set_profile(self, profile):
+        '''
+        Показать профили (pd.DataFrame, индекс - имена столбцов)
+        '''
+        self.tree.delete(*self.tree.get_children())
+        for name, row in profile.iterrows():
+            self.tree.insert('', tkn.END, text=str(name),
+                             values=[self.format_value(row.get(column)) for column in self.COLUMNS])
+
+
+class VirtualTable(tkn.Frame):
+    '''
+    Таблица для больших наборов данных. Строки Treeview создаются только
+    для видимого окна; при прокрутке окно заново берется из столбцов
+    источника (DatasetVersion.take). Сортировка (щелчок по заголовку) и
+    фильтр меняют только массив номеров строк order, таблица источника
+    не переставляется и не копируется.
+    '''
+
+    ROW_HEIGHT = 20 # высота строки Treeview (пиксели), если стиль ее не задает
+    COLUMN_WIDTH = 90
+
+    def __init__(self, master, **kwargs):
+        tkn.Frame.__init__(self, master, **kwargs)
+        self.source = None # DatasetVersion
+        self.order = None # номера строк источника в порядке показа (None - все по порядку)
+        self.sorting = None # (столбец, по возрастанию)
+        self.condition = None # (столбец, условие DatasetVersion.match)
+        self.first = 0 # первая видимая строка
+        self.visible = 1 # число видимых строк
+        self.row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or self.ROW_HEIGHT)
+
+        filter_frame = tkn.Frame(self)
+        filter_frame.grid(row=0, column=0, columnspan=2, sticky='we')
+        ttk.Label(filter_frame, text='Filter').pack(side=tkn.LEFT)
+        self.filter_column = ttk.Combobox(filter_frame, state='readonly', width=15)
+        self.filter_column.pack(side=tkn.LEFT)
+        self.filter_entry = ttk.Entry(filter_frame, width=20)
+        self.filter_entry.pack(side=tkn.LEFT)
+        self.filter_entry.bind('<Return>', lambda event: self.apply_filter())
+        ttk.Button(filter_frame, text='Apply', command=self.apply_filter).pack(side=tkn.LEFT)
+        ttk.Button(filter_frame, text='Reset', command=self.reset_filter).pack(side=tkn.LEFT)
+        self.status = ttk.Label(filter_frame, text='')
+        self.status.pack(side=tkn.LEFT, padx=10)
+
+        self.tree = ttk.Treeview(self, show='headings', selectmode='browse')
+        self.tree.grid(row=1, column=0, sticky='news')
+        self.scrollbar = ttk.Scrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=1, column=1, sticky='ns')
+        scx = ttk.Scrollbar(self, orient=tkn.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=scx.set)
+        scx.grid(row=2, column=0, sticky='we')
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind('<Configure>', self._resize)
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll(self.wheel_rows(event.delta)))
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(3))
+
+    @property
+    def rows(self):
+        if self.source is None:
+            return 0
+        return len(self.source) if self.order is None else len(self.order)
+
+    def set_source(self, source):
+        '''
+        Показать набор данных (DatasetVersion, pd.DataFrame или None - очистить)
+        '''
+        if isinstance(source, pd.DataFrame):
+            source = dataset_versions.DatasetVersion(source)
+        self.source = source
+        columns = [] if source is None else [str(name) for name in source.columns]
+        self.tree.delete(*self.tree.get_children())
+        self.tree['columns'] = columns
+        if self.sorting is not None and self.sorting[0] not in columns:
+            self.sorting = None
+        if self.condition is not None and self.condition[0] not in columns:
+            self.condition = None
+        for name in columns:
+            self.tree.column(name, width=self.COLUMN_WIDTH, anchor=tkn.E, stretch=False)
+        self._update_headings()
+        self.filter_column['values'] = columns
+        if columns and self.filter_column.get() not in columns:
+            self.filter_column.set(columns[0])
+        self._reorder()
+
+    def _update_headings(self):
+        for name in self.tree['columns']:
+            mark = ''
+            if self.sorting is not None and self.sorting[0] == name:
+                mark = ' ▲' if self.sorting[1] else ' ▼'
+            self.tree.heading(name, text=name + mark, command=lambda name=name: self.sort(name))
+
+    def _column(self, name):
+        return next(column for column in self.source.columns if str(column) == name)
+
+    def _reorder(self):
+        '''
+        Пересчитать порядок строк по сортировке и фильтру
+        '''
+        order = None
+        if self.source is not None:
+            if self.sorting is not None:
+                order = self.source.sort_order(self._column(self.sorting[0]), self.sorting[1])
+            if self.condition is not None:
+                keep = self.source.match(self._column(self.condition[0]), self.condition[1])
+                order = np.flatnonzero(keep) if order is None else order[keep[order]]
+        self.order = order
+        self.first = 0
+        self._render()
+
+    def sort(self, name):
+        '''
+        Сортировка по столбцу; повторный щелчок меняет направление
+        '''
+        ascending = not (self.sorting is not None and self.sorting == (name, True))
+        self.sorting = (name, ascending)
+        self._update_headings()
+        self._reorder()
+
+    def apply_filter(self):
+        condition = self.filter_entry.get().strip()
+        if self.source is None or not condition:
+            return self.reset_filter()
+        previous, self.condition = self.condition, (self.filter_column.get(), condition)
+        try:
+            self._reorder()
+        except ValueError as error:
+            self.condition = previous # порядок строк остался прежним
+            self.status['text'] = str(error)
+
+    def reset_filter(self):
+        self.condition = None
+        self.filter_entry.delete(0, tkn.END)
+        self._reorder()
+
+    # ----- Прокрутка
+
+    def _resize(self, event):
+        visible = max(1, event.height // self.row_height - 1) # без строки заголовков
+        if visible != self.visible:
+            self.visible = visible
+            self._render()
+
+    @staticmethod
+    def wheel_rows(delta):
+        '''
+        Строк прокрутки на событие колеса: delta кратно 120 в Windows, на macOS - единицы
+        '''
+        return -int(np.sign(delta))*max(1, abs(delta) // 120)
+
+    def scroll(self, rows):
+        self.first += rows
+        self._render()
+
+    def yview(self, *args):
+        '''
+        Команда полосы прокрутки: ('moveto', доля) или ('scroll', число, 'units' | 'pages')
+        '''
+        if args[0] == 'moveto':
+            self.first = int(float(args[1])*self.rows)
+        elif args[0] == 'scroll':
+            self.first += int(args[1])*(self.visible if args[2] == 'pages' else 1)
+        self._render()
+
+    @staticmethod
+    def format_value(value):
+        if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+            return ''
+        if isinstance(value, (float, np.floating)):
+            return f'{value:.6g}'
+        return str(value)
+
+    def window(self):
+        '''
+        Видимое окно: (номера строк источника, pd.DataFrame значений)
+        '''
+        self.first = max(0, min(self.first, self.rows - self.visible))
+        stop = min(self.first + self.visible, self.rows)
+        positions = np.arange(self.first, stop) if self.order is None else self.order[self.first:stop]
+        return positions, self.source.take(positions)
+
+    def _render(self):
+        self.status['text'] = '' # сообщение об ошибке фильтра снимается при любой перерисовке
+        items = self.tree.get_children()
+        if self.source is None or not self.rows:
+            self.tree.delete(*items)
+            self.scrollbar.set(0, 1)
+            if self.source is not None:
+                self.status['text'] = '0 rows'
+            return
+        positions, data = self.window()
+        columns = [data[name].to_numpy(dtype=object) for name in data.columns]
+        for number, position in enumerate(positions):
+            values = [self.format_value(column[number]) for column in columns]
+            if number < len(items):
+                self.tree.item(items[number], text=str(position), values=values)
+            else:
+                self.tree.insert('', tkn.END, text=str(position), values=values)
+        self.tree.delete(*items[len(positions):])
+        self.scrollbar.set(self.first/self.rows, (self.first + len(positions))/self.rows)
+        total = f' (filtered from {len(self.source)})' if self.rows != len(self.source) else ''
+        self.status['text'] = f'rows {self.first + 1}-{self.first + len(positions)} of {self.rows}{total}'
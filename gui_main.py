@@ -9,18 +9,25 @@ Icons from https://icon-icons.com/ru/pack/Freebie-Flat-Icons-Vol5/2313
 
 import os
 import copy
+import queue
 import tkinter as tkn
 import tkinter.ttk as ttk
 from tkinter import messagebox
 
+import numpy as np
+
 import gui_settings
 import gui_elements
+import command_executor
 
 class MainWindow(tkn.Tk):
 
     WINDOW_TITLE = 'FPGAClient'
     WINDOW_GEOMETRY = '800x480'
     WIDTH_FRAME_MAIN = 0.70
+    MONITOR_UPDATE_MS = 500 # период обновления карты при мониторинге
+    MONITOR_INTERVAL_MS = 100 # период тестирования при мониторинге по умолчанию
+    HISTORY_MIN_VALUE = 2.5 # меньшие значения истории не отображаются (кОм)
 
     def __init__(self, main_app, *args, **kwargs):
         #todo: сделать через super()
@@ -31,6 +38,7 @@ class MainWindow(tkn.Tk):
         self.screen_height = self.winfo_screenheight()
         self.screen_width = self.winfo_screenwidth()
         self.main_app = main_app # по этой ссылке доступны все методы из main
+        self.executor = command_executor.CommandExecutor(self, logger=main_app.logger) # операции с платой вне потока Tk
         self.create_menu()
         self.create_main_window()
         self.create_binders()
@@ -65,7 +73,7 @@ class MainWindow(tkn.Tk):
         Binders
         '''
         self.bind('<Escape>', self.exit_click)
-        self.bind('<t>', lambda event: self.main_app.test_matrix()) #загрузка модели клавишой space
+        self.bind('<t>', lambda event: self.test_matrix()) #тестирование матрицы клавишей t
 
     def create_main_window(self):
         '''
@@ -105,6 +113,16 @@ class MainWindow(tkn.Tk):
         tab_test_frame_button_test.grid(row=0, column=0, sticky=tkn.NW)
         gui_elements.create_alt_window(tab_test_frame_button_test,'Test matrix')
 
+        # ----- Monitoring
+        self.entry_monitor_interval = ttk.Entry(tab_test_frame_button, width=6)
+        self.entry_monitor_interval.insert(0, str(self.MONITOR_INTERVAL_MS))
+        self.entry_monitor_interval.grid(row=1, column=0, pady=(5, 0), sticky=tkn.W)
+        gui_elements.create_alt_window(self.entry_monitor_interval,'Monitoring period, ms')
+        self.button_monitor = ttk.Button(tab_test_frame_button, text='Monitor', width=8, command=self.click_button_monitor)
+        self.button_monitor.grid(row=2, column=0, sticky=tkn.W)
+        self.label_monitor = ttk.Label(tab_test_frame_button, text='')
+        self.label_monitor.grid(row=3, column=0, sticky=tkn.W)
+
         # ----- Matrix frame
         self.frame_matrix = tkn.LabelFrame(tab_test, text='Matrix map')
         self.frame_matrix.grid(row=0, column=1, padx=5, pady=5, sticky=tkn.NS)
@@ -140,9 +158,23 @@ class MainWindow(tkn.Tk):
 
 
 
-        self.button_show_history = ttk.Button(frame_program, text='Show history', command=self.click_button_show_history)
-        self.button_show_history.grid(row=4, column=0, columnspan=3)
-        self.button_show_history['state'] = 'disabled'
+        self.button_clear_history = ttk.Button(frame_program, text='Clear history', command=self.click_button_clear_history)
+        self.button_clear_history.grid(row=4, column=0, columnspan=3)
+        self.button_clear_history['state'] = 'disabled'
+
+        button_program_all = ttk.Button(frame_program, text='Program all', command=self.program_all)
+        button_program_all.grid(row=5, column=0, columnspan=3)
+        gui_elements.create_alt_window(button_program_all,'Program all cells with these parameters')
+
+        # ----- History plot
+        self.history_plot = gui_elements.HistoryPlot(tab_test, min_value=self.HISTORY_MIN_VALUE)
+        self.history_plot.grid(row=0, column=3, padx=5, pady=5, sticky=tkn.NSEW)
+
+        # ----- Queue tab
+        tab_queue = ttk.Frame(frame_main_functions)
+        frame_main_functions.add(tab_queue, text ='Queue')
+        self.command_panel = gui_elements.CommandPanel(tab_queue, self.executor)
+        self.command_panel.pack(fill=tkn.BOTH, expand=True, padx=5, pady=5)
 
         # ----- Log
         frame_bottom = tkn.Frame(self, bg='red')
@@ -165,65 +197,124 @@ class MainWindow(tkn.Tk):
         button_clearlog = ttk.Button(frame_for_log_button, text='Clear log', command=self.clear_log)
         button_clearlog.grid(row=0, column=0, sticky=tkn.W)
 
-    def click_button_show_history(self):
+    def click_button_clear_history(self):
         '''
-        Визуализация истории
+        Очистка графика историй
         '''
-        print(self.main_app.program_result_history)
-        self.main_app.plot_program_result_history()
+        self.history_plot.clear()
+        self.button_clear_history['state'] = 'disabled'
 
     def show_matrix(self):
         '''
-        Визуализация матрицы из кнопок
+        Визуализация матрицы (размер из описания кроссбара)
         '''
-        k = 1
-        self.matrix = []
-        for i in range(4):
-            self.matrix.append([])
-            for j in range(4):
-                b = tkn.Button(self.frame_matrix, text=f'{k}', width=2, height=1)
-                b.memristor_number = k
-                b.bind('<Button-1>', self.program_mem)
-                b.grid(row=i, column=j)
-                self.matrix[-1].append(b)
-                k += 1
+        geometry = self.main_app.crossbar.geometry
+        self.matrix = gui_elements.MatrixView(self.frame_matrix, geometry.rows, geometry.cols, on_click=self.program_mem)
+        self.matrix.grid(row=0, column=0)
 
-    def program_mem(self, event):
+    def read_program_parameters(self):
         '''
+        Параметры программирования из полей ввода
+        Возвращает:
+            (target_resistance, tolerance_resistance, flag_save_history, number_attempts) или None
         '''
-        #1. Получить 5 параметров
         try:
             target_resistance = int(self.entry_target.get()) #прочитать из поля Entry
             tolerance_resistance = int(self.entry_tolerance.get()) #прочитать из поля Entry
             flag_save_history = int(self.check_val.get()) #прочитать флаг
             number_attempts = int(self.combobox_attempt.get()) #прочитать значение из выпадающего списка
-            element_number = event.widget.memristor_number
-        #2. Передать их в main_app
-        except:
+        except ValueError:
             print('Неверные входные данные')
+            return None
+        return target_resistance, tolerance_resistance, flag_save_history, number_attempts
+
+    def submit(self, name, function, *args, **kwargs):
+        '''
+        Поставить операцию с платой в очередь исполнителя
+        '''
+        try:
+            return self.executor.submit(name, function, *args, **kwargs)
+        except queue.Full:
+            messagebox.showwarning('Queue', 'Too many queued operations')
+            return None
+
+    def program_mem(self, element_number):
+        '''
+        Программирование элемента element_number (от 1) по нажатию на карте матрицы
+        '''
+        #1. Получить параметры
+        parameters = self.read_program_parameters()
+        if parameters is None:
             return
-        self.main_app.program_element(target_resistance, tolerance_resistance, flag_save_history, number_attempts,
-                                      element_number)
-        #3. Обновить подпись кнопки
-        # self.main_app.program_result
-        event.widget.configure(text=int(self.main_app.program_result))
+        target_resistance, tolerance_resistance, flag_save_history, number_attempts = parameters
+
+        #2. Обновить ячейку на карте и добавить историю на график, когда команда выполнится
+        def done(command):
+            # результат этой команды, а не последней выполненной
+            program_result, history = command.result
+            self.matrix.set_value(element_number, program_result)
+            if history is not None:
+                self.history_plot.set_data(element_number, history)
+                self.button_clear_history['state'] = 'normal'
+
+        #3. Передать их в main_app через очередь
+        self.submit(f'Program №{element_number}', self.main_app.program_element, target_resistance,
+                    tolerance_resistance, flag_save_history, number_attempts, element_number, on_done=done)
+
+    def program_all(self):
+        '''
+        Программирование всех ячеек одинаковыми параметрами проходами
+        до попадания в допуск (с прогрессом и отменой)
+        '''
+        parameters = self.read_program_parameters()
+        if parameters is None:
+            return
+        target_resistance, tolerance_resistance, flag_save_history, number_attempts = parameters
+        geometry = self.main_app.crossbar.geometry
+        targets = np.full((geometry.rows, geometry.cols), float(target_resistance))
 
-        #4. Разлочить кнопку истории если стоял флаг истории
-        self.button_show_history['state'] = 'normal'
+        def done(command):
+            self.matrix.set_values(command.result.resistance.reshape(-1))
 
+        self.submit(f'Program matrix to {target_resistance} kOhm', self.main_app.program_matrix_adaptive, targets,
+                    tolerance_resistance, number_attempts, bool(flag_save_history), on_done=done, command=True)
 
     def test_matrix(self):
         '''
+        Тестирование матрицы через очередь
+        '''
+        self.submit('Test matrix', self.main_app.test_matrix,
+                    on_done=lambda command: self.write_test_results_to_buttons(command.result))
+
+    def write_test_results_to_buttons(self, test_data):
+        self.matrix.set_values(test_data)
+
+    def click_button_monitor(self):
+        '''
+        Запуск и остановка мониторинга матрицы
         '''
-        self.main_app.test_matrix()
-        self.write_test_results_to_buttons()
+        if self.main_app.drift_monitor.running:
+            self.main_app.stop_monitoring()
+            self.button_monitor.configure(text='Monitor')
+            return
+        try:
+            self.main_app.start_monitoring(float(self.entry_monitor_interval.get()))
+        except ValueError:
+            print('Неверные входные данные')
+            return
+        self.button_monitor.configure(text='Stop')
+        self.after(self.MONITOR_UPDATE_MS, self.update_monitor)
 
-    def write_test_results_to_buttons(self):
-        k = 0
-        for i in range(4):
-            for j in range(4):
-                self.matrix[i][j].configure(text=int(self.main_app.test_data[k]))
-                k+=1
+    def update_monitor(self):
+        '''
+        Обновление карты последним снимком мониторинга (с частотой GUI, а не тестирования)
+        '''
+        snapshot = self.main_app.drift_monitor.latest()
+        if snapshot is not None:
+            self.matrix.set_values(self.main_app.crossbar.conv_to_resistance(snapshot.values).reshape(-1))
+            self.label_monitor.configure(text=f'{snapshot.count} ({snapshot.rate:.1f} Hz)')
+        if self.main_app.drift_monitor.running:
+            self.after(self.MONITOR_UPDATE_MS, self.update_monitor)
 
     def temp_test(self):
         pass
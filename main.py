@@ -11,17 +11,23 @@ import sys
 import time
 import argparse
 import threading
-import matplotlib.pyplot as plt
 import numpy as np
 
-import tools
 import app_logger
+import tracing
 import fpga_client
+import crossbar
+import experiment_store
+import drift_monitor
+import program_scheduler
 from gui_main import MainWindow
 
 # настройка парсера аргументов вызова из терминала (уточнить как вызывать)
 parser = argparse.ArgumentParser()
 parser.add_argument('--mode', type=str, default='g', help='Launch Mode')
+parser.add_argument('--trace', type=str, default=None, help='Trace levels, e.g. memory=DEBUG,client=DEBUG')
+parser.add_argument('--calibration', type=str, default=None, help='Calibration file (.npz or .csv)')
+parser.add_argument('--geometry', type=str, default='4x4', help='Crossbar geometry: 4x4, 32x32, 64x64 or a JSON file')
 args = parser.parse_args()
 
 class MainApp():
@@ -36,133 +42,124 @@ class MainApp():
     PATH_SETTINGS_IP_FILE = os.path.join(PATH_SETTINGS_DIRECTORY, 'ip_list.conf')
     PATH_LOGS_DIRECTORY = os.path.join(PATH_FPGA_CLIENT, 'logs')
     PATH_LOG_FILE = app_logger.get_log_file_path(PATH_LOGS_DIRECTORY)
-
-    def plot_program_result_history(self):
-        plt.stem(np.delete(np.array(self.program_result_history), np.where(np.array(self.program_result_history) < 2.5)))
-        plt.show()
+    PATH_EXPERIMENTS_DIRECTORY = os.path.join(PATH_FPGA_CLIENT, 'experiments')
+    MAX_LOGGED_CELLS = 64 # результаты тестирования больших матриц не выводятся в лог поячеечно
 
     def test_matrix(self):
         '''
         Тестирование матрицы
+        Возвращает:
+            test_data (list) - сопротивления ячеек (кОм), нули при ошибке
         '''
         try:
             self.logger.info('Trying to test the matrix!')
-            # 1. проверить готовность ПЛИС (это значит ожидание флага готовности)
-            fpga_state_reg_addr = 0xC0000000
-            data = [5, fpga_state_reg_addr, 0x1, 10] # ждем появления в ОЗУ 0x1 в течении 10 секунд
-            self.fpga_client.send(data)
-            assert self.fpga_client.data_from_server[0]
-
-            # 2. отправить команду на проведение тестирования (это значит записать данные по адресу)
-            fifo_addr = 0xC0000010
-            data = [2, fifo_addr, 0xA1]
-            self.fpga_client.send(data)
-
-            # 3. отправить запрос на ожидание
-            flags_reg_addr = 0xC0000004
-            data = [5, flags_reg_addr, 0x1, 10]
-            self.fpga_client.send(data)
-            assert self.fpga_client.data_from_server[0]
-
-            # 4. отправить запрос на чтение результата
-            test_data_reg_addr = 0xC0000040
-            data = [3, test_data_reg_addr, 16, 4]
-            self.fpga_client.send(data)
-
-            # 5. переводим напряжения в сопротивления
-            try:
-                assert len(self.fpga_client.data_from_server) == 16
-                self.test_data = list(map(tools.conv_to_resistance, self.fpga_client.data_from_server))
-                # один канал с погрешностями, поэтому его корректируем отдельно
-                for x in range(4, 8):
-                    self.test_data[x] = tools.conv_to_resistance_second(self.fpga_client.data_from_server[x])
+            # одним пакетом: ожидание готовности, команда тестирования,
+            # ожидание результата и чтение результатов всех ячеек одним блоком
+            test_data = self.crossbar.test()
+            self.store.record_test(test_data)
+            self.store.flush()
+            # переводим напряжения в сопротивления с калибровкой каналов
+            self.test_data = list(self.crossbar.conv_to_resistance(test_data).reshape(-1))
+            if self.crossbar.geometry.cells <= self.MAX_LOGGED_CELLS:
                 for i,item in enumerate(self.test_data):
                     self.logger.info(f"Memristor №{i+1}: {round(item,2)} kOhm")
-            except AssertionError:
-                self.test_data = [0 for i in range(16)]
-                self.logger.warning(f'Data size is not correct!')
-
-        except AssertionError:
-            self.test_data = [0 for i in range(16)]
-            self.logger.warning(f'Something wrong!')
+        except crossbar.CrossbarError as error:
+            self.test_data = [0 for i in range(self.crossbar.geometry.cells)]
+            self.logger.warning(f'Something wrong! {error}')
+        return self.test_data
 
     def program_element(self,target_resistance,tolerance_resistance,flag_save_history,number_attempts,element_number):
-
-        print(target_resistance)
-        print(tolerance_resistance)
-        print(flag_save_history)
-        print(number_attempts)
-        print(element_number)
-        pass
-
-        #подготовка слова
-        '''
-        11..0 - целевое значение сопротивления, переведенное в значение АЦП;
-        23..12 - допустимое отклонение от целевого значения;
-        26..24 - максимальное количество попыток программирования;
-        27 - режим измерения “гребенки” (1 - включено, 0 - выключено);
-        31..28 - номер программируемого элемента (от 0 до 15).
-        '0b 0000 0 000 000000000000 000000000000'
-        '''
-        word = (element_number - 1) << 1
-        word = (word + flag_save_history) << 3
-        word = (word + number_attempts) << 12
-        word = (word + (tools.conv_to_voltage(target_resistance * (1 + tolerance_resistance / 100)) - tools.conv_to_voltage(target_resistance))) << 12
-        word = (word + tools.conv_to_voltage(target_resistance))
-
-        print(bin(word))
-        #1.
-
-        self.logger.info('Trying to test the matrix!')
-        # 1. проверить готовность ПЛИС (это значит ожидание флага готовности)
-        fpga_state_reg_addr = 0xC0000000
-        data = [5, fpga_state_reg_addr, 0x1, 10] # ждем появления в ОЗУ 0x1 в течении 10 секунд
-        self.fpga_client.send(data)
-        assert self.fpga_client.data_from_server[0]
-
-        #2. Мы отправляем 2 слова: идентификатор и слово данных вот так - request(4, [0xb2, data], 0xC0000010, 0)
-        fifo_addr = 0xC0000010
-        data = [4, fifo_addr, [0xb2, word], 0]
-        self.fpga_client.send(data)
-
-        #3.
-        flags_reg_addr = 0xC0000004
-        data = [5, flags_reg_addr, 0x2, 20]
-        self.fpga_client.send(data)
-        assert self.fpga_client.data_from_server[0]
-
-        #4.
-        # value finish
-        self.program_result = 0
-        prog_data_reg_addr = 0xC0000080
-        data = [1, prog_data_reg_addr]
-        self.fpga_client.send(data)
-        self.program_result = self.fpga_client.data_from_server[0]
-
-        # all history
+        '''
+        Программирование одного элемента (element_number - от 1)
+        Возвращает:
+            program_result (float) - итоговое сопротивление (кОм)
+            program_result_history (list) - история (кОм) или None
+        '''
+        self.logger.info(f'Trying to program memristor №{element_number}!')
+        # одним пакетом: ожидание готовности, команда программирования,
+        # ожидание флага завершения, чтение результата (и истории)
+        result = self.crossbar.program_cells([element_number - 1], [target_resistance], tolerance_resistance,
+                                             number_attempts, flag_save_history == 1)
+        self.store.record_program_result([element_number - 1], [target_resistance], tolerance_resistance,
+                                         number_attempts, result)
+        self.store.flush()
+        if not result.ok[0]:
+            self.logger.warning(f'Memristor №{element_number} has not been programmed!')
+
+        self.program_result = result.resistance[0]
+        history = None
         if flag_save_history == 1:
-            buff_addr = 0xC0004000
-            data_history = [3, buff_addr, 461, 4]
-            self.fpga_client.send(data_history)
-            print(self.fpga_client.data_from_server)
-
-        #5.
-        if element_number in [5, 6, 7, 8]:
-            self.program_result = tools.conv_to_resistance_second(self.program_result)
-        else:
-            self.program_result = tools.conv_to_resistance(self.program_result)
+            history = list(self.crossbar.conv_to_resistance(result.history[0], element_number - 1))
+            self.program_result_history = history
+        return self.program_result, history
 
-        if flag_save_history == 1:
-            try:
-                assert len(self.fpga_client.data_from_server) == 461
-                if element_number in [5,6,7,8]:
-                    # один канал с погрешностями, поэтому его корректируем отдельно
-                    self.program_result_history = list(map(tools.conv_to_resistance_second, self.fpga_client.data_from_server))
-                else:
-                    self.program_result_history = list(map(tools.conv_to_resistance, self.fpga_client.data_from_server))
-            except AssertionError:
-                self.program_result_history = [0 for i in range(461)]
-                self.logger.warning(f'Data size is not correct!')
+    def program_matrix(self, targets, tolerances, attempts, flag_save_history=False, command=None):
+        '''
+        Программирование всей матрицы одной задачей
+        Принимает:
+            targets (2-D array) - целевые сопротивления (кОм)
+            tolerances (array или число) - допустимое отклонение (%)
+            attempts (array или число) - максимальное количество попыток
+            flag_save_history (bool) - сохранять истории программирования
+            command (command_executor.Command) - команда исполнителя (прогресс и отмена)
+        Возвращает:
+            result (crossbar.ProgramResult)
+        '''
+        self.logger.info('Trying to program the matrix!')
+        progress = cancelled = None
+        if command is not None:
+            progress, cancelled = command.report, lambda: command.cancelled
+        result = self.crossbar.program_matrix(targets, tolerances, attempts, flag_save_history, progress, cancelled)
+        self.store.record_program_result(np.arange(self.crossbar.geometry.cells), targets, tolerances, attempts, result)
+        self.store.flush()
+        self.logger.info(f'Programmed {result.ok.sum()}/{result.ok.size} cells in {result.elapsed:.3f} s '
+                         f'({result.round_trips} round trip(s), {result.hardware_time:.3f} s on the board)')
+        if command is not None:
+            command.check_cancelled()
+        return result
+
+    def program_matrix_adaptive(self, targets, tolerance, attempts, flag_save_history=False, command=None):
+        '''
+        Программирование матрицы проходами с тестированием до попадания всех ячеек в допуск
+        Принимает:
+            targets (2-D array) - целевые сопротивления (кОм)
+            tolerance (array или число) - допустимое отклонение (%)
+            attempts (int) - количество попыток на первом проходе
+            flag_save_history (bool) - сохранять истории программирования
+            command (command_executor.Command) - команда исполнителя (прогресс и отмена)
+        Возвращает:
+            result (program_scheduler.ScheduleResult)
+        '''
+        self.logger.info('Trying to program the matrix adaptively!')
+        progress = cancelled = None
+        if command is not None:
+            progress, cancelled = command.report, lambda: command.cancelled
+        scheduler = program_scheduler.ProgramScheduler(self.crossbar, self.store, logger=self.logger)
+        result = scheduler.run(targets, tolerance, attempts, flag_save_history, progress, cancelled)
+        if command is not None:
+            command.check_cancelled()
+        return result
+
+    def mvm(self, vectors):
+        '''
+        Умножение матрицы на векторы напряжений (мВ), результат - токи строк (мкА)
+        '''
+        start = time.perf_counter()
+        currents = self.crossbar.mvm(vectors)
+        elapsed = time.perf_counter() - start
+        count = len(np.atleast_2d(currents))
+        self.logger.info(f'{count} vector(s) multiplied in {elapsed:.3f} s ({count/elapsed:.0f} vectors/s)')
+        return currents
+
+    def start_monitoring(self, interval_ms):
+        '''
+        Запустить непрерывное тестирование матрицы с периодом interval_ms
+        '''
+        self.drift_monitor.interval = interval_ms/1000
+        self.drift_monitor.start()
+
+    def stop_monitoring(self):
+        self.drift_monitor.stop()
 
     ## ОТЛАЖЕННЫЕ
     def __init__(self):
@@ -173,6 +170,11 @@ class MainApp():
         self.check_settings_files()
         self.fpga_client = fpga_client.FPGAClient()
         self.fpga_client.get_logger(self.LOGGER_NAME)
+        self.crossbar = crossbar.Crossbar(self.fpga_client, args.geometry, self.logger, args.calibration)
+        geometry = self.crossbar.geometry
+        self.store = experiment_store.ExperimentStore(
+            os.path.join(self.PATH_EXPERIMENTS_DIRECTORY, f'{geometry.rows}x{geometry.cols}'), geometry.cells)
+        self.drift_monitor = drift_monitor.DriftMonitor(self.crossbar, store=self.store, logger=self.logger)
         self.start_local_for_debug()
 
     def run(self, run_mode):
@@ -225,10 +227,12 @@ class MainApp():
             self.logger.info(f'Can\'t start the server on the localhost!')
 
     def launch_server(self):
+        server_path = os.path.join(self.PATH_FPGA_CLIENT, 'fpga_server.py')
+        server_args = f' --host localhost --library "emulator:{args.geometry}"'
         if sys.platform == "linux" or sys.platform == "linux2":
-            os.system('python3 ' + os.path.join('server','server.py'))
+            os.system('python3 ' + server_path + server_args)
         elif sys.platform == "win32":
-            os.system('py ' + os.path.join('server','server.py'))
+            os.system('py ' + server_path + server_args)
 
     def on_quitting(self):
         '''
@@ -243,9 +247,13 @@ class MainApp():
         #    print(self.fpga_client._flag_break_connection_process)
         #    pass
 
+        # мониторинг останавливается первым: его поток обращается к серверу и пишет в журнал окна
+        self.drift_monitor.stop()
+        self.gui.executor.shutdown()
         if self._flag_server_works_local:
             self.fpga_client.stop_server()
         self.fpga_client.close_connection()
+        self.store.close()
         self.gui.destroy()
 
     def create_logger(self):
@@ -256,6 +264,9 @@ class MainApp():
         self.logger = app_logger.get_logger(self.LOGGER_NAME)
         # установка файла для ведения журнала
         self.logger.addHandler(app_logger.get_file_handler(self.PATH_LOG_FILE))
+        # трассировка обмена с ПЛИС (по умолчанию выключена)
+        if args.trace:
+            tracing.configure(args.trace, app_logger.get_file_handler(self.PATH_LOG_FILE))
 
     def check_settings_files(self):
         '''
@@ -10,8 +10,13 @@ This software is aimed to help people create neural networks.
 #import toolbar_list
 import os
 import io
+import time
 import importlib
 import pandas as pd
+import csv_loader
+import dataset_cache
+import dataset_versions
+import column_profile
 
 WINDOW_NAME = 'Neural Network Wizard'
 MAXIMIZE_WINDOW = True
@@ -34,12 +39,89 @@ for toolbar in toolbars:
 class DataStorage():
 
     file_path = ''
+    csv_stats = None
+    dataset = None # версии очищаемого набора данных (dataset_versions.VersionedDataset)
+    profiler = None # профили столбцов текущей версии (column_profile.DatasetProfiler)
+    cache = dataset_cache.DatasetCache()
 
     def load_csv_pandas(self):
         self.csv_data = pd.read_csv(self.file_path)
 
-    def set_csv_data(self, new_csv_data):
-        self.csv_data = new_csv_data.copy()
+    def load_csv(self, chunk_size=csv_loader.CHUNK_SIZE, progress=None, use_cache=True):
+        '''
+        Загрузка CSV частями с уменьшением типов и статистикой столбцов
+        (см. csv_loader.py). Разобранная таблица кешируется в каталоге кеша
+        пользователя (см. dataset_cache.py), повторная загрузка идет из кеша.
+        Принимает:
+            chunk_size (int) - строк в части
+            progress - progress(доля, сообщение) после каждой части
+            use_cache (bool) - использовать кеш
+        '''
+        start = time.perf_counter()
+        data = self.cache.get(self.file_path) if use_cache else None
+        if data is not None:
+            self.csv_data = data
+            self.csv_stats = csv_loader.CsvStats().update(data)
+            self.csv_stats.cached = True
+            self.csv_stats.memory = int(data.memory_usage().sum())
+            self.csv_stats.elapsed = time.perf_counter() - start
+            self.dataset = dataset_versions.VersionedDataset(data)
+            if progress is not None:
+                progress(1.0, f'{len(data)} rows (cache)')
+            return
+        self.csv_data, self.csv_stats = csv_loader.read_csv_chunked(self.file_path, chunk_size, progress)
+        self.dataset = dataset_versions.VersionedDataset(self.csv_data)
+        if use_cache:
+            self.cache.put(self.file_path, self.csv_data)
+
+    def set_cache(self, directory=None, enabled=True):
+        '''
+        Задать каталог кеша разобранных CSV (None - каталог по умолчанию,
+        см. dataset_cache.default_directory) или выключить кеш
+        '''
+        self.cache = dataset_cache.DatasetCache(directory=directory, enabled=enabled)
+
+    def set_csv_data(self, new_csv_data, copy=True):
+        self.csv_data = new_csv_data.copy() if copy else new_csv_data
+        self.csv_stats = csv_loader.CsvStats().update(self.csv_data)
+        self.dataset = dataset_versions.VersionedDataset(self.csv_data)
+
+    def get_profile(self):
+        '''
+        Профили столбцов текущей версии набора данных (pd.DataFrame, строка на
+        столбец: dtype, count, nulls, infinite, filled, min, max, mean, std,
+        unique).
+        Первый вызов - проход по всей таблице, дальше профили обновляются
+        только по строкам, изменившимся с прошлого вызова
+        '''
+        if self.profiler is None or self.profiler.base is not self.dataset.current.base:
+            self.profiler = column_profile.DatasetProfiler(self.dataset.current)
+        return self.profiler.profile(self.dataset.current)
+
+    def get_histogram(self, column):
+        '''
+        Гистограмма столбца текущей версии (см. column_profile.ColumnProfile.histogram)
+        '''
+        self.get_profile()
+        return self.profiler.histogram(column)
+
+    def export_csv(self, file_path):
+        '''
+        Записать текущую версию набора данных в CSV (частями)
+        '''
+        self.dataset.current.to_csv(file_path)
+
+    def export_data(self):
+        '''
+        Собрать текущую версию набора данных в pd.DataFrame
+        '''
+        return self.dataset.current.materialize()
+
+    def get_csv_stats(self):
+        '''
+        Статистика столбцов загруженного CSV (pd.DataFrame)
+        '''
+        return self.csv_stats.summary()
 
     def get_csv_info(self):
         buffer = io.StringIO()
@@ -52,8 +134,9 @@ class DataStorage():
 
     def check_dataset(self, dataset):
         '''
+        Набор данных можно сохранять: есть строки и столбцы без пропусков
         '''
-        pass
+        return not dataset.empty and not dataset.isnull().values.any()
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
@@ -6,21 +6,61 @@ import time
 import logging
 import os
 
+import numpy as np
+
+import tracing
+
 class MemoryController():
 
-    def __init__(self, library_path):
+    WAIT_SPIN_TIME = 0.0005 # время непрерывного опроса при ожидании (секунды)
+    WAIT_POLL_FLOOR = 0.0001 # минимальная пауза между опросами (секунды)
+    WAIT_POLL_MIN = 0.00001 # нижняя граница poll_floor (секунды): при 0 пауза не росла бы удвоением
+    WAIT_POLL_CEILING = 0.01 # максимальная пауза между опросами (секунды)
+    ERROR_ANSWERS = (['there is no such request'], ['Error in MemoryController']) # ответы с ошибкой
+
+    def __init__(self, library_path=None, driver=None):
         '''
         При инициализации указываем путь до библиотеки
-        и устанавливаем настройки по умолчанию
+        и устанавливаем настройки по умолчанию.
+        Вместо библиотеки можно передать готовый драйвер (driver) -
+        объект с методами read_data, write_data и, если есть, read_block, write_block
+        (например, emulator.FPGAEmulator).
         '''
-        self.library_path = os.path.join(os.getcwd(), library_path) # путь до библиотеки
-        self.driver = ctypes.CDLL(self.library_path) # подключение библиотеки на C
-        self.driver.read_data.restype = ctypes.c_int
-        self.driver.read_data.argtypes = [ctypes.c_int]
-        self.driver.write_data.argtypes = [ctypes.c_int, ctypes.c_int]
         self.logger = logging.getLogger(__name__)
+        self.trace_logger = tracing.get_logger('memory') # сообщения горячих путей
+        self.trace = tracing.OpTrace() # последние операции для разбора ошибок
+        if driver is None:
+            self.library_path = os.path.join(os.getcwd(), library_path) # путь до библиотеки
+            self.driver = ctypes.CDLL(self.library_path) # подключение библиотеки на C
+            self.driver.read_data.restype = ctypes.c_int
+            self.driver.read_data.argtypes = [ctypes.c_int]
+            self.driver.write_data.argtypes = [ctypes.c_int, ctypes.c_int]
+            self._setup_block_access()
+        else:
+            self.library_path = None
+            self.driver = driver
+            self.block_access = hasattr(driver, 'read_block') and hasattr(driver, 'write_block')
         self.logger.info('MemoryController has been created!')
 
+    def _setup_block_access(self):
+        '''
+        Подключить блочные функции драйвера, если они есть в библиотеке:
+            int read_block(unsigned address, int num_elements, int shift, uint32_t *data)
+            int write_block(unsigned address, const uint32_t *data, int num_elements, int shift)
+        (отрицательный код возврата - ошибка)
+        Иначе блоки читаются и пишутся по одному слову.
+        '''
+        words = ctypes.POINTER(ctypes.c_uint32)
+        try:
+            self.driver.read_block.restype = ctypes.c_int
+            self.driver.read_block.argtypes = [ctypes.c_uint, ctypes.c_int, ctypes.c_int, words]
+            self.driver.write_block.restype = ctypes.c_int
+            self.driver.write_block.argtypes = [ctypes.c_uint, words, ctypes.c_int, ctypes.c_int]
+            self.block_access = True
+        except AttributeError:
+            self.block_access = False
+        self.logger.info('Block access is ' + ('enabled' if self.block_access else 'not supported by the driver'))
+
     def read_word(self, address):
         '''
         Прочитать слово из памяти по заданному адресу
@@ -30,7 +70,9 @@ class MemoryController():
             word (int) - слово данных
         '''
         word = self.driver.read_data(address)
-        self.logger.info('Reading ' + hex(word) + ' from ' + hex(address))
+        self.trace.record(tracing.OP_READ, address, word)
+        if self.trace_logger.isEnabledFor(logging.DEBUG):
+            self.trace_logger.debug('Reading %#x from %#x', word, address)
         return word
 
     def write_word(self, address, word):
@@ -41,7 +83,9 @@ class MemoryController():
             word (int) - слово данных
         '''
         self.driver.write_data(address, word)
-        self.logger.info('Writing ' + hex(word) + ' to ' + hex(address))
+        self.trace.record(tracing.OP_WRITE, address, word)
+        if self.trace_logger.isEnabledFor(logging.DEBUG):
+            self.trace_logger.debug('Writing %#x to %#x', word, address)
 
     def read_data(self, address, num_elements, shift):
         '''
@@ -51,43 +95,106 @@ class MemoryController():
             address (int) - адрес памяти для начала чтения
             shift (int) - шаг чтения
         Возвращает:
-            data (list) - данные из памяти
+            data (np.ndarray) - данные из памяти (uint32)
         '''
-        data = []
-        for i in range(num_elements):
-            data.append(self.read_word(address + i*shift))
+        data = np.empty(num_elements, dtype=np.uint32)
+        if self.block_access:
+            status = self.driver.read_block(address, num_elements, shift, data.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)))
+            if status < 0:
+                raise OSError(f'Driver read_block failed with {status}')
+            self.trace.record(tracing.OP_READ_BLOCK, address, num_elements)
+            self.trace_logger.debug('Reading block of %d words from %#x', num_elements, address)
+        else:
+            for i in range(num_elements):
+                data[i] = self.read_word(address + i*shift) & 0xFFFFFFFF
         return data
 
     def write_data(self, address, data, shift):
         '''
         Записать блок данных в память по заданному адресу
         Принимает:
-            data (list) - список, содержащий данные для записи
+            data (list или np.ndarray) - данные для записи
             address (int) - адрес памяти для начала записи
             shift (int) - шаг записи
         '''
-        for i,datum in enumerate(data):
-            self.write_word(address + i*shift, datum)
+        if self.block_access:
+            # отрицательные слова (c_int) переводим в беззнаковые
+            words = np.ascontiguousarray(np.asarray(data, dtype=np.int64).astype(np.uint32))
+            status = self.driver.write_block(address, words.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)), len(words), shift)
+            if status < 0:
+                raise OSError(f'Driver write_block failed with {status}')
+            self.trace.record(tracing.OP_WRITE_BLOCK, address, len(words))
+            self.trace_logger.debug('Writing block of %d words to %#x', len(words), address)
+        else:
+            for i,datum in enumerate(data):
+                self.write_word(address + i*shift, int(datum))
 
-    def wait_flag(self, address, value, timing):
+    def wait_flag(self, address, value, timing, poll_floor=None):
         '''
-        Ожидать появления значения в памяти заданное время
+        Ожидать появления значения в памяти заданное время.
+        Первые WAIT_SPIN_TIME секунд память опрашивается непрерывно,
+        затем пауза между опросами удваивается от poll_floor до WAIT_POLL_CEILING.
         Принимает:
             address (int) - адрес памяти для чтения
             value (int) - значение
-            timing (int) - время (секунды)
+            timing (float) - время (секунды)
+            poll_floor (float) - минимальная пауза между опросами (секунды, не меньше WAIT_POLL_MIN)
         Возвращает:
             ready (bool) - готовность
+            waited (float) - время ожидания (секунды)
         '''
-        self.logger.info('Waiting ' + hex(value) + ' in ' + hex(address) + ' for ' + str(timing) + 's')
+        self.trace_logger.debug('Waiting %#x in %#x for %ss', value, address, timing)
+        if poll_floor is None:
+            poll_floor = self.WAIT_POLL_FLOOR
+        poll_floor = max(poll_floor, self.WAIT_POLL_MIN)
+        pause = poll_floor
         ready = False
-        for i in range(timing):
+        start = time.perf_counter()
+        deadline = start + timing
+        while True:
             if self.read_word(address) == value:
                 ready = True
                 break
-            time.sleep(1)
-        self.logger.info('The value has been obtained!')
-        return ready
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now - start < self.WAIT_SPIN_TIME:
+                continue
+            time.sleep(min(pause, deadline - now))
+            pause = min(2*pause, max(poll_floor, self.WAIT_POLL_CEILING))
+        waited = time.perf_counter() - start
+        self.trace.record(tracing.OP_WAIT, address, int(waited*1e6))
+        if ready:
+            self.trace_logger.debug('The value has been obtained in %.6fs!', waited)
+        else:
+            self.logger.warning('Value %#x has not been obtained in %#x!', value, address)
+        return ready, waited
+
+    def execute_batch(self, ops, abort_on_failure=True):
+        '''
+        Выполнить список операций по порядку
+        Принимает:
+            ops (list) - операции в формате запросов 1-5
+            abort_on_failure (bool) - прекратить выполнение при ошибке или неудачном ожидании
+        Возвращает:
+            ok (bool) - все операции выполнены успешно
+            results (list) - ответы выполненных операций
+        '''
+        ok = True
+        results = []
+        for op in ops:
+            if op[0] == 6:
+                answer = ['there is no such request']
+            else:
+                answer = self.request(op)
+            results.append(answer)
+            failed = isinstance(answer, list) and answer in self.ERROR_ANSWERS
+            if failed or (op[0] == 5 and not answer[0]):
+                ok = False
+                if abort_on_failure:
+                    self.logger.warning('Batch aborted at operation %d of %d', len(results), len(ops))
+                    break
+        return ok, results
 
     def request(self, request):
         '''
@@ -127,15 +234,31 @@ class MemoryController():
             elif request[0] == 5:
                 '''
                 Запрос ожидания заданного значения (value) в ОЗУ по адресу (address)
-                в течении заданного времени (timing)
+                в течении заданного времени (timing, секунды, можно дробное)
+                с необязательной минимальной паузой между опросами (poll_floor).
+                Ответ: [готовность, время ожидания в секундах]
                 '''
                 address = request[1]
                 value = request[2]
                 timing = request[3]
-                answer = [self.wait_flag(address, value, timing)]
+                poll_floor = request[4] if len(request) > 4 else None
+                ready, waited = self.wait_flag(address, value, timing, poll_floor)
+                answer = [ready, waited]
+            elif request[0] == 6:
+                '''
+                Пакет операций (ops) в формате запросов 1-5, выполняемых по порядку
+                с прекращением при первой ошибке (abort_on_failure, по умолчанию True).
+                Ответ: [все операции успешны, [ответы выполненных операций]]
+                '''
+                ops = request[1]
+                abort_on_failure = request[2] if len(request) > 2 else True
+                ok, results = self.execute_batch(ops, abort_on_failure)
+                answer = [ok, results]
             else:
                 answer = ['there is no such request']
         except Exception:
+            self.logger.exception('Error in request %s', request[:1])
+            self.trace.dump(self.logger)
             answer = ['Error in MemoryController']
         return answer
 
@@ -143,14 +266,16 @@ class MemoryController():
         description = '''Класс работы с памятью. Использует бибилотеку на C.
 
 Атрибуты:
-    driver - библиотека работы с памятью на C
+    driver - библиотека работы с памятью на C (или эмулятор)
     library_path - путь до библиотеки
+    block_access - драйвер поддерживает блочное чтение и запись
 
 Методы:
     read_word(address)
     write_word(address, word)
     read_data(num_elements, address, shift)
     write_data(data, address, shift)
-    wait_flag(address, value, timing)
+    wait_flag(address, value, timing, poll_floor)
+    execute_batch(ops, abort_on_failure)
         '''
         return description
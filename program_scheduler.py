@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Adaptive closed-loop programming of many cells.
+
+Планировщик тестирует всю матрицу одним блоком и программирует ее
+проходами. Каждый проход:
+    1. ячейки вне допуска программируются пакетно (Crossbar.program_cells);
+    2. вся матрица снова тестируется одним блоком.
+Ячейки, оставшиеся вне допуска, попадают в следующий проход с большим
+числом попыток и более узким допуском в управляющем слове (плата
+останавливается ближе к цели, запас на шум чтения и дрейф). Работа
+заканчивается, когда все ячейки в допуске или исчерпан бюджет проходов.
+По каждому проходу собирается статистика сходимости.
+'''
+
+import time
+import logging
+
+import numpy as np
+
+MAX_PASSES = 6 # максимальное число проходов
+ATTEMPTS_STEP = 2 # прибавка попыток на каждом следующем проходе
+TOLERANCE_FACTOR = 0.7 # сужение допуска в слове на каждом следующем проходе
+MIN_WORD_TOLERANCE = 0.5 # минимальный допуск в слове (%)
+
+
+class PassStats():
+    '''
+    Статистика прохода
+    Атрибуты:
+        number (int) - номер прохода (от 1)
+        programmed (int) - число программируемых ячеек
+        attempts, word_tolerance - параметры слова прохода
+        in_tolerance (int) - число ячеек в допуске после прохода
+        mean_error, max_error (float) - средняя и максимальная ошибка по матрице (%)
+        elapsed (float) - время прохода (секунды)
+        round_trips (int) - число обменов с сервером
+    '''
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return (f'Pass {self.number}: {self.programmed} cells programmed, {self.in_tolerance} in tolerance, '
+                f'error mean {self.mean_error:.2f}% max {self.max_error:.2f}%, {self.elapsed:.2f} s')
+
+
+class ScheduleResult():
+    '''
+    Результат планировщика
+    Атрибуты:
+        resistance (np.ndarray) - итоговые сопротивления (кОм)
+        error (np.ndarray) - итоговая относительная ошибка (%)
+        converged (np.ndarray) - ячейка в допуске
+        programmings (np.ndarray) - число программирований ячейки
+        attempts (np.ndarray) - суммарное число попыток платы по ячейке
+        passes (list) - статистика проходов (PassStats)
+        cancelled (bool) - работа прервана
+        elapsed (float) - полное время (секунды)
+    '''
+
+    def __init__(self, shape):
+        self.resistance = np.zeros(shape, dtype=np.float64)
+        self.error = np.zeros(shape, dtype=np.float64)
+        self.converged = np.zeros(shape, dtype=bool)
+        self.programmings = np.zeros(shape, dtype=np.int64)
+        self.attempts = np.zeros(shape, dtype=np.int64)
+        self.passes = []
+        self.cancelled = False
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (f'ScheduleResult({self.converged.sum()}/{self.converged.size} cells converged, '
+                f'{len(self.passes)} pass(es), {self.elapsed:.2f}s)')
+
+
+class ProgramScheduler():
+    '''
+    Программирование матрицы с обратной связью по тестированию
+    '''
+
+    def __init__(self, crossbar, store=None, max_passes=MAX_PASSES, logger=None):
+        '''
+        Принимает:
+            crossbar (Crossbar) - кроссбар
+            store (ExperimentStore) - хранилище для записи программирований и тестов или None
+            max_passes (int) - бюджет проходов
+            logger (logging.Logger) - логгер
+        '''
+        self.crossbar = crossbar
+        self.store = store
+        self.max_passes = max_passes
+        self.logger = logger or logging.getLogger(__name__)
+
+    def measure(self, targets):
+        '''
+        Тестирование матрицы
+        Возвращает:
+            resistance, error (np.ndarray) - сопротивления (кОм) и относительная ошибка (%);
+                ячейки с целью 0 не используются, их ошибка - 0
+        '''
+        values = self.crossbar.test()
+        if self.store is not None:
+            self.store.record_test(values)
+        resistance = self.crossbar.conv_to_resistance(values)
+        targets = np.broadcast_to(targets, resistance.shape)
+        error = np.divide(100*np.abs(resistance - targets), targets, out=np.zeros(resistance.shape),
+                          where=targets != 0)
+        return resistance, error
+
+    def run(self, targets, tolerance, attempts=3, save_history=False, progress=None, cancelled=None):
+        '''
+        Запрограммировать матрицу до попадания всех ячеек в допуск
+        Принимает:
+            targets (2-D array) - целевые сопротивления (кОм), rows x cols; 0 - ячейка не программируется
+            tolerance (float или array) - допустимое отклонение (%)
+            attempts (int) - число попыток в слове на первом проходе
+            save_history (bool) - сохранять истории программирования
+            progress - progress(доля, сообщение) после каждого прохода
+            cancelled - cancelled() -> True, если работу нужно прервать
+        Возвращает:
+            result (ScheduleResult)
+        '''
+        start = time.perf_counter()
+        geometry = self.crossbar.geometry
+        targets = np.asarray(targets, dtype=np.float64)
+        shape = (geometry.rows, geometry.cols)
+        if targets.shape != shape:
+            raise ValueError(f'Targets must be {shape[0]}x{shape[1]}, got {targets.shape}')
+        tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.float64), shape)
+        max_attempts = geometry.word_format.limit('attempts')
+        result = ScheduleResult(shape)
+
+        resistance, error = self.measure(targets)
+        word_tolerance = tolerance.copy()
+        for number in range(1, self.max_passes + 1):
+            pending = np.flatnonzero((error > tolerance).reshape(-1))
+            if not len(pending):
+                break
+            if cancelled is not None and cancelled():
+                result.cancelled = True
+                break
+            pass_start = time.perf_counter()
+            pass_attempts = min(attempts + ATTEMPTS_STEP*(number - 1), max_attempts)
+            pending_tolerance = word_tolerance.reshape(-1)[pending]
+            programmed = self.crossbar.program_cells(pending, targets.reshape(-1)[pending], pending_tolerance,
+                                                     pass_attempts, save_history, cancelled=cancelled)
+            if self.store is not None:
+                self.store.record_program_result(pending, targets.reshape(-1)[pending], pending_tolerance,
+                                                 pass_attempts, programmed)
+            result.programmings.reshape(-1)[pending] += programmed.done
+            result.attempts.reshape(-1)[pending] += programmed.attempts
+
+            resistance, error = self.measure(targets)
+            # ячейки, не попавшие в допуск, программируются с более узким допуском в слове
+            missed = error > tolerance
+            word_tolerance = np.where(missed, np.maximum(word_tolerance*TOLERANCE_FACTOR, MIN_WORD_TOLERANCE),
+                                      word_tolerance)
+            stats = PassStats(number=number, programmed=len(pending), attempts=pass_attempts,
+                              word_tolerance=float(pending_tolerance.mean()),
+                              in_tolerance=int((~missed).sum()), mean_error=float(error.mean()),
+                              max_error=float(error.max()), elapsed=time.perf_counter() - pass_start,
+                              round_trips=programmed.round_trips + 1)
+            result.passes.append(stats)
+            self.logger.info(str(stats))
+            if progress is not None:
+                progress(number/self.max_passes, f'pass {number}: {stats.in_tolerance}/{error.size} in tolerance')
+            if programmed.cancelled:
+                result.cancelled = True
+                break
+
+        if self.store is not None:
+            self.store.flush()
+        result.resistance[...] = resistance
+        result.error[...] = error
+        result.converged[...] = error <= tolerance
+        result.elapsed = time.perf_counter() - start
+        self.logger.info(f'Matrix programming has finished: {result}')
+        return result
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Wire protocol between FPGAClient and the server.
+
+Каждое сообщение (запрос или ответ) передается кадром:
+    заголовок - длина тела и идентификатор запроса (по 4 байта, network order);
+    тело - компактная бинарная запись списка.
+
+Ответ несет идентификатор своего запроса, поэтому клиент может отправить
+несколько запросов подряд, не дожидаясь ответов, и сопоставить ответы по
+идентификатору. Сервер обрабатывает запросы одного соединения по порядку.
+
+Тело состоит из элементов вида <тег><данные>:
+    b'n' - None;
+    b'b' - bool (1 байт);
+    b'i' - целое со знаком (8 байт);
+    b'f' - вещественное (8 байт);
+    b's' - строка utf-8 (длина 4 байта + байты);
+    b'W' - массив беззнаковых 32-битных слов (число слов 4 байта + слова little-endian);
+    b'V' - массив 32-битных слов со знаком (так же как b'W');
+    b'l' - вложенный список (число элементов 4 байта + элементы).
+
+Списки из целых, укладывающихся в 32 бита, кодируются массивом слов,
+поэтому блок из десятков тысяч слов передается одним кадром без pickle.
+'''
+
+import sys
+import struct
+from array import array
+
+HEADER = struct.Struct('!II') # заголовок кадра: длина тела, идентификатор запроса
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024 # максимальный размер тела кадра
+RECEIVE_BUFFER_SIZE = 64 * 1024 # начальный размер приемного буфера
+
+_COUNT = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_BOOL = struct.Struct('<?')
+
+_TAG_NONE = ord('n')
+_TAG_BOOL = ord('b')
+_TAG_INT = ord('i')
+_TAG_FLOAT = ord('f')
+_TAG_STR = ord('s')
+_TAG_UWORDS = ord('W')
+_TAG_SWORDS = ord('V')
+_TAG_LIST = ord('l')
+
+_WORD_MAX = 0xFFFFFFFF
+_SWORD_MIN = -0x80000000
+_SWORD_MAX = 0x7FFFFFFF
+_NEED_BYTESWAP = sys.byteorder != 'little'
+
+
+class ProtocolError(Exception):
+    '''
+    Ошибка разбора или формирования кадра
+    '''
+
+
+def _as_words(items):
+    '''
+    Попробовать представить список целых массивом 32-битных слов
+    (все элементы - int, не bool, иначе список кодируется поэлементно)
+    Возвращает:
+        words (array) - массив 'I' или 'i', либо None, если список не является массивом слов
+    '''
+    if not items or set(map(type, items)) != {int}:
+        return None
+    for typecode in ('I', 'i'):
+        try:
+            return array(typecode, items)
+        except OverflowError:
+            continue
+        except TypeError:
+            return None
+    return None
+
+
+def _encode_words(out, tag, words):
+    out.append(tag)
+    out += _COUNT.pack(len(words))
+    if _NEED_BYTESWAP:
+        words = array(words.typecode, words)
+        words.byteswap()
+    out += words.tobytes()
+
+
+def _encode_item(out, item):
+    if item is None:
+        out.append(_TAG_NONE)
+    elif type(item) is bool:
+        out.append(_TAG_BOOL)
+        out += _BOOL.pack(item)
+    elif isinstance(item, int):
+        try:
+            packed = _INT.pack(item)
+        except struct.error:
+            raise ProtocolError(f'Integer {item} does not fit into 64 bits') from None
+        out.append(_TAG_INT)
+        out += packed
+    elif isinstance(item, float):
+        out.append(_TAG_FLOAT)
+        out += _FLOAT.pack(item)
+    elif isinstance(item, str):
+        raw = item.encode('utf-8')
+        out.append(_TAG_STR)
+        out += _COUNT.pack(len(raw))
+        out += raw
+    elif isinstance(item, array) and item.typecode in ('I', 'i'):
+        _encode_words(out, _TAG_UWORDS if item.typecode == 'I' else _TAG_SWORDS, item)
+    elif hasattr(item, 'dtype') and getattr(item, 'ndim', 0) == 0:
+        # скаляр NumPy
+        _encode_item(out, item.item())
+    elif hasattr(item, 'dtype') and hasattr(item, 'tobytes'):
+        # массивы NumPy передаются как есть, без создания объектов Python на каждое слово
+        signed = item.dtype.kind == 'i'
+        words = item.astype('<i4' if signed else '<u4', copy=False).ravel()
+        out.append(_TAG_SWORDS if signed else _TAG_UWORDS)
+        out += _COUNT.pack(len(words))
+        out += words.tobytes()
+    elif isinstance(item, (list, tuple)):
+        words = _as_words(item)
+        if words is not None:
+            _encode_words(out, _TAG_UWORDS if words.typecode == 'I' else _TAG_SWORDS, words)
+        else:
+            out.append(_TAG_LIST)
+            out += _COUNT.pack(len(item))
+            for element in item:
+                _encode_item(out, element)
+    else:
+        raise ProtocolError(f'Unsupported type {type(item).__name__}')
+
+
+def encode(message):
+    '''
+    Закодировать сообщение в тело кадра
+    Принимает:
+        message (list, tuple, array или np.ndarray) - запрос или ответ
+    Возвращает:
+        body (bytearray) - тело кадра
+    '''
+    out = bytearray()
+    _encode_item(out, message)
+    return out
+
+
+def _decode_item(body, offset):
+    tag = body[offset]
+    offset += 1
+    if tag == _TAG_NONE:
+        return None, offset
+    if tag == _TAG_BOOL:
+        return _BOOL.unpack_from(body, offset)[0], offset + _BOOL.size
+    if tag == _TAG_INT:
+        return _INT.unpack_from(body, offset)[0], offset + _INT.size
+    if tag == _TAG_FLOAT:
+        return _FLOAT.unpack_from(body, offset)[0], offset + _FLOAT.size
+    (count,) = _COUNT.unpack_from(body, offset)
+    offset += _COUNT.size
+    if tag == _TAG_STR:
+        return bytes(body[offset:offset+count]).decode('utf-8'), offset + count
+    if tag in (_TAG_UWORDS, _TAG_SWORDS):
+        words = array('I' if tag == _TAG_UWORDS else 'i')
+        end = offset + 4*count
+        if end > len(body):
+            raise ProtocolError('Words array is out of the frame')
+        words.frombytes(body[offset:end])
+        if _NEED_BYTESWAP:
+            words.byteswap()
+        return words.tolist(), end
+    if tag == _TAG_LIST:
+        items = []
+        for i in range(count):
+            item, offset = _decode_item(body, offset)
+            items.append(item)
+        return items, offset
+    raise ProtocolError(f'Unknown tag {tag}')
+
+
+def decode(body):
+    '''
+    Раскодировать тело кадра
+    Принимает:
+        body (bytes-like) - тело кадра
+    Возвращает:
+        message (list) - запрос или ответ
+    '''
+    try:
+        message, offset = _decode_item(body, 0)
+    except (IndexError, struct.error) as error:
+        raise ProtocolError('Frame is truncated') from error
+    if offset != len(body):
+        raise ProtocolError('Extra bytes in the frame')
+    return message
+
+
+def encode_frame(message, request_id=0):
+    '''
+    Сформировать кадр целиком
+    Принимает:
+        message (list) - запрос или ответ
+        request_id (int) - идентификатор запроса
+    Возвращает:
+        frame (bytearray) - заголовок и тело
+    '''
+    body = encode(message)
+    if len(body) > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f'Message is too big ({len(body)} bytes)')
+    return HEADER.pack(len(body), request_id) + body
+
+
+def send_message(sock, message, request_id=0):
+    '''
+    Отправить сообщение одним кадром
+    '''
+    sock.sendall(encode_frame(message, request_id))
+
+
+class MessageReader():
+    '''
+    Чтение кадров из сокета в переиспользуемый буфер.
+    Сокет читается через recv_into сколько есть данных,
+    поэтому несколько коротких кадров подряд разбираются за один системный вызов.
+    '''
+
+    def __init__(self, sock, buffer_size=RECEIVE_BUFFER_SIZE):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self._start = 0 # начало непрочитанных данных
+        self._end = 0 # конец принятых данных
+
+    def _fill(self, size):
+        '''
+        Дочитать из сокета, пока в буфере не окажется size байт
+        Возвращает:
+            view (memoryview) - представление на size непрочитанных байт
+        '''
+        if self._start + size > len(self.buffer):
+            # сдвигаем остаток в начало буфера (или расширяем буфер)
+            pending = self._end - self._start
+            if size > len(self.buffer):
+                buffer = bytearray(max(size, 2*len(self.buffer)))
+            else:
+                buffer = self.buffer
+            buffer[:pending] = self.buffer[self._start:self._end]
+            self.buffer = buffer
+            self._start = 0
+            self._end = pending
+        view = memoryview(self.buffer)
+        while self._end - self._start < size:
+            count = self.sock.recv_into(view[self._end:])
+            if not count:
+                raise BrokenPipeError
+            self._end += count
+        return view[self._start:self._start+size]
+
+    def read_message(self):
+        '''
+        Прочитать одно сообщение
+        Возвращает:
+            request_id (int) - идентификатор запроса
+            message (list) - раскодированное сообщение
+        '''
+        size, request_id = HEADER.unpack(self._fill(HEADER.size))
+        if size > MAX_MESSAGE_SIZE:
+            raise ProtocolError(f'Frame is too big ({size} bytes)')
+        self._start += HEADER.size
+        body = self._fill(size)
+        self._start += size
+        return request_id, decode(body)
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Tests of fpga_server with the board emulator as the driver.
+
+Сервер запускается на свободном порту (port=0) в цикле событий теста,
+клиенты - соединения asyncio, обменивающиеся кадрами protocol:
+    python3 -m pytest -q tests
+'''
+
+import os
+import sys
+import asyncio
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import emulator
+import protocol
+import fpga_server
+
+HOST = '127.0.0.1'
+TIMEOUT = 5 # ожидание ответа сервера в тестах (секунды)
+BUSY_TIME = 0.3 # время, на которое запрос ожидания занимает плату (секунды)
+
+
+class Connection():
+    '''
+    Соединение тестового клиента с сервером
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.request_id = 0
+
+    @classmethod
+    async def open(cls, port):
+        return cls(*await asyncio.open_connection(HOST, port))
+
+    async def submit(self, message):
+        self.request_id += 1
+        self.writer.write(protocol.encode_frame(message, self.request_id))
+        await self.writer.drain()
+        return self.request_id
+
+    async def receive(self):
+        header = await asyncio.wait_for(self.reader.readexactly(protocol.HEADER.size), TIMEOUT)
+        size, request_id = protocol.HEADER.unpack(header)
+        return request_id, protocol.decode(await self.reader.readexactly(size))
+
+    async def request(self, message):
+        request_id = await self.submit(message)
+        answer_id, answer = await self.receive()
+        assert answer_id == request_id
+        return answer
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class ServerTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = fpga_server.FPGAServer(HOST, 0)
+        self.task = asyncio.get_running_loop().create_task(self.server.serve())
+        while not self.server.port:
+            await asyncio.sleep(0.01)
+        self.connections = []
+
+    async def asyncTearDown(self):
+        for connection in self.connections:
+            connection.writer.close()
+        self.server.stop()
+        await asyncio.wait_for(self.task, TIMEOUT)
+
+    async def connect(self, create=True):
+        connection = await Connection.open(self.server.port)
+        self.connections.append(connection)
+        if create:
+            self.assertEqual(await connection.request([252, 'emulator']), [True])
+        return connection
+
+    def busy(self, connection):
+        '''
+        Занять плату запросом ожидания значения, которое не появится
+        '''
+        return connection.submit([5, emulator.PROG_RESULT_REG, 0xDEAD, BUSY_TIME])
+
+
+class TestRequests(ServerTestCase):
+
+    async def test_read_write(self):
+        client = await self.connect()
+        self.assertEqual(await client.request([2, emulator.PROG_RESULT_REG, 0x5A]), [0x5A])
+        self.assertEqual(await client.request([1, emulator.PROG_RESULT_REG]), [0x5A])
+
+    async def test_blocks(self):
+        client = await self.connect()
+        words = [1, 2, 3, 0xFFFF]
+        self.assertEqual(list(await client.request([4, emulator.TEST_DATA_ADDR, words, 4])), words)
+        self.assertEqual(list(await client.request([3, emulator.TEST_DATA_ADDR, len(words), 4])), words)
+
+    async def test_wait(self):
+        client = await self.connect()
+        await client.request([2, emulator.PROG_RESULT_REG, 7])
+        ready, waited = await client.request([5, emulator.PROG_RESULT_REG, 7, 1.0])
+        self.assertTrue(ready)
+        ready, waited = await client.request([5, emulator.PROG_RESULT_REG, 8, 0.05])
+        self.assertFalse(ready)
+        self.assertGreaterEqual(waited, 0.05)
+
+    async def test_unknown_request(self):
+        client = await self.connect()
+        self.assertEqual(await client.request([99]), ['there is no such request'])
+
+    async def test_no_controller(self):
+        client = await self.connect(create=False)
+        self.assertEqual(await client.request([1, emulator.PROG_RESULT_REG]), ['Memory controller is not created'])
+
+
+class TestPriority(ServerTestCase):
+
+    async def test_higher_priority_first(self):
+        owner = await self.connect()
+        low = await self.connect()
+        high = await self.connect()
+        self.assertEqual(await low.request([251, 5]), [True])
+        self.assertEqual(await high.request([251, 0]), [True])
+        await self.busy(owner)
+        await asyncio.sleep(0.05) # ожидание уже выполняется, остальные запросы - в очереди
+        order = []
+
+        async def read(connection, name):
+            await connection.request([1, emulator.PROG_RESULT_REG])
+            order.append(name)
+
+        first = asyncio.get_running_loop().create_task(read(low, 'low'))
+        await asyncio.sleep(0.05) # запрос low попадает в очередь раньше
+        await read(high, 'high')
+        await first
+        self.assertEqual(order, ['high', 'low'])
+        await owner.receive()
+
+    async def test_round_robin(self):
+        owner = await self.connect()
+        first = await self.connect()
+        second = await self.connect()
+        await self.busy(owner)
+        await asyncio.sleep(0.05)
+        for connection in (first, second):
+            for i in range(2):
+                await connection.submit([1, emulator.PROG_RESULT_REG])
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.server.board.report()[0], 4)
+        order = []
+
+        async def receive(connection, name):
+            for i in range(2):
+                await connection.receive()
+                order.append(name)
+
+        await asyncio.gather(receive(first, 'first'), receive(second, 'second'))
+        self.assertEqual(order, ['first', 'second', 'first', 'second'])
+        await owner.receive()
+
+
+class TestMalformedRequests(ServerTestCase):
+
+    async def test_bad_service_requests(self):
+        client = await self.connect(create=False)
+        for request in ([251], [251, 'x'], [251, -100], [251, 1.5], [251, True], [251, 1, 2],
+                        [252], [252, 5], 7, [], 'text'):
+            with self.subTest(request=request):
+                self.assertEqual(await client.request(request), [fpga_server.ERROR_REQUEST])
+        self.assertEqual(await client.request([254]), [True]) # соединение сохранилось
+
+    async def test_bad_geometry(self):
+        client = await self.connect(create=False)
+        for library in ('emulator:no-such-geometry', 'no-such-library.so'):
+            with self.subTest(library=library):
+                self.assertEqual(await client.request([252, library]), ['Error in MemoryController'])
+        self.assertEqual(await client.request([252, 'emulator']), [True])
+
+    async def test_bad_frame(self):
+        client = await self.connect(create=False)
+        client.writer.write(protocol.HEADER.pack(1, 1) + b'?')
+        await client.writer.drain()
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await client.receive()
+        other = await self.connect(create=False)
+        self.assertEqual(await other.request([254]), [True])
+
+
+class TestCleanup(ServerTestCase):
+
+    async def test_disconnect_drops_queued_requests(self):
+        owner = await self.connect()
+        client = await self.connect()
+        await self.busy(owner)
+        await asyncio.sleep(0.05)
+        for i in range(5):
+            await client.submit([1, emulator.PROG_RESULT_REG])
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.server.board.queue), 5)
+        await client.close()
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.server.board.queue), 0)
+        self.assertEqual(len(self.server._handlers), 1)
+        await owner.receive()
+        self.assertEqual(await owner.request([254]), [True])
+
+    async def test_stop(self):
+        owner = await self.connect()
+        other = await self.connect()
+        board = self.server.board
+        self.assertEqual(await owner.request([255]), [True])
+        await asyncio.wait_for(self.task, TIMEOUT)
+        self.assertEqual(self.server._handlers, {})
+        self.assertIsNone(board.emulator._thread)
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await other.receive()
+        with self.assertRaises(OSError):
+            await Connection.open(self.server.port)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+
+'''
+Low-overhead tracing of FPGA operations.
+
+Горячие пути (MemoryController, FPGAClient) пишут сообщения в логгеры
+подсистем 'trace.<подсистема>' с ленивыми %-аргументами на уровне DEBUG.
+По умолчанию эти логгеры выключены (уровень WARNING), поэтому в работе
+форматирование строк не выполняется. Уровни задаются по подсистемам:
+    tracing.configure('memory=DEBUG,client=INFO')
+или переменной окружения NNW_TRACE с тем же содержимым. Неизвестный
+уровень (опечатка в NNW_TRACE) не мешает запуску: трассировка подсистемы
+остается выключенной ('off'), в журнал выводится предупреждение.
+
+Если хотя бы одна подсистема трассируется (уровень DEBUG), каждая
+операция записывается в кольцевой буфер OpTrace (последние N операций),
+который выводится в журнал при ошибке, и, по желанию, в двоичный файл
+трассировки. При выключенной трассировке OpTrace.record сразу возвращается.
+'''
+
+import os
+import time
+import struct
+import logging
+import collections
+
+TRACE_LOGGER_NAME = 'trace' # корневой логгер трассировки
+TRACE_ENV = 'NNW_TRACE' # переменная окружения с уровнями подсистем
+DEFAULT_LEVEL = logging.WARNING # уровень трассировки по умолчанию
+LEVEL_OFF = 'OFF' # уровень выключенной трассировки (DEFAULT_LEVEL)
+RING_SIZE = 256 # число последних операций в кольцевом буфере
+
+# коды операций совпадают с кодами запросов MemoryController.request
+OP_READ = 1
+OP_WRITE = 2
+OP_READ_BLOCK = 3
+OP_WRITE_BLOCK = 4
+OP_WAIT = 5
+OP_NAMES = {OP_READ: 'read', OP_WRITE: 'write', OP_READ_BLOCK: 'read block',
+            OP_WRITE_BLOCK: 'write block', OP_WAIT: 'wait'}
+
+# запись двоичного файла трассировки: время, код операции, адрес, значение
+RECORD = struct.Struct('<dBIq')
+
+_root = logging.getLogger(TRACE_LOGGER_NAME)
+if _root.level == logging.NOTSET:
+    _root.setLevel(DEFAULT_LEVEL)
+_logger = logging.getLogger(__name__)
+_configured = {_root} # логгеры, уровни которых задавались configure
+_enabled = False # трассируется хотя бы одна подсистема (OpTrace.record пишет операции)
+
+
+def get_logger(subsystem):
+    '''
+    Логгер трассировки подсистемы ('memory', 'client', ...)
+    '''
+    return logging.getLogger(f'{TRACE_LOGGER_NAME}.{subsystem}')
+
+
+def configure(spec=None, handler=None):
+    '''
+    Задать уровни трассировки подсистем
+    Принимает:
+        spec (str) - строка вида 'memory=DEBUG,client=INFO' (по умолчанию из NNW_TRACE);
+                     имя без подсистемы задает общий уровень: 'DEBUG';
+                     'off' и неизвестные уровни выключают трассировку подсистемы
+        handler (logging.Handler) - обработчик для вывода трассировки
+    '''
+    global _enabled
+    if spec is None:
+        spec = os.environ.get(TRACE_ENV, '')
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        subsystem, _, level = item.rpartition('=')
+        subsystem, level = subsystem.strip(), level.strip().upper()
+        logger = get_logger(subsystem) if subsystem else _root
+        if level == LEVEL_OFF:
+            level = DEFAULT_LEVEL
+        elif not isinstance(logging.getLevelName(level), int):
+            _logger.warning('Unknown trace level %r in %r, tracing of %s is off', level, spec,
+                            subsystem or 'all subsystems')
+            level = DEFAULT_LEVEL
+        logger.setLevel(level)
+        _configured.add(logger)
+    _enabled = any(logger.isEnabledFor(logging.DEBUG) for logger in _configured)
+    if handler is not None:
+        _root.addHandler(handler)
+
+
+class OpTrace():
+    '''
+    Кольцевой буфер последних операций с необязательной записью в двоичный файл
+    '''
+
+    def __init__(self, size=RING_SIZE, sample_every=1):
+        '''
+        Принимает:
+            size (int) - число хранимых операций
+            sample_every (int) - записывать каждую sample_every-ю операцию
+        '''
+        self.ring = collections.deque(maxlen=size)
+        self.sample_every = sample_every
+        self._count = 0
+        self._file = None
+
+    def record(self, op, address=0, value=0):
+        '''
+        Записать операцию (при выключенной трассировке - только в открытый файл)
+        '''
+        if not _enabled and self._file is None:
+            return
+        self._count += 1
+        if self.sample_every > 1 and self._count % self.sample_every:
+            return
+        item = (time.time(), op, address, value)
+        self.ring.append(item)
+        if self._file is not None:
+            self._file.write(RECORD.pack(item[0], op, address & 0xFFFFFFFF, int(value)))
+
+    def open_file(self, path):
+        '''
+        Начать запись операций в двоичный файл трассировки
+        '''
+        self.close_file()
+        self._file = open(path, 'ab')
+
+    def close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def dump(self, logger, level=logging.WARNING):
+        '''
+        Вывести последние операции в журнал
+        '''
+        if not self.ring or not logger.isEnabledFor(level):
+            return
+        logger.log(level, 'Last %d operations:', len(self.ring))
+        for timestamp, op, address, value in self.ring:
+            logger.log(level, '    %.6f %s %#x %s', timestamp, OP_NAMES.get(op, op), address, value)
+
+
+def read_trace_file(path):
+    '''
+    Прочитать двоичный файл трассировки
+    Возвращает:
+        records (list) - список (время, код операции, адрес, значение)
+    '''
+    with open(path, 'rb') as trace_file:
+        raw = trace_file.read()
+    raw = raw[:len(raw) - len(raw) % RECORD.size]
+    return list(RECORD.iter_unpack(raw))
+
+
+configure()